@@ -1 +1,9 @@
-from gixi.client import main
+__all__ = ['main']
+
+
+def __getattr__(name: str):
+    # the client imports PyQt5, the server processes should not pay for it
+    if name == 'main':
+        from gixi.client import main
+        return main
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -16,6 +16,13 @@ def generate_sh_str(config: AppConfig) -> str:
     else:
         constraint = ''
 
+    if config.cluster_config.nodes > 1:
+        # one server instance per node, the instances split the images between each other
+        launcher = f'srun --nodes={config.cluster_config.nodes} --ntasks={config.cluster_config.nodes} ' \
+                   f'--ntasks-per-node=1 '
+    else:
+        launcher = ''
+
     python_args = str(config.job_config.config_path)
     return f'''#!/bin/bash
 {partition}
@@ -29,7 +36,7 @@ def generate_sh_str(config: AppConfig) -> str:
 
 cd {str(PROGRAM_PATH)}
 export DATA_DIR={config.job_config.data_dir}
-python -m gixi.server {python_args}
+{launcher}python -m gixi.server {python_args}
 '''
 
 
@@ -1,16 +1,30 @@
-from gixi.server.models_collection import get_basic_model
-from gixi.server.img_processing import *
-from gixi.server.log_config import set_log_config
-from gixi.server.app_config import (
-    AppConfig,
-    ParallelConfig,
-    GeneralConfig,
-    JobConfig,
-    ClusterConfig,
-    ProgramPathsConfig,
-    PostProcessingConfig,
-    PolarConversionConfig,
-    SaveConfig,
-)
-from gixi.server.config import Config
-from gixi.server.run import run, run_server
+from gixi.server.lazy_imports import lazy_exports
+
+# heavy modules (torch, cv2, xrayutilities) are imported on the first access to the exported names
+_EXPORTS = {
+    'get_basic_model': 'gixi.server.models_collection',
+    'normalize': 'gixi.server.img_processing',
+    'with_probability': 'gixi.server.img_processing',
+    'torch_he': 'gixi.server.img_processing',
+    'AngleLimits': 'gixi.server.img_processing',
+    'ContrastCorrection': 'gixi.server.img_processing',
+    'QInterpolation': 'gixi.server.img_processing',
+    'PolarInterpolation': 'gixi.server.img_processing',
+    'set_log_config': 'gixi.server.log_config',
+    'AppConfig': 'gixi.server.app_config',
+    'ParallelConfig': 'gixi.server.app_config',
+    'GeneralConfig': 'gixi.server.app_config',
+    'JobConfig': 'gixi.server.app_config',
+    'ClusterConfig': 'gixi.server.app_config',
+    'ProgramPathsConfig': 'gixi.server.app_config',
+    'PostProcessingConfig': 'gixi.server.app_config',
+    'PolarConversionConfig': 'gixi.server.app_config',
+    'SaveConfig': 'gixi.server.app_config',
+    'Config': 'gixi.server.config',
+    'run': 'gixi.server.run',
+    'run_server': 'gixi.server.run',
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
@@ -1,4 +1,4 @@
-from gixi.server import run
+from gixi.server.run import run
 
 
 if __name__ == '__main__':
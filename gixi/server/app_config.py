@@ -11,11 +11,6 @@ SERVER_LOGS_PATH = PROGRAM_PATH / 'server_logs'
 TIME_RECORDS_PATH: Path = PROGRAM_PATH / 'time_records'
 CIF_PATH: Path = PROGRAM_PATH / 'cif_files'
 
-# Yes, it does create folders on import.
-SERVER_LOGS_PATH.mkdir(exist_ok=True)
-TIME_RECORDS_PATH.mkdir(exist_ok=True)
-CIF_PATH.mkdir(exist_ok=True)
-
 
 class ContrastConfig(Config):
     limit: float = 2000
@@ -122,6 +117,8 @@ class PolarConversionConfig(Config):
 
 class LogConfig(Config):
     record_time: bool = True
+    record_spans: bool = False
+    status_interval: float = 5.
     debug: bool = False
     log_to_file: bool = False
 
@@ -129,6 +126,8 @@ class LogConfig(Config):
 
     PARAM_DESCRIPTIONS = dict(
         record_time='Record time used for each process on the cluster',
+        record_spans='Stream every time record of each process to h5 files (requires record_time)',
+        status_interval='Interval (s) of rewriting the json status file in the output folder, 0 to disable',
         debug='Turn on logs for debugging',
     )
 
@@ -145,12 +144,30 @@ class LogConfig(Config):
 class ParallelConfig(Config):
     parallel_computation: bool = False
     max_batch: int = 64
+    max_batch_wait: float = 0.02
+    bucket_by_size: bool = False
+    inference_workers: int = 1
+    inference_threads: int = 0
+    pin_cores: bool = False
+    numa_aware: bool = False
+    matching_workers: int = 0
+    start_method: str = 'fork'
+    share_grids: bool = True
 
     CONF_NAME = 'Multithreading'
 
     PARAM_DESCRIPTIONS = dict(
         parallel_computation='Use multithreading to accelerate computations',
         max_batch='Max batch size for ML detection model',
+        max_batch_wait='Max time (sec) to wait for a batch to fill up before running detection',
+        bucket_by_size='Batch only images of the same size together',
+        inference_workers='Number of detection processes (choose automatically for non-positive values)',
+        inference_threads='Number of torch threads per detection process (choose automatically for non-positive values)',
+        pin_cores='Pin every process to its own cpu cores',
+        numa_aware='Keep the cores of each detection process on the same NUMA node',
+        matching_workers='Number of processes matching peaks to crystal structures (match in detection processes if 0)',
+        start_method='Start method of the worker processes: fork, forkserver (preloads the stage modules) or spawn',
+        share_grids='Compute the interpolation grids once and share them with the workers via shared memory',
     )
 
 
@@ -162,6 +179,7 @@ class ClusterConfig(Config):
     chdir: str = '~/maxwell_output/'
     use_cuda: bool = False
     max_cores: int = -1
+    split_frames: str = 'index'
 
     CONF_NAME = 'Cluster Configuration'
 
@@ -172,6 +190,8 @@ class ClusterConfig(Config):
         chdir='Directory to store job logs',
         use_cuda='Use CUDA acceleration (use only for partitions with gpu support)',
         max_cores='Max number of cpu cores (use all the cores for non-positive values)',
+        nodes='Number of nodes to split the images between',
+        split_frames="Split the images between the nodes by batch 'index' or by file name 'hash'",
     )
 
     @property
@@ -183,16 +203,26 @@ class ClusterConfig(Config):
 class MatchingConfig(Config):
     perform_matching: bool = True
     max_distance: float = 0.05
+    use_sim_cache: bool = True
+    sim_processes: int = -1
+    truncated_matching: bool = False
 
     PARAM_DESCRIPTIONS = dict(
         perform_matching='Perform matching against crystal structures from cif folder',
-        max_distance='Max accepted distance between simulated and experimental peaks (Ang)'
+        max_distance='Max accepted distance between simulated and experimental peaks (Ang)',
+        use_sim_cache='Cache simulated peaks of crystal structures on disk',
+        sim_processes='Number of processes to simulate peaks of new structures (all the cores for non-positive values)',
+        truncated_matching='Maximize the number of pairs closer than max_distance instead of minimizing the total distance',
     )
 
     @property
     def cif_folder(self) -> Path:
         return CIF_PATH
 
+    @property
+    def sim_cache_folder(self) -> Path:
+        return CIF_PATH / '.sim_cache'
+
 
 class SaveConfig(Config):
     save_img: bool = False
@@ -200,6 +230,7 @@ class SaveConfig(Config):
     save_polar_img: bool = True
     save_scores: bool = True
     save_intensities: bool = True
+    save_legacy_matching: bool = True
 
     CONF_NAME = 'Save Configuration'
 
@@ -208,6 +239,36 @@ class SaveConfig(Config):
         save_q_img='Save images in reciprocal space',
         save_polar_img='Save images in polar space',
         save_intensities='Save peak intensities',
+        save_legacy_matching='Save matching results in one group per phase next to the matching tables',
+    )
+
+
+class CacheConfig(Config):
+    use_cache: bool = False
+    cache_dir: str = ''
+
+    CONF_NAME = 'Result Cache'
+
+    PARAM_DESCRIPTIONS = dict(
+        use_cache='Reuse interpolated images and detected peaks from previous runs for unchanged images',
+        cache_dir='Cache directory (default: .gixi_cache in the processed data directory)',
+    )
+
+
+class TrackingConfig(Config):
+    track_peaks: bool = False
+    iou_thresh: float = 0.5
+    max_pending: int = 256
+    max_frame_lag: int = 32
+
+    CONF_NAME = 'Peak Tracking'
+
+    PARAM_DESCRIPTIONS = dict(
+        track_peaks='Link peaks of consecutive frames into tracks (saved to tracks.h5)',
+        iou_thresh='Min IoU of the boxes of a peak in consecutive frames',
+        max_pending='Max number of frames waiting for a previous frame before tracking them anyway',
+        max_frame_lag='Max number of frames a frame waits for its previous frame behind the newest frame '
+                      '(the previous frame is considered lost)',
     )
 
 
@@ -235,6 +296,7 @@ class JobConfig(Config):
     data_dir: str = ''
     name: str = 'gixi'
     rewrite_previous: bool = True
+    resume: bool = False
 
     CONF_NAME = 'Data Paths'
 
@@ -243,7 +305,8 @@ class JobConfig(Config):
         folder_name='Raw data folder name (relative to data_dir/raw/)',
         data_dir='Path to the root directory of the measurements (data_dir)',
         name='Name of the job',
-        rewrite_previous='Rewrite previous results for this folder'
+        rewrite_previous='Rewrite previous results for this folder',
+        resume='Skip images already saved by a previous run (requires rewriting previous results)',
     )
 
     @property
@@ -265,6 +328,8 @@ class AppConfig(Config):
     model_config: ModelConfig = ModelConfig()
     log_config: LogConfig = LogConfig()
     program_paths_config: ProgramPathsConfig = ProgramPathsConfig()
+    cache_config: CacheConfig = CacheConfig()
+    tracking_config: TrackingConfig = TrackingConfig()
 
     GUI_CONFIG_GROUPS = OrderedDict(
         job_config=JobConfig,
@@ -278,6 +343,8 @@ class AppConfig(Config):
         postprocessing_config=PostProcessingConfig,
         model_config=ModelConfig,
         save_config=SaveConfig,
+        cache_config=CacheConfig,
+        tracking_config=TrackingConfig,
         log_config=LogConfig,
     )
 
@@ -324,5 +391,10 @@ class AppConfig(Config):
     @property
     def record_filename(self) -> str or None:
         if self.log_config.record_time:
-            filename = f'record_time_{self.job_config.id_name}.pt'
+            filename = f'record_time_{self.job_config.id_name}.npz'
             return str(TIME_RECORDS_PATH / filename)
+
+    @property
+    def spans_folder(self) -> str or None:
+        if self.log_config.record_time and self.log_config.record_spans:
+            return str(TIME_RECORDS_PATH / f'spans_{self.job_config.id_name}')
@@ -1,7 +1,13 @@
 from .fast_simulation import FastSimulation
+from .batch_simulation import BatchSimulation
 from .sim_dataset import SimDataset
+from .sim_loader import SimIterableDataset, get_sim_loader, write_sim_shards
 
 __all__ = [
     'FastSimulation',
-    'SimDataset'
+    'BatchSimulation',
+    'SimDataset',
+    'SimIterableDataset',
+    'get_sim_loader',
+    'write_sim_shards',
 ]
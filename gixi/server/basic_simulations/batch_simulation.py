@@ -0,0 +1,349 @@
+from math import pi
+from typing import List, NamedTuple, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from torchvision.ops import batched_nms
+
+from ..noise import perlin_batch
+from .misc import render_peaks
+
+__all__ = [
+    'BatchSimulation',
+    'BatchLabels',
+]
+
+SIZE: int = 512
+
+
+class BatchLabels(NamedTuple):
+    """
+    Peak parameters of a batch padded to the max number of peaks (batch_size, num_peaks),
+    mask marks the real peaks. slope, x_size and y_size (batch_size, 1) are the angle limits of every image.
+    """
+    pos: Tensor
+    widths: Tensor
+    a_pos: Tensor
+    a_widths: Tensor
+    boxes: Tensor
+    mask: Tensor
+    slope: Tensor
+    x_size: Tensor
+    y_size: Tensor
+
+    def set_images(self, idx: Tensor, labels: 'BatchLabels') -> 'BatchLabels':
+        num_peaks = max(self.mask.shape[1], labels.mask.shape[1])
+        res = [_pad(t, num_peaks).clone() for t in self]
+
+        for t, new in zip(res, labels):
+            t[idx] = _pad(new, num_peaks)
+
+        return BatchLabels(*res)
+
+
+class BatchSimulation(object):
+    """
+    Simulates batches of polar images with peaks as FastSimulation does image by image:
+    the labels are padded to the max number of peaks, the augmentations are applied to the whole batch
+    with a random subset of images and random parameters per image.
+
+    All the random numbers are drawn from a generator on the device, the same seed gives
+    the same batches on the same device.
+    """
+
+    def __init__(self, device='cuda', seed: int = None):
+        self.device = torch.device(device)
+        self.generator = torch.Generator(device=self.device)
+        self.manual_seed(seed)
+
+        self.x = torch.arange(SIZE, device=self.device, dtype=torch.float)
+        self.y = torch.arange(SIZE, device=self.device, dtype=torch.float)
+
+        self.mask_coords = torch.flip(self.x[None] * torch.cos(self.y[:, None] / SIZE * pi / 2), (0,))
+
+        self.kernel1 = torch.tensor([[1., 1., 1.],
+                                     [1., 0.3, 1.],
+                                     [1., 1., 1.]], device=self.device).view(1, 1, 3, 3)
+
+    def manual_seed(self, seed: int = None):
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    @torch.no_grad()
+    def simulate_batch(self, batch_size: int) -> Tuple[Tensor, List[Tensor]]:
+        """
+        Returns images (batch_size, 512, 512) and the list of boxes of every image.
+        """
+        labels = self.simulate_labels(batch_size)
+
+        intensities = self.gen_intensities(labels)
+        img = self.img_from_labels(labels, intensities)
+
+        # rings modification
+        img = self.mul_perlin(img)
+
+        # background
+        img = self.background_perlin(img)
+        img = self.add_glass(img)
+        img = self.add_linear_background(img)
+
+        # noise
+        img = self.apply_poisson_noise(img)
+        img = self.apply_speckle_noise(img)
+        img = self.digitalize_img(img)
+        img = self.apply_stretch(img)
+        img = self.apply_stretch(img, (20, 50), (7, 10))
+
+        # masks
+        img = self.add_dark_area(img, labels)
+        img = self.add_masks(img)
+
+        # kernels & other processing
+        img = self.apply_kernel(img)
+        img = self.apply_he(img)
+        img = self.apply_clip_img(img)
+
+        # normalization
+        img = _normalize(img)
+
+        counts = labels.mask.sum(1).tolist()
+        boxes = list(labels.boxes[labels.mask].split(counts))
+
+        return img, boxes
+
+    @torch.no_grad()
+    def simulate_boxes(self, batch_size: int) -> List[Tensor]:
+        labels = self.simulate_labels(batch_size)
+        return list(labels.boxes[labels.mask].split(labels.mask.sum(1).tolist()))
+
+    @torch.no_grad()
+    def simulate_labels(self, batch_size: int) -> BatchLabels:
+        num_peaks = self.randint(2, 200, batch_size)
+        max_peaks = int(num_peaks.max())
+
+        mask = torch.arange(max_peaks, device=self.device)[None] < num_peaks[:, None]
+
+        width_central = self.uniform(0.8, 4.5, batch_size, 1)
+        pos = self.uniform(70, 500, batch_size, max_peaks)
+        widths = torch.poisson(width_central.repeat(1, max_peaks) * 50, generator=self.generator) / 50
+        a_pos = self.uniform(-20, 532, batch_size, max_peaks)
+        a_widths = self.uniform(40, 500, batch_size, max_peaks)
+
+        mask &= self.filter_nms(pos, widths, a_pos, a_widths, mask)
+
+        size_ratio = self.uniform(-0.05, 0.05, batch_size, 1)
+        x_weight = pi / 4 - size_ratio
+        slope = self.uniform(0, 0.1, batch_size, 1)
+        x_size, y_size = SIZE * torch.sin(x_weight), SIZE * torch.cos(x_weight)
+
+        boxes = torch.stack([pos - widths,
+                             a_pos - a_widths * 2,
+                             pos + widths,
+                             a_pos + a_widths * 2], -1)
+
+        angles = (boxes[..., 3] + boxes[..., 1]) / 2
+        boxes[..., 3] = torch.minimum(boxes[..., 3], _angle_max(pos, y_size))
+        boxes[..., 1] = torch.maximum(boxes[..., 1], _angle_min(pos, x_size, slope))
+        box_widths = boxes[..., 3] - boxes[..., 1]
+
+        mask &= (box_widths >= 40) & (angles - boxes[..., 1] > - box_widths / 2) & (angles < boxes[..., 3])
+
+        boxes[..., :2].clamp_(min=0)
+        boxes[..., 2:].clamp_(max=SIZE)
+
+        labels = BatchLabels(pos, widths, a_pos, a_widths, boxes, mask, slope, x_size, y_size)
+
+        empty = ~mask.any(1)
+
+        if empty.any():
+            idx = empty.nonzero()[:, 0]
+            labels = labels.set_images(idx, self.simulate_labels(idx.numel()))
+
+        return labels
+
+    @staticmethod
+    def filter_nms(pos, widths, a_pos, a_widths, mask, min_nms: float = 0.001) -> Tensor:
+        idx_boxes = torch.stack([pos - widths * 2.5, a_pos - a_widths * 2, pos + widths * 2.5, a_pos + a_widths * 2], -1)
+        image_idx = torch.arange(pos.shape[0], device=pos.device)[:, None].expand_as(pos)
+        flat_idx = mask.flatten().nonzero()[:, 0]
+        keep = batched_nms(
+            idx_boxes.view(-1, 4)[flat_idx],
+            torch.ones(flat_idx.shape[0], device=pos.device),
+            image_idx.flatten()[flat_idx],
+            min_nms,
+        )
+        res = torch.zeros_like(mask)
+        res.view(-1)[flat_idx[keep]] = True
+        return res
+
+    def gen_intensities(self, labels: BatchLabels) -> Tensor:
+        intensities = self.uniform(5, 20, *labels.pos.shape)
+        intensities = torch.where((labels.pos < 160) | (labels.widths < 2), intensities * 2.5, intensities)
+        return intensities * labels.mask
+
+    def img_from_labels(self, labels: BatchLabels, intensities: Tensor) -> Tensor:
+        power = 4 - 2 * self.chance(0.8, len(intensities)).float()[:, None, None]
+        # padded peaks have zero intensity but must not produce nans
+        widths = labels.widths.masked_fill(~labels.mask, 1)
+        a_widths = labels.a_widths.masked_fill(~labels.mask, 1)
+        return render_peaks(self.x, self.y, labels.pos, widths, labels.a_pos, a_widths, intensities, power)
+
+    def mul_perlin(self, img):
+        apply = self.chance(0.9, len(img))
+        weights = self.uniform(1, 3, len(img), 3)
+        weights[:, 2] *= self.chance(0.3, len(img))
+        noise = perlin_batch(len(img), (3, 4, 5), weights, amp=1, device=self.device, generator=self.generator)
+        return _where(apply, img * noise, img)
+
+    def background_perlin(self, img):
+        apply = self.chance(0.2, len(img))
+        noise = perlin_batch(len(img), (1,), device=self.device, generator=self.generator)
+        return _where(apply, img + noise * img.amax((1, 2), keepdim=True) / 2, img)
+
+    def add_glass(self, img, pos_range: tuple = (40, 300)):
+        batch_size = len(img)
+        linear = self.chance(0.5, batch_size).float()[:, None, None]
+        power = 2 - linear
+
+        r = self.uniform(*pos_range, batch_size, 1, 1)
+        w = self.uniform(50, 140, batch_size, 1, 1) * (1 + linear)
+        a = self.uniform(50, 450, batch_size, 1, 1)
+        aw = self.uniform(250, 1050, batch_size, 1, 1)
+        weight = self.uniform(0.5, 1.2, batch_size, 1, 1) * (1 + linear)
+
+        gauss = (torch.exp(- torch.abs(self.x - r) ** power / 2 / w ** power) *
+                 torch.exp(- (self.y[:, None] - a) ** 2 / 2 / aw ** 2))
+        return _normalize(img) + gauss * weight
+
+    def add_linear_background(self, img):
+        apply = self.chance(0.9, len(img))
+        start, end = self.uniform(0, 0.1, 2, len(img), 1, 1)
+        background = start + (end - start) * torch.linspace(0, 1, SIZE, device=self.device)
+        return _where(apply, _normalize(img) + background, img)
+
+    def apply_poisson_noise(self, img):
+        coef = self.uniform(50, 100, len(img), 1, 1)
+        return torch.poisson(coef * _normalize(img), generator=self.generator)
+
+    def apply_speckle_noise(self, img):
+        apply = self.chance(0.3, len(img))
+        var = self.uniform(0.1, 0.25, len(img), 1, 1)
+        noise = torch.randn(img.shape, device=self.device, generator=self.generator) * var
+        return _where(apply, img + img * noise, img)
+
+    def digitalize_img(self, img):
+        apply = self.chance(0.9, len(img))
+        channels = self.randint(10, 32, len(img), 1, 1)
+        return _where(apply, (_normalize(img) * channels).round(), img)
+
+    def apply_stretch(self, img, x_range: tuple = (50, 150), step_range: tuple = (3, 6)):
+        # nearest-neighbour upscaling of every step-th row back to the full height for the first x_max columns
+        batch_size = len(img)
+        apply = self.chance(0.8, batch_size)
+        x_max = self.randint(*x_range, batch_size)
+        step = self.randint(*step_range, batch_size)[:, None]
+
+        num_rows = (SIZE + step - 1) // step
+        rows = step * (torch.arange(SIZE, device=self.device) * num_rows // SIZE)
+        stretched = img.gather(1, rows[..., None].expand(-1, -1, SIZE))
+
+        columns = torch.arange(SIZE, device=self.device) < x_max[:, None]
+        return torch.where(apply[:, None, None] & columns[:, None], stretched, img)
+
+    def add_dark_area(self, img, labels: BatchLabels):
+        x = self.x[None]
+        angle_min = _angle_min(x, labels.x_size, labels.slope)[:, None]
+        angle_max = _angle_max(x, labels.y_size)[:, None]
+        y = self.y[:, None]
+        return img.masked_fill((y <= angle_min) | (y >= angle_max), 0)
+
+    def add_masks(self, img):
+        batch_size = len(img)
+        apply = self.chance(0.5, batch_size)
+        rs = self.uniform(130, 280, batch_size, 2)
+        ws = self.uniform(3, 6, batch_size, 2)
+
+        # the second ring is used for half of the images if it is far enough from the first one
+        second = self.chance(0.5, batch_size) & (torch.abs(rs[:, 1] - rs[:, 0]) >= 100)
+        rings = torch.stack([apply, apply & second], 1)[..., None, None]
+
+        coords = self.mask_coords
+        r, w = rs[..., None, None], ws[..., None, None]
+        masks = ((coords <= r + w) & (coords >= r - w) & rings).any(1)
+        return img.masked_fill(masks, 0)
+
+    def apply_kernel(self, img):
+        apply = self.chance(0.7, len(img))
+        return _where(apply, F.conv2d(img[:, None], self.kernel1, padding=1)[:, 0], img)
+
+    def apply_he(self, img):
+        apply = self.chance(0.7, len(img))
+        return _where(apply, batch_he(img), img)
+
+    def apply_clip_img(self, img):
+        apply = self.chance(0.3, len(img))
+        m = img.mean((1, 2), keepdim=True)
+        s = img.std((1, 2), keepdim=True) * self.uniform(2, 4, len(img), 1, 1)
+        return _where(apply, torch.minimum(torch.maximum(img, m - s), m + s), img)
+
+    def uniform(self, low: float, high: float, *shape) -> Tensor:
+        return torch.rand(*shape, device=self.device, generator=self.generator) * (high - low) + low
+
+    def randint(self, low: int, high: int, *shape) -> Tensor:
+        """
+        Random integers from low to high inclusive, as random.randint.
+        """
+        return torch.randint(low, high + 1, shape, device=self.device, generator=self.generator)
+
+    def chance(self, probability: float, batch_size: int) -> Tensor:
+        return torch.rand(batch_size, device=self.device, generator=self.generator) < probability
+
+
+def batch_he(img: Tensor, bins: int = 1000) -> Tensor:
+    """
+    Histogram equalization of every image of the batch, as torch_he.
+    """
+    flat = img.flatten(1)
+    low, high = flat.amin(1, keepdim=True), flat.amax(1, keepdim=True)
+    bin_d = ((high - low) / bins).clamp_(min=torch.finfo(img.dtype).tiny)
+
+    bin_idx = ((flat - low) / bin_d).long().clamp_(0, bins - 1)
+    hist = torch.zeros(flat.shape[0], bins, device=img.device).scatter_add_(1, bin_idx, torch.ones_like(flat))
+    cdf = torch.cumsum(hist, 1)
+    cdf = cdf / cdf[:, -1:]
+
+    # linear interpolation of the cdf between the bin centers
+    t = (flat - low) / bin_d - 0.5
+    ind = t.floor().clamp_(0, bins - 2)
+    frac = t - ind
+    ind = ind.long()
+    y0, y1 = cdf.gather(1, ind), cdf.gather(1, ind + 1)
+
+    return (y0 + (y1 - y0) * frac).view(img.shape)
+
+
+def _angle_max(r: Tensor, y_size: Tensor) -> Tensor:
+    return ((r <= y_size) + (r > y_size) * torch.nan_to_num(torch.arcsin(y_size / r)) / pi * 2) * SIZE
+
+
+def _angle_min(r: Tensor, x_size: Tensor, slope: Tensor) -> Tensor:
+    geometry_area = (r > x_size) * torch.nan_to_num(torch.arccos(x_size / r)) / pi * 2 * SIZE
+    return torch.maximum(geometry_area, r * slope)
+
+
+def _normalize(img: Tensor) -> Tensor:
+    img_min, img_max = img.amin((1, 2), keepdim=True), img.amax((1, 2), keepdim=True)
+    return (img - img_min) / (img_max - img_min)
+
+
+def _where(apply: Tensor, new: Tensor, img: Tensor) -> Tensor:
+    return torch.where(apply[:, None, None], new, img)
+
+
+def _pad(t: Tensor, num_peaks: int) -> Tensor:
+    if t.shape[1] in (1, num_peaks):  # values per image or already padded
+        return t
+    return torch.cat([t, t.new_zeros((t.shape[0], num_peaks - t.shape[1]) + t.shape[2:])], 1)
@@ -14,7 +14,7 @@ from ..img_processing import (
     with_probability
 )
 from ..noise import perlin
-from .misc import clamp_boxes
+from .misc import clamp_boxes, render_peaks
 
 
 class FastSimulation(object):
@@ -121,12 +121,7 @@ class FastSimulation(object):
 
     def img_from_labels(self, pos, widths, a_pos, a_widths, intensities):
         power = 2 if random.random() > 0.2 else 4
-        return (intensities[None, None] * (
-            torch.exp(
-                - torch.abs(self.x - pos[None, None]) ** power / widths[None, None] ** power / 2
-                - (self.y - a_pos[None, None]) ** 2 / a_widths[None, None] ** 2 / 2
-            )
-        )).sum(-1)
+        return render_peaks(self.x.view(-1), self.y.view(-1), pos, widths, a_pos, a_widths, intensities, power)
 
 
 def get_power():
@@ -6,3 +6,16 @@ def clamp_boxes(boxes, size: int = 512):
     torch.clamp_(boxes[:, 1], min=0)
     torch.clamp_(boxes[:, 2], max=size)
     torch.clamp_(boxes[:, 3], max=size)
+
+
+def render_peaks(x, y, pos, widths, a_pos, a_widths, intensities, power=2):
+    """
+    Renders the sum of the peaks
+    intensities * exp(- |x - pos| ** power / widths ** power / 2 - (y - a_pos) ** 2 / a_widths ** 2 / 2)
+    on the (y, x) grid. Every peak is separable, so the image is Y.T @ diag(intensities) @ X with the 1d profiles
+    X (num_peaks, len(x)) and Y (num_peaks, len(y)) and no (len(y), len(x), num_peaks) tensor is created.
+    The peak parameters are (num_peaks,) or (batch_size, num_peaks), power is a number or (batch_size, 1, 1).
+    """
+    x_profiles = torch.exp(- torch.abs(x - pos[..., None]) ** power / widths[..., None] ** power / 2)
+    y_profiles = torch.exp(- (y - a_pos[..., None]) ** 2 / a_widths[..., None] ** 2 / 2)
+    return torch.matmul((y_profiles * intensities[..., None]).transpose(-1, -2), x_profiles)
@@ -0,0 +1,202 @@
+import random
+import logging
+import multiprocessing
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import torch
+from torch import Tensor
+from torch.utils.data import IterableDataset, DataLoader, get_worker_info
+
+from .fast_simulation import FastSimulation
+from .batch_simulation import BatchSimulation
+from .sim_dataset import SimDataset
+
+__all__ = [
+    'SimIterableDataset',
+    'get_sim_loader',
+    'write_sim_shards',
+    'load_shard',
+]
+
+SHARD_PATTERN: str = 'sim_shard_*.pt'
+
+
+class SimIterableDataset(IterableDataset):
+    """
+    Streams batches of simulated images (batch_size, in_channels, 512, 512) and lists of boxes.
+    Every DataLoader worker simulates its own batches with a seed derived from (seed, epoch, worker id)
+    and the number of previous iterations over the dataset in the worker. The epoch is kept in shared memory,
+    so set_epoch also reaches persistent workers, it has to be called before the iteration starts.
+    If cache_folder contains shards written by write_sim_shards, the batches are read from the shards
+    (split between the workers, a worker without shards yields nothing) instead of being simulated.
+
+    num_batches limits the number of batches per epoch (for all the workers together), infinite if None.
+    """
+
+    def __init__(self,
+                 batch_size: int,
+                 num_batches: int = None,
+                 seed: int = 0,
+                 device: str = 'cpu',
+                 in_channels: int = 1,
+                 batched: bool = True,
+                 cache_folder: str or Path = None,
+                 ):
+        super().__init__()
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+        self.seed = seed
+        self.device = device
+        self.in_channels = in_channels
+        self.batched = batched
+        self.cache_folder = Path(cache_folder) if cache_folder else None
+        self._epoch = multiprocessing.Value('q', 0, lock=False)  # shared with the workers
+        self._num_iterations = 0  # persistent workers keep their copy of the dataset between epochs
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch.value
+
+    def set_epoch(self, epoch: int):
+        self._epoch.value = epoch
+
+    def shard_paths(self) -> List[Path]:
+        if not self.cache_folder or not self.cache_folder.is_dir():
+            return []
+        return sorted(self.cache_folder.glob(SHARD_PATTERN))
+
+    def __iter__(self) -> Iterator[Tuple[Tensor, List[Tensor]]]:
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        seed_sequence = np.random.SeedSequence([self.seed, self.epoch, self._num_iterations, worker_id])
+        seed = int(seed_sequence.generate_state(1)[0])
+        self._num_iterations += 1
+
+        if self.num_batches is None:
+            num_batches = None
+        else:
+            num_batches = self.num_batches // num_workers + int(worker_id < self.num_batches % num_workers)
+
+        paths = self.shard_paths()
+
+        if paths:
+            worker_paths = paths[worker_id::num_workers]
+
+            if not worker_paths:
+                logging.getLogger(__name__).warning(
+                    f'Worker {worker_id} has no shards: {len(paths)} shards for {num_workers} workers.'
+                )
+                return
+
+            batches = self._iter_shards(worker_paths, seed)
+        else:
+            batches = self._iter_simulated(seed)
+
+        for i, batch in enumerate(batches):
+            if num_batches is not None and i >= num_batches:
+                return
+            yield batch
+
+    def _iter_simulated(self, seed: int):
+        if self.batched:
+            sim = BatchSimulation(self.device, seed=seed)
+        else:
+            # FastSimulation draws from the global generators
+            random.seed(seed)
+            np.random.seed(seed % 2 ** 32)
+            torch.manual_seed(seed)
+            sim = FastSimulation(self.device)
+
+        dataset = SimDataset(sim, self.in_channels)
+
+        while True:
+            yield dataset.get_batch(self.batch_size)
+
+    def _iter_shards(self, paths: List[Path], seed: int):
+        rng = random.Random(seed)
+
+        while True:
+            for path in rng.sample(paths, len(paths)):
+                images, boxes = load_shard(path)
+
+                if self.in_channels > 1:
+                    images = images.repeat(1, self.in_channels, 1, 1)
+
+                yield images, boxes
+
+
+def get_sim_loader(batch_size: int,
+                   num_workers: int = 0,
+                   num_batches: int = None,
+                   seed: int = 0,
+                   device: str = None,
+                   in_channels: int = 1,
+                   batched: bool = True,
+                   cache_folder: str or Path = None,
+                   pin_memory: bool = None,
+                   prefetch_factor: int = 2,
+                   ) -> DataLoader:
+    """
+    Returns a DataLoader over SimIterableDataset: num_workers processes simulate batches in parallel
+    on cpu and keep prefetch_factor batches each ready, the batches are copied to pinned memory
+    for a fast transfer to the gpu. Without workers the batches are simulated in the main process,
+    on the gpu if available. The number of workers is limited by the number of cached shards.
+    """
+    cuda = torch.cuda.is_available()
+
+    if device is None:
+        device = 'cuda' if cuda and not num_workers else 'cpu'
+
+    dataset = SimIterableDataset(
+        batch_size, num_batches=num_batches, seed=seed, device=device, in_channels=in_channels,
+        batched=batched, cache_folder=cache_folder,
+    )
+
+    num_shards = len(dataset.shard_paths())
+
+    if 0 < num_shards < num_workers:
+        logging.getLogger(__name__).warning(
+            f'Only {num_shards} cached shards, reduce the number of workers from {num_workers} to {num_shards}.'
+        )
+        num_workers = num_shards
+
+    kwargs = dict(prefetch_factor=prefetch_factor, persistent_workers=True) if num_workers > 0 else {}
+
+    return DataLoader(
+        dataset,
+        batch_size=None,  # the dataset yields batches
+        num_workers=num_workers,
+        pin_memory=(cuda and device == 'cpu') if pin_memory is None else pin_memory,
+        **kwargs
+    )
+
+
+def write_sim_shards(folder: str or Path,
+                     num_shards: int,
+                     batch_size: int,
+                     num_workers: int = 0,
+                     seed: int = 0,
+                     ) -> List[Path]:
+    """
+    Simulates num_shards batches in parallel and saves every batch to its own file in folder,
+    images are stored as float16.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    loader = get_sim_loader(batch_size, num_workers, num_batches=num_shards, seed=seed, device='cpu',
+                            pin_memory=False)
+    paths = []
+
+    for i, (images, boxes) in enumerate(loader):
+        path = folder / SHARD_PATTERN.replace('*', f'{seed}_{i:05d}')
+        torch.save(dict(images=images.half(), boxes=list(boxes)), str(path))
+        paths.append(path)
+
+    return paths
+
+
+def load_shard(path: str or Path) -> Tuple[Tensor, List[Tensor]]:
+    shard = torch.load(str(path), map_location='cpu')
+    return shard['images'].float(), shard['boxes']
@@ -0,0 +1,23 @@
+from gixi.server.lazy_imports import lazy_exports
+
+_EXPORTS = {
+    'write_synthetic_frames': 'gixi.server.bench.synthetic',
+    'simulate_detector_frame': 'gixi.server.bench.synthetic',
+    'polar_to_detector': 'gixi.server.bench.synthetic',
+    'benchmark_stages': 'gixi.server.bench.stages',
+    'measure': 'gixi.server.bench.stages',
+    'summarize_latencies': 'gixi.server.bench.stages',
+    'benchmark_servers': 'gixi.server.bench.servers',
+    'run_benchmarks': 'gixi.server.bench.run_bench',
+    'get_bench_config': 'gixi.server.bench.run_bench',
+    'main': 'gixi.server.bench.run_bench',
+    'benchmark_model_ops': 'gixi.server.bench.model_ops',
+    'get_op_cases': 'gixi.server.bench.model_ops',
+    'compare_results': 'gixi.server.bench.model_ops',
+    'measure_import_times': 'gixi.server.bench.import_time',
+    'measure_import_time': 'gixi.server.bench.import_time',
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
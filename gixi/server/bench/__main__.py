@@ -0,0 +1,5 @@
+from gixi.server.bench import main
+
+
+if __name__ == '__main__':
+    main()
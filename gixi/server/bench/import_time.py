@@ -0,0 +1,132 @@
+import sys
+import json
+import logging
+import subprocess
+from argparse import ArgumentParser
+from typing import Dict, Sequence
+
+import numpy as np
+
+__all__ = [
+    'measure_import_time',
+    'measure_import_times',
+    'parse_importtime',
+    'main',
+]
+
+# Modules imported by the server processes: the entry point, the module every worker
+# process loads and the modules of the single stages.
+DEFAULT_MODULES: tuple = (
+    'gixi.server',
+    'gixi.server.run',
+    'gixi.server.servers.multi_process_server',
+    'gixi.server.servers.image_path_gen',
+    'gixi.server.servers.save_data',
+    'gixi.server.process_images',
+    'gixi.server.matching',
+    'gixi.server.server_operations',
+)
+
+HEAVY_PACKAGES: tuple = (
+    'torch', 'torchvision', 'cv2', 'scipy', 'xrayutilities', 'h5py', 'PyQt5',
+)
+
+
+def parse_importtime(stderr: str) -> Dict[str, dict]:
+    """
+    Parses the output of python -X importtime: self and cumulative import time (s) of every module.
+    """
+    modules = {}
+
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        modules[name.strip()] = dict(self=int(self_us) * 1e-6, cumulative=int(cumulative_us) * 1e-6)
+
+    return modules
+
+
+def measure_import_time(module: str, python: str = sys.executable) -> dict:
+    """
+    Imports the module in a fresh interpreter, returns the total import time (s),
+    the heavy packages it imported and their cumulative import times.
+    """
+    res = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+
+    modules = parse_importtime(res.stderr)
+
+    if res.returncode:
+        error = [line for line in res.stderr.splitlines() if not line.startswith('import time:')]
+        return dict(error=error[-1] if error else f'exit code {res.returncode}')
+
+    return dict(
+        total=sum(m['self'] for m in modules.values()),
+        num_modules=len(modules),
+        heavy={name: modules[name]['cumulative'] for name in HEAVY_PACKAGES if name in modules},
+    )
+
+
+def measure_import_times(modules: Sequence[str] = DEFAULT_MODULES, repeat: int = 3) -> Dict[str, dict]:
+    """
+    Measures the import time of every module repeat times and keeps the median total time.
+    """
+    log = logging.getLogger(__name__)
+    results = {}
+
+    for module in modules:
+        runs = [measure_import_time(module) for _ in range(repeat)]
+        errors = [r['error'] for r in runs if 'error' in r]
+
+        if errors:
+            results[module] = dict(error=errors[0])
+            log.warning(f'Could not import {module}: {errors[0]}')
+            continue
+
+        totals = np.array([r['total'] for r in runs])
+        results[module] = dict(runs[int(np.argsort(totals)[len(totals) // 2])], min=float(totals.min()))
+
+        log.info(f'{module}: {results[module]["total"]:.3f} s.')
+
+    return results
+
+
+def get_results_str(results: Dict[str, dict]) -> str:
+    lines = [f'{"module":<45}{"time (s)":>10}{"modules":>9}  heavy packages']
+
+    for module, res in results.items():
+        if 'error' in res:
+            lines.append(f'{module:<45}{"-":>10}{"-":>9}  {res["error"]}')
+            continue
+
+        heavy = ', '.join(f'{k} ({v:.2f} s)' for k, v in res['heavy'].items()) or '-'
+        lines.append(f'{module:<45}{res["total"]:>10.3f}{res["num_modules"]:>9}  {heavy}')
+
+    return '\n'.join(lines)
+
+
+def main():
+    parser = ArgumentParser(description='Measure the import time of the gixi server modules in fresh interpreters')
+    parser.add_argument('modules', type=str, nargs='*', default=list(DEFAULT_MODULES), help='Modules to import')
+    parser.add_argument('-o', '--output', type=str, default='', help='Output json file')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of imports of every module')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s]: %(message)s')
+
+    results = measure_import_times(args.modules, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    print(get_results_str(results))
+
+
+if __name__ == '__main__':
+    main()
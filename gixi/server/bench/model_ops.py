@@ -0,0 +1,339 @@
+import sys
+import json
+import logging
+from argparse import ArgumentParser
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+from time import perf_counter
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from gixi.server.app_config import AppConfig
+from gixi.server.models_collection import get_basic_model
+from gixi.server.model import FixedAnchorsGenerator, decode_boxes
+from gixi.server.model.utils import get_top_n_idx, batched_nms
+
+__all__ = [
+    'OpCase',
+    'get_op_cases',
+    'benchmark_model_ops',
+    'compare_results',
+    'main',
+]
+
+_MIN_ROUNDS: int = 5
+_MIN_TIME: float = 0.2
+_WARMUP_ROUNDS: int = 2
+
+# Reference results (batch sizes 1 and 4, one thread), compared by default. The timings depend on the machine,
+# a slowdown only fails the run on the machine of the baseline. Regenerate them on the benchmark machine with
+# python -m gixi.server.bench.model_ops --save-baseline gixi/server/bench/baselines/model_ops_baseline.json
+BASELINE_PATH: Path = Path(__file__).parent / 'baselines' / 'model_ops_baseline.json'
+_META_KEY: str = '_meta'
+# the environment of a baseline which has to match to fail a run on a regression
+_ENVIRONMENT_KEYS: Tuple[str, ...] = ('machine', 'processor', 'torch', 'threads')
+
+
+class OpCase(NamedTuple):
+    """
+    The benchmarked call func(**inputs()). The inputs are built right before the case runs
+    and released after it, so that only the inputs of a single case are in memory.
+    """
+    name: str
+    func: Callable
+    params: dict
+    inputs: Callable[[], dict] = dict
+
+
+def get_op_cases(config: AppConfig = None,
+                 batch_sizes: Sequence[int] = (1, 4),
+                 box_counts: Sequence[int] = (100, 1000, 5000),
+                 seed: int = 0,
+                 ) -> List[OpCase]:
+    """
+    Builds the benchmark cases of the post-processing ops with the geometry of the detection model
+    (image shape, feature maps, anchors, filter parameters) and random inputs.
+    """
+    config = config or AppConfig()
+    model = get_basic_model(config, 'cpu', load_weights=False)
+
+    img_shape = model.rpn_filter.img_shape
+    anchor_generator = model.anchor_generator
+    anchors = anchor_generator.anchors
+    num_anchors_per_level = [
+        h * w * anchor_generator.num_anchors_per_location() for h, w in anchor_generator.feature_map_sizes
+    ]
+    num_anchors = anchors.shape[0]
+    roi_level = model.roi_align.choose_map.idx
+    roi_map_size = model.backbone.feature_map_sizes(img_shape)[roi_level]
+    num_maps = model.roi_align.choose_map.num_of_maps
+
+    def anchor_inputs(batch_size: int):
+        def inputs():
+            generator = torch.Generator().manual_seed(seed)
+            score = torch.rand(batch_size, num_anchors, generator=generator)
+            rel_codes = torch.rand(batch_size * num_anchors, 4, generator=generator) * 0.2 - 0.1
+            batch_anchors = torch.cat(anchor_generator.get_anchors(batch_size, torch.device('cpu')))
+            proposals = decode_boxes(rel_codes, batch_anchors).view(batch_size, -1, 4)
+            objectness = torch.rand(batch_size, num_anchors, generator=generator) * 8 - 4
+            return dict(score=score, rel_codes=rel_codes, anchors=batch_anchors, proposals=proposals,
+                        objectness=objectness)
+        return inputs
+
+    def box_inputs(batch_size: int, num_boxes: int, with_feature_map: bool = False):
+        def inputs():
+            generator = torch.Generator().manual_seed(seed)
+            num = num_boxes * batch_size
+            xy = torch.rand(num, 2, generator=generator) * torch.tensor(img_shape[::-1], dtype=torch.float32)
+            wh = torch.rand(num, 2, generator=generator) * 40 + 1
+            boxes = torch.cat([xy, xy + wh], 1)
+            scores = torch.rand(num, generator=generator) * 8 - 4
+            idxs = torch.arange(batch_size).repeat_interleave(num_boxes)
+
+            if not with_feature_map:
+                return dict(boxes=boxes, scores=scores, idxs=idxs)
+
+            feature_map = torch.rand(batch_size, model.backbone.out_channels, *roi_map_size, generator=generator)
+            return dict(boxes=boxes, feature_maps=[feature_map] * num_maps)
+        return inputs
+
+    cases = [
+        OpCase(
+            'FixedAnchorsGenerator', lambda: FixedAnchorsGenerator(
+                anchor_generator.height_weight_per_feature, img_shape, anchor_generator.feature_map_sizes
+            ), dict(num_anchors=num_anchors),
+        ),
+    ]
+
+    for batch_size in batch_sizes:
+        params = dict(batch_size=batch_size, num_anchors=num_anchors)
+        inputs = anchor_inputs(batch_size)
+
+        cases.extend([
+            OpCase(
+                'get_top_n_idx',
+                lambda score, **_: get_top_n_idx(model.rpn_filter.pre_nms_top_n, score, num_anchors_per_level),
+                params, inputs,
+            ),
+            OpCase(
+                'decode_boxes', lambda rel_codes, anchors, **_: decode_boxes(rel_codes, anchors),
+                params, inputs,
+            ),
+            OpCase(
+                'FilterProposals',
+                lambda proposals, objectness, **_: model.rpn_filter(proposals, objectness, num_anchors_per_level),
+                params, inputs,
+            ),
+        ])
+
+        for num_boxes in box_counts:
+            params = dict(batch_size=batch_size, num_boxes=num_boxes)
+
+            cases.extend([
+                OpCase(
+                    'batched_nms',
+                    lambda boxes, scores, idxs: batched_nms(boxes, scores, idxs, model.rpn_filter.nms_thresh),
+                    params, box_inputs(batch_size, num_boxes),
+                ),
+                OpCase(
+                    'FilterRois',
+                    lambda boxes, scores, n=(num_boxes,) * batch_size, **_: model.roi_filter(boxes, scores, list(n)),
+                    params, box_inputs(batch_size, num_boxes),
+                ),
+                OpCase(
+                    'RoiAlign',
+                    lambda boxes, feature_maps, n=num_boxes: model.roi_align(feature_maps, list(boxes.split(n))),
+                    params, box_inputs(batch_size, num_boxes, with_feature_map=True),
+                ),
+            ])
+
+    return cases
+
+
+@torch.no_grad()
+def benchmark_model_ops(cases: Sequence[OpCase],
+                        min_rounds: int = _MIN_ROUNDS,
+                        min_time: float = _MIN_TIME,
+                        ) -> Dict[str, dict]:
+    """
+    Runs every case at least min_rounds times and for at least min_time seconds after the warm-up,
+    returns the timing statistics (s) and the peak memory growth (MiB) of every case.
+    """
+    log = logging.getLogger(__name__)
+    results = {}
+
+    for case in cases:
+        key = case_key(case)
+        inputs = case.inputs()
+
+        def run():
+            return case.func(**inputs)
+
+        for _ in range(_WARMUP_ROUNDS):
+            run()
+
+        peak_memory = _measure_peak_memory(run)
+        times = []
+        start = perf_counter()
+
+        while len(times) < min_rounds or perf_counter() - start < min_time:
+            t = perf_counter()
+            run()
+            times.append(perf_counter() - t)
+
+        del inputs
+
+        times = np.array(times)
+
+        results[key] = dict(
+            params=case.params,
+            rounds=int(times.size),
+            min=float(times.min()),
+            median=float(np.median(times)),
+            mean=float(times.mean()),
+            stddev=float(times.std()),
+            peak_memory_mb=peak_memory,
+        )
+
+        log.debug(f'{key}: median {results[key]["median"]:.2e} s.')
+
+    return results
+
+
+def case_key(case: OpCase) -> str:
+    params = ','.join(f'{k}={v}' for k, v in case.params.items())
+    return f'{case.name}[{params}]'
+
+
+def compare_results(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float = 1.2) -> List[dict]:
+    """
+    Compares the median times with the baseline. A case is a regression if it is
+    more than threshold times slower than the baseline.
+    """
+    rows = []
+
+    for key, res in results.items():
+        base = baseline.get(key)
+
+        if not base:
+            rows.append(dict(case=key, median=res['median'], baseline=None, ratio=None, regression=False))
+            continue
+
+        ratio = res['median'] / base['median'] if base['median'] else float('inf')
+        rows.append(dict(case=key, median=res['median'], baseline=base['median'], ratio=ratio,
+                         regression=ratio > threshold))
+
+    return rows
+
+
+def get_comparison_str(rows: List[dict]) -> str:
+    lines = [f'{"case":<58}{"median (s)":>12}{"baseline (s)":>14}{"ratio":>8}']
+
+    for row in rows:
+        baseline = f'{row["baseline"]:.2e}' if row['baseline'] is not None else '-'
+        ratio = f'{row["ratio"]:.2f}' if row['ratio'] is not None else '-'
+        mark = '  REGRESSION' if row['regression'] else ''
+        lines.append(f'{row["case"]:<58}{row["median"]:>12.2e}{baseline:>14}{ratio:>8}{mark}')
+
+    return '\n'.join(lines)
+
+
+def get_environment_info(num_threads: int) -> dict:
+    """
+    Describes the machine of a baseline, the timings are only comparable on the same one.
+    """
+    import platform
+
+    return dict(
+        machine=platform.machine(),
+        processor=platform.processor() or platform.platform(),
+        python=platform.python_version(),
+        torch=torch.__version__,
+        threads=num_threads,
+    )
+
+
+def is_same_environment(meta: dict or None, environment: dict) -> bool:
+    """
+    Whether the timings of a baseline with the meta information are comparable with the current environment.
+    """
+    return bool(meta) and all(meta.get(key) == environment[key] for key in _ENVIRONMENT_KEYS)
+
+
+def _measure_peak_memory(func: Callable) -> float or None:
+    """
+    Peak resident memory growth (MiB) during a single call, resets the peak via /proc/self/clear_refs (Linux).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        rss = _read_status_kb('VmRSS')
+        func()
+        return (_read_status_kb('VmHWM') - rss) / 1024
+    except (OSError, ValueError):
+        func()
+        return None
+
+
+def _read_status_kb(field: str) -> int:
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1])
+    raise ValueError(f'{field} not found')
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the post-processing ops of the detection model')
+    parser.add_argument('-o', '--output', type=str, default='model_ops_results.json', help='Output json file')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--box-counts', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--threads', type=int, default=1, help='Number of torch threads')
+    parser.add_argument('--filter', type=str, default='', help='Run only the ops with this substring in the name')
+    parser.add_argument('--save-baseline', type=str, default='', help='Save the results as a baseline json file')
+    parser.add_argument('--compare', type=str, default=str(BASELINE_PATH),
+                        help='Compare the results with a baseline json file (empty string to skip)')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown ratio reported as a regression')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s]: %(message)s')
+    torch.set_num_threads(args.threads)
+
+    cases = [c for c in get_op_cases(batch_sizes=args.batch_sizes, box_counts=args.box_counts) if args.filter in c.name]
+    results = benchmark_model_ops(cases)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        Path(args.save_baseline).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.save_baseline, 'w') as f:
+            json.dump({_META_KEY: get_environment_info(args.threads), **results}, f, indent=2)
+
+    baseline, same_environment = {}, False
+
+    if args.compare and Path(args.compare).is_file():
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        meta = baseline.pop(_META_KEY, None)
+        same_environment = is_same_environment(meta, get_environment_info(args.threads))
+        logging.info(f'Compare with {args.compare}, measured on {meta or "unknown machine"}.')
+
+        if not same_environment:
+            logging.warning('The baseline was measured in another environment, regressions do not fail the run. '
+                            'Save a baseline on this machine with --save-baseline.')
+    elif args.compare:
+        logging.warning(f'Baseline {args.compare} does not exist, save one with --save-baseline.')
+
+    rows = compare_results(results, baseline, args.threshold)
+    print(get_comparison_str(rows))
+
+    if same_environment and any(row['regression'] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
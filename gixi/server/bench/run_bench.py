@@ -0,0 +1,148 @@
+import os
+import json
+import shutil
+import logging
+import platform
+import tempfile
+from argparse import ArgumentParser
+from typing import Sequence, Tuple
+from pathlib import Path
+from time import strftime, localtime
+
+import numpy as np
+import torch
+
+from gixi.package_info import __version__
+from gixi.server.app_config import (
+    AppConfig,
+    JobConfig,
+    GeneralConfig,
+    LogConfig,
+    ModelConfig,
+)
+from gixi.server.models_collection import get_basic_model
+
+from .synthetic import write_synthetic_frames
+from .stages import benchmark_stages
+from .servers import benchmark_servers, update_config, SERVER_MODES
+
+__all__ = [
+    'get_bench_config',
+    'run_benchmarks',
+    'main',
+]
+
+
+def get_bench_config(workdir: Path, config: AppConfig = None) -> AppConfig:
+    config = config or AppConfig()
+
+    return update_config(
+        config,
+        job_config=JobConfig(data_dir=str(workdir), folder_name='bench', name='bench'),
+        general=GeneralConfig(sum_images=1),
+        log_config=LogConfig(record_time=False, record_spans=False, status_interval=0),
+    )
+
+
+def prepare_model(config: AppConfig, workdir: Path) -> Tuple[AppConfig, bool]:
+    """
+    Uses the model of the config if its weights are available. Otherwise, saves random weights
+    to the working directory (the timings do not depend on the weights).
+    """
+    try:
+        get_basic_model(config, 'cpu')
+        return config, True
+    except (OSError, RuntimeError) as err:
+        logging.getLogger(__name__).warning(f'Could not load the model weights ({err}), use random weights.')
+
+    path = Path(workdir) / 'bench_model.h5'
+    torch.save(get_basic_model(config, 'cpu', load_weights=False).state_dict(), str(path))
+
+    return update_config(config, model_config=ModelConfig(name=str(path.absolute()))), False
+
+
+def run_benchmarks(workdir: Path,
+                   num_frames: int = 16,
+                   batch_sizes: Sequence[int] = (1, 4, 16),
+                   modes: Sequence[str] = ('single', 'multi'),
+                   device: str = 'cpu',
+                   seed: int = 0,
+                   ) -> dict:
+    log = logging.getLogger(__name__)
+    workdir = Path(workdir)
+
+    config = get_bench_config(workdir)
+    config, pretrained = prepare_model(config, workdir)
+
+    log.info(f'Write {num_frames} synthetic frames to {config.src_path}.')
+    boxes_list = write_synthetic_frames(config.src_path, config, num_frames, seed)
+    config.dest_path.mkdir(parents=True, exist_ok=True)
+    paths = sorted(config.src_path.glob('*.tif'))
+
+    stages = benchmark_stages(config, paths, boxes_list, batch_sizes, device)
+    servers = benchmark_servers(config, num_frames, modes)
+
+    return dict(
+        meta=dict(
+            time=strftime('%Y-%m-%d %H:%M:%S', localtime()),
+            gixi_version=__version__,
+            python=platform.python_version(),
+            numpy=np.__version__,
+            torch=torch.__version__,
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+            device=device,
+            num_frames=num_frames,
+            frame_shape=[config.q_space.size_y, config.q_space.size_x],
+            pretrained_weights=pretrained,
+            seed=seed,
+        ),
+        stages=stages,
+        servers=servers,
+    )
+
+
+def get_results_str(results: dict) -> str:
+    lines = [f'{"stage":<22}{"items/s":>12}{"median (s)":>14}{"p90 (s)":>12}']
+
+    for name, res in results['stages'].items():
+        lines.append(f'{name:<22}{res["items_per_s"]:>12.2f}{res["median"]:>14.2e}{res["p90"]:>12.2e}')
+
+    for name, res in results['servers'].items():
+        if 'error' in res:
+            lines.append(f'{name + " server":<22}{"failed: " + res["error"]:>38}')
+        else:
+            lines.append(f'{name + " server":<22}{res["frames_per_s"]:>12.2f}')
+
+    return '\n'.join(lines)
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the gixi processing pipeline on synthetic frames')
+    parser.add_argument('-o', '--output', type=str, default='bench_results.json', help='Output json file')
+    parser.add_argument('--frames', type=int, default=16, help='Number of synthetic frames')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16], help='Inference batch sizes')
+    parser.add_argument('--modes', type=str, nargs='*', default=list(SERVER_MODES.keys()),
+                        choices=list(SERVER_MODES.keys()), help='Server modes to run')
+    parser.add_argument('--device', type=str, default='cpu', help='Inference device for the stage benchmarks')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the simulation')
+    parser.add_argument('--workdir', type=str, default='', help='Working directory (a temporary one by default)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s]: %(message)s')
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix='gixi_bench_'))
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        results = run_benchmarks(workdir, args.frames, args.batch_sizes, args.modes, args.device, args.seed)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(str(workdir), ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(get_results_str(results))
+    logging.getLogger(__name__).info(f'Saved results to {args.output}')
@@ -0,0 +1,55 @@
+import logging
+from typing import Dict, Sequence
+from time import perf_counter
+
+from gixi.server.app_config import AppConfig
+from gixi.server.servers import SingleProcessServer, MultiProcessServer
+
+__all__ = [
+    'benchmark_servers',
+    'update_config',
+]
+
+SERVER_MODES = dict(
+    single=SingleProcessServer,
+    multi=MultiProcessServer,
+)
+
+
+def update_config(config: AppConfig, **sections) -> AppConfig:
+    conf_dict = config.asdict()
+    conf_dict.update({name: section.asdict() for name, section in sections.items()})
+    return AppConfig.from_dict(conf_dict)
+
+
+def benchmark_servers(config: AppConfig, num_frames: int, modes: Sequence[str] = ('single', 'multi')) -> Dict[str, dict]:
+    """
+    Runs the whole pipeline on the synthetic frames in the single- and multi-process server modes
+    and measures the initialization time and the throughput.
+    """
+    log = logging.getLogger(__name__)
+    results = {}
+
+    for mode in modes:
+        log.info(f'Benchmark {mode}-process server.')
+        mode_config = update_config(config, parallel=config.parallel.update(parallel_computation=mode == 'multi'))
+
+        try:
+            start = perf_counter()
+            server = SERVER_MODES[mode](mode_config)
+            init_time = perf_counter() - start
+            server.run()
+            run_time = perf_counter() - start - init_time
+        except (Exception, SystemExit) as err:
+            log.warning(f'{mode}-process server failed: {err}')
+            results[mode] = dict(error=str(err) or type(err).__name__)
+            continue
+
+        results[mode] = dict(
+            frames=num_frames,
+            init_time=init_time,
+            run_time=run_time,
+            frames_per_s=num_frames / run_time if run_time else 0.,
+        )
+
+    return results
@@ -0,0 +1,124 @@
+import logging
+import warnings
+from typing import List, Callable, Dict, Sequence
+from time import perf_counter
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from gixi.server.app_config import AppConfig
+from gixi.server.misc import read_image
+from gixi.server.models_collection import get_basic_model
+from gixi.server.img_processing import QInterpolation, PolarInterpolation, ContrastCorrection
+from gixi.server.matching import MatchDiffractionPatterns
+from gixi.server.servers.save_data import SaveData
+
+__all__ = [
+    'benchmark_stages',
+    'measure',
+    'summarize_latencies',
+]
+
+
+def summarize_latencies(latencies: Sequence[float], items_per_call: int = 1) -> Dict[str, float]:
+    latencies = np.asarray(latencies, dtype=np.float64)
+
+    return dict(
+        calls=int(latencies.size),
+        items_per_call=items_per_call,
+        mean=float(latencies.mean()),
+        median=float(np.median(latencies)),
+        p90=float(np.percentile(latencies, 90)),
+        min=float(latencies.min()),
+        max=float(latencies.max()),
+        items_per_s=float(items_per_call * latencies.size / latencies.sum()) if latencies.sum() else 0.,
+    )
+
+
+def measure(func: Callable, args_list: Sequence, items_per_call: int = 1, warmup: int = 1) -> Dict[str, float]:
+    """
+    Calls func(args) for every element of args_list (cycling through it for the warm-up calls)
+    and summarizes the latencies.
+    """
+    for i in range(warmup):
+        func(args_list[i % len(args_list)])
+
+    latencies = []
+
+    for args in args_list:
+        start = perf_counter()
+        func(args)
+        latencies.append(perf_counter() - start)
+
+    return summarize_latencies(latencies, items_per_call)
+
+
+@torch.no_grad()
+def benchmark_stages(config: AppConfig,
+                     paths: List[Path],
+                     boxes_list: List[np.ndarray],
+                     batch_sizes: Sequence[int] = (1, 4, 16),
+                     device: str = 'cpu',
+                     ) -> Dict[str, dict]:
+    """
+    Measures every stage of the pipeline on the synthetic frames separately:
+    reading, q and polar interpolation, contrast correction, model inference per batch size,
+    matching and saving.
+    """
+    log = logging.getLogger(__name__)
+    results = {}
+
+    q_interp, p_interp = QInterpolation(config), PolarInterpolation(config)
+    contrast = ContrastCorrection(config.contrast)
+
+    log.info('Benchmark reading.')
+    results['read'] = measure(read_image, paths)
+    images = [read_image(path) for path in paths]
+
+    log.info('Benchmark interpolation and contrast correction.')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        results['q_space'] = measure(q_interp, images)
+
+    results['polar'] = measure(p_interp, images)
+    polar_images = [p_interp(img) for img in images]
+    results['contrast'] = measure(contrast, polar_images)
+    processed_images = [contrast(img) for img in polar_images]
+
+    model = get_basic_model(config, device)
+
+    for batch_size in batch_sizes:
+        log.info(f'Benchmark inference with batch size {batch_size}.')
+        batches = [
+            torch.tensor(
+                np.array([processed_images[(i + j) % len(processed_images)] for j in range(batch_size)]),
+                dtype=torch.float32, device=device,
+            )[:, None]
+            for i in range(0, len(processed_images), batch_size)
+        ]
+        results[f'inference_batch_{batch_size}'] = measure(model, batches, items_per_call=batch_size)
+
+    log.info('Benchmark matching.')
+    matching = MatchDiffractionPatterns(config)
+    data_list = [dict(boxes=boxes, polar_img=img) for boxes, img in zip(boxes_list, polar_images)]
+    results['matching'] = measure(lambda data: matching.match_batch([data]), data_list)
+    results['matching']['num_phases'] = len(matching.sim_results or [])
+
+    log.info('Benchmark saving.')
+    save_data = SaveData(config)
+    save_list = [
+        dict(
+            paths=(path,),
+            boxes=data['boxes'],
+            scores=np.ones(len(data['boxes']), dtype=np.float32),
+            polar_img=data['polar_img'],
+            processed_img=processed_img,
+        )
+        for path, data, processed_img in zip(paths, data_list, processed_images)
+    ]
+    results['save'] = measure(lambda data: save_data.save_data(dict(data)), save_list, warmup=0)
+    save_data.close()
+
+    return results
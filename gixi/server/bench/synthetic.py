@@ -0,0 +1,105 @@
+import random
+from typing import List, Tuple
+from pathlib import Path
+
+import numpy as np
+import cv2 as cv
+import torch
+from PIL import Image
+
+from gixi.server.app_config import AppConfig
+from gixi.server.basic_simulations import FastSimulation
+
+__all__ = [
+    'polar_to_detector',
+    'simulate_detector_frame',
+    'write_synthetic_frames',
+]
+
+
+def polar_to_detector(polar_img: np.ndarray, config: AppConfig) -> np.ndarray:
+    """
+    Maps an image in polar coordinates (angle from 0 to 90 deg along the rows, q from 0 to q_max
+    along the columns) to the raw detector image, the inverse of PolarInterpolation.
+    """
+    q_config = config.q_space
+    k = 2 * np.pi / q_config.wavelength
+    d = q_config.distance / q_config.pixel_size
+    alpha = np.pi / 180 * q_config.incidence_angle
+    sin, cos = np.sin(alpha), np.cos(alpha)
+
+    yy, zz = np.meshgrid(
+        np.arange(q_config.size_x, dtype=np.float64) - q_config.y0,
+        np.arange(q_config.size_y, dtype=np.float64) - q_config.z0,
+    )
+
+    norm = np.sqrt(yy ** 2 + zz ** 2 + d ** 2)
+    q2 = 2 * (1 - d / norm)
+    q_z = (zz * cos - d * sin) / norm + sin
+    q_xy = np.sqrt(np.clip(q2 - q_z ** 2, 0, None))
+
+    num_angles, num_q = polar_img.shape
+    q_map = np.sqrt(q2) * k / q_config.q_max * (num_q - 1)
+    angle_map = np.arctan2(q_z, q_xy) / (np.pi / 2) * (num_angles - 1)
+
+    img = cv.remap(
+        polar_img.astype(np.float32), q_map.astype(np.float32), angle_map.astype(np.float32),
+        cv.INTER_LINEAR, borderMode=cv.BORDER_CONSTANT, borderValue=0,
+    )
+
+    if q_config.flip_x:
+        img = np.flip(img, 1)
+    if q_config.flip_y:
+        img = np.flip(img, 0)
+
+    return np.ascontiguousarray(img)
+
+
+def simulate_detector_frame(simulation: FastSimulation,
+                            config: AppConfig,
+                            max_counts: float = 5000,
+                            rng: np.random.Generator = None,
+                            ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns a raw detector image (uint16 counts with Poisson noise) and the simulated boxes
+    normalized to the polar image size (the format of data_dict['boxes']).
+    """
+    rng = rng or np.random.default_rng()
+
+    polar_img, boxes = simulation.simulate_img()
+    polar_img, boxes = polar_img.cpu().numpy(), boxes.cpu().numpy()
+
+    img = polar_to_detector(polar_img, config) * max_counts
+    img = np.clip(rng.poisson(img), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+    scale = np.array([polar_img.shape[1], polar_img.shape[0]] * 2)[None]
+
+    return img, boxes / scale
+
+
+def write_synthetic_frames(folder: Path,
+                           config: AppConfig,
+                           num_frames: int,
+                           seed: int = 0,
+                           max_counts: float = 5000,
+                           ) -> List[np.ndarray]:
+    """
+    Writes num_frames simulated detector images to folder as uint16 TIFFs,
+    returns the normalized boxes of every frame.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    simulation = FastSimulation(device='cpu')
+    boxes_list = []
+
+    for i in range(num_frames):
+        img, boxes = simulate_detector_frame(simulation, config, max_counts, rng)
+        Image.fromarray(img).save(str(folder / f'frame_{i:05d}.tif'))
+        boxes_list.append(boxes)
+
+    return boxes_list
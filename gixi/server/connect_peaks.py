@@ -1,27 +1,119 @@
 from typing import Tuple
 
 import numpy as np
-from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
 
 __all__ = [
     'give_matching_indices',
+    'overlapping_pairs',
+    'sparse_iou',
+    'sparse_assignment',
     'np_iou',
 ]
 
 
+# max number of candidate pairs checked for overlap at once
+_MAX_CANDIDATES: int = 2 ** 18
+
+
 def give_matching_indices(
         boxes: np.ndarray,
         prev_boxes: np.ndarray,
         thresh: float = 0.5,
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-    iou_mtx = np_iou(prev_boxes, boxes)
-    prev_ind, current_ind = linear_sum_assignment(-iou_mtx)
+    """
+    Assigns boxes of two frames maximizing the total IoU and keeps the pairs with IoU > thresh.
+    """
+    iou_mtx = sparse_iou(prev_boxes, boxes)
+    prev_ind, current_ind = sparse_assignment(iou_mtx)
+
+    iou_values = _paired_iou(prev_boxes[prev_ind], boxes[current_ind])
+    indices = iou_values > thresh
+
+    return current_ind[indices], prev_ind[indices], iou_values[indices]
+
+
+def sparse_iou(boxes_1: np.ndarray, boxes_2: np.ndarray) -> csr_matrix:
+    """
+    Memory-efficient counterpart of np_iou: evaluates only the overlapping pairs of boxes
+    and returns the IoU values as a sparse matrix.
+    """
+    idx_1, idx_2 = overlapping_pairs(boxes_1, boxes_2)
+    iou_values = _paired_iou(boxes_1[idx_1], boxes_2[idx_2])
+    return csr_matrix((iou_values, (idx_1, idx_2)), shape=(len(boxes_1), len(boxes_2)))
+
+
+def sparse_assignment(iou_mtx: csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Maximizes the total IoU of one-to-one assigned pairs using only the stored entries of a sparse matrix.
+    Every row gets a dummy column with the cost of an unmatched box, so that a full matching always exists.
+    """
+    num_1, num_2 = iou_mtx.shape
+
+    if not iou_mtx.nnz:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    iou_mtx = iou_mtx.tocoo()
+    rows = np.concatenate([iou_mtx.row, np.arange(num_1)])
+    cols = np.concatenate([iou_mtx.col, num_2 + np.arange(num_1)])
+    # costs are kept positive, explicit zeros would not be treated as edges
+    costs = np.concatenate([2 - iou_mtx.data, np.full(num_1, 2.)])
+
+    cost_mtx = csr_matrix((costs, (rows, cols)), shape=(num_1, num_2 + num_1))
+    prev_ind, current_ind = min_weight_full_bipartite_matching(cost_mtx)
+
+    matched = current_ind < num_2
+    return prev_ind[matched], current_ind[matched]
+
+
+def overlapping_pairs(boxes_1: np.ndarray, boxes_2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the indices of all the overlapping pairs of boxes (with the +1 pixel convention of np_iou).
+    The second set is sorted by q start, so the candidates of every box of the first set form a slice
+    found by a binary search, the candidates are then checked for overlap in both dimensions.
+    """
+    if not len(boxes_1) or not len(boxes_2):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    order = np.argsort(boxes_2[:, 0], kind='stable')
+    starts_2 = boxes_2[order, 0]
+    max_width = (boxes_2[:, 2] - boxes_2[:, 0]).max()
+
+    first = np.searchsorted(starts_2, boxes_1[:, 0] - 1 - max_width, 'left')
+    last = np.searchsorted(starts_2, boxes_1[:, 2] + 1, 'right')
+    counts = np.maximum(last - first, 0)
+
+    # candidates are checked in chunks to bound the memory for large sets of boxes
+    chunk_ids = np.cumsum(counts) // _MAX_CANDIDATES
+    bounds = np.flatnonzero(np.diff(chunk_ids)) + 1
+    pairs_1, pairs_2 = [], []
+
+    for rows in np.split(np.arange(len(boxes_1)), bounds):
+        chunk_counts = counts[rows]
+        idx_1 = np.repeat(rows, chunk_counts)
+        offsets = np.repeat(np.cumsum(chunk_counts) - chunk_counts - first[rows], chunk_counts)
+        idx_2 = order[np.arange(chunk_counts.sum()) - offsets]
+
+        b1, b2 = boxes_1[idx_1], boxes_2[idx_2]
+        overlap = (
+                (np.minimum(b1[:, 2], b2[:, 2]) - np.maximum(b1[:, 0], b2[:, 0]) + 1 > 0) &
+                (np.minimum(b1[:, 3], b2[:, 3]) - np.maximum(b1[:, 1], b2[:, 1]) + 1 > 0)
+        )
+        pairs_1.append(idx_1[overlap])
+        pairs_2.append(idx_2[overlap])
+
+    return np.concatenate(pairs_1), np.concatenate(pairs_2)
 
-    indices = iou_mtx[prev_ind, current_ind] > thresh
-    prev_ind, current_ind = prev_ind[indices], current_ind[indices]
-    iou_values = iou_mtx[prev_ind, current_ind]
 
-    return current_ind, prev_ind, iou_values
+def _paired_iou(boxes_1: np.ndarray, boxes_2: np.ndarray) -> np.ndarray:
+    inter_area = (
+            np.maximum(np.minimum(boxes_1[:, 2], boxes_2[:, 2]) - np.maximum(boxes_1[:, 0], boxes_2[:, 0]) + 1, 0) *
+            np.maximum(np.minimum(boxes_1[:, 3], boxes_2[:, 3]) - np.maximum(boxes_1[:, 1], boxes_2[:, 1]) + 1, 0)
+    )
+    area_1 = (boxes_1[:, 2] - boxes_1[:, 0] + 1) * (boxes_1[:, 3] - boxes_1[:, 1] + 1)
+    area_2 = (boxes_2[:, 2] - boxes_2[:, 0] + 1) * (boxes_2[:, 3] - boxes_2[:, 1] + 1)
+    return inter_area / (area_1 + area_2 - inter_area)
 
 
 def np_iou(boxes_1: np.ndarray, boxes_2: np.ndarray):
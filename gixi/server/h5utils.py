@@ -46,12 +46,16 @@ class GixiFileManager(object):
 
 
 def init_folder(parent_folder_path: Path, src_name: str, add_time: bool = True) -> Path:
+    folder_path = parent_folder_path / get_folder_name(src_name, add_time)
+    folder_path.mkdir(exist_ok=True)
+    return folder_path
+
+
+def get_folder_name(src_name: str, add_time: bool = True) -> str:
     src_name = src_name.split('.')[0]
     if add_time:
         src_name = src_name + dt.strftime(dt.now(), '-%d_%b_%H-%M-%S')
-    folder_path = parent_folder_path / src_name
-    folder_path.mkdir(exist_ok=True)
-    return folder_path
+    return src_name
 
 
 def read_gixi(filepath: str or Path) -> dict:
@@ -1,5 +1,15 @@
-from gixi.server.img_processing.utils import normalize, with_probability
-from gixi.server.img_processing.he import torch_he
-from gixi.server.img_processing.angle_limits import AngleLimits
-from gixi.server.img_processing.contrast_correction import ContrastCorrection
-from gixi.server.img_processing.conversions import QInterpolation, PolarInterpolation
+from gixi.server.lazy_imports import lazy_exports
+
+_EXPORTS = {
+    'normalize': 'gixi.server.img_processing.utils',
+    'with_probability': 'gixi.server.img_processing.utils',
+    'torch_he': 'gixi.server.img_processing.he',
+    'AngleLimits': 'gixi.server.img_processing.angle_limits',
+    'ContrastCorrection': 'gixi.server.img_processing.contrast_correction',
+    'QInterpolation': 'gixi.server.img_processing.conversions',
+    'PolarInterpolation': 'gixi.server.img_processing.conversions',
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
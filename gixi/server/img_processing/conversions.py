@@ -1,3 +1,5 @@
+from typing import Tuple
+
 import numpy as np
 import cv2 as cv
 
@@ -15,10 +17,12 @@ __all__ = [
 
 
 class QInterpolation(object):
-    def __init__(self, config: AppConfig):
+    def __init__(self, config: AppConfig, grid: Tuple[np.ndarray, np.ndarray] = None):
         self.config = config
         self._flip_x, self._flip_y = self.config.q_space.flip_x, self.config.q_space.flip_y
-        self.xy, self.zz = self._get_grid()
+        # a precomputed grid (e.g. shared between processes) skips the computation
+        xy, zz = grid if grid is not None else self._get_grid()
+        self.xy, self.zz = xy.astype(np.float32, copy=False), zz.astype(np.float32, copy=False)
         self.algorithm = config.polar_config.algorithm
 
         if self.algorithm not in (cv.INTER_LINEAR, cv.INTER_CUBIC, cv.INTER_LANCZOS4):
@@ -63,7 +67,10 @@ def convert2polar_space(img: np.ndarray,
 
 
 def convert_img(img: np.ndarray, xy: np.ndarray, zz: np.ndarray, algorithm: int = cv.INTER_LINEAR):
-    return cv.remap(img.astype(np.float32), xy.astype(np.float32), zz.astype(np.float32), algorithm)
+    return cv.remap(
+        img.astype(np.float32, copy=False), xy.astype(np.float32, copy=False), zz.astype(np.float32, copy=False),
+        algorithm,
+    )
 
 
 def get_detector_q_grid(q_config: QSpaceConfig):
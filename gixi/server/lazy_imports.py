@@ -0,0 +1,30 @@
+from importlib import import_module
+from typing import Callable, Dict, Tuple
+
+__all__ = [
+    'lazy_exports',
+]
+
+
+def lazy_exports(package_name: str, exports: Dict[str, str]) -> Tuple[Callable, Callable]:
+    """
+    Returns module level __getattr__ and __dir__ functions (PEP 562) of a package which import
+    the exported names from their modules on the first access, so importing the package itself
+    does not import torch, cv2 or xrayutilities.
+    """
+    package = import_module(package_name)
+
+    def __getattr__(name: str):
+        module_name = exports.get(name)
+
+        if module_name is None:
+            raise AttributeError(f'module {package_name!r} has no attribute {name!r}')
+
+        value = getattr(import_module(module_name), name)
+        setattr(package, name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(package)) | set(exports))
+
+    return __getattr__, __dir__
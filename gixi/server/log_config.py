@@ -1,5 +1,6 @@
 import logging
 import logging.config
+from pathlib import Path
 
 __all__ = [
     'set_log_config',
@@ -61,6 +62,9 @@ def _get_log_config(level, filename: str = None) -> dict:
 
 
 def set_log_config(level: int = logging.INFO, filename: str = None):
+    if filename:
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+
     log_config = _get_log_config(level, filename=filename)
     logging.config.dictConfig(log_config)
     logging.getLogger(__name__).debug(f'log config is set with level={level} and filename={filename}.')
@@ -1,72 +1,799 @@
-from scipy.optimize import linear_sum_assignment
+import logging
+import os
+from bisect import bisect_right
+from typing import List, Tuple, Dict, NamedTuple
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 
 from gixi.server.matching.simulate_diffraction_peaks import simulate_diffraction_peaks
+from gixi.server.matching.sim_cache import SimulationCache
 from gixi.server.app_config import AppConfig
 
 
 class MatchDiffractionPatterns(object):
-    def __init__(self, config: AppConfig):
+    """
+    Simulates the peaks of the crystal structures of the cif folder (or takes the phase_arrays
+    of another instance) and matches the detected peaks against them.
+    """
+
+    def __init__(self, config: AppConfig, phase_arrays: Dict[str, np.ndarray] = None):
+        self.log = logging.getLogger(__name__)
         self.config = config
         self.max_distance = self.config.match_config.max_distance
         self.q_max = self.config.q_space.q_max
         self.folder = self.config.match_config.cif_folder
+        self.wavelength = self.config.q_space.wavelength
+
+        if self.config.match_config.use_sim_cache:
+            self.cache = SimulationCache(self.config.match_config.sim_cache_folder)
+        else:
+            self.cache = None
+
+        if phase_arrays is not None:
+            # simulated by another process
+            self.sim_results = None
+            self._set_phase_arrays(phase_arrays)
+            return
 
         if self.config.match_config.perform_matching:
             self.sim_results = self._simulate_peaks()
         else:
             self.sim_results = None
 
+        self._concat_phases()
+
     def __call__(self, data_dict: dict):
-        if not self.sim_results:
-            return data_dict
+        self.match_batch([data_dict])
+        return data_dict
 
-        boxes = data_dict['boxes']
-        qs = (boxes[:, 0] + boxes[:, 2]) / 2 * self.q_max
+    def match_batch(self, data_list: List[dict]) -> 'BatchMatchResults' or None:
+        """
+        Matches the peaks of all the frames against all the phases in one pass and stores
+        the compact results of every frame in data_dict['matching_table'] and, unless disabled
+        by save_legacy_matching, the results of every phase in data_dict['matching_results'].
+        """
+        if not self._phases:
+            return
 
-        matching_results = {}
+        exp_qs_list = [(d['boxes'][:, 0] + d['boxes'][:, 2]) / 2 * self.q_max for d in data_list]
 
-        for name, path, q_pos, intensities, miller_indices in self.sim_results:
-            matched_sf, sim_idx, exp_idx = get_match_metrics(q_pos, qs, intensities, self.max_distance)
+        results = match_batch(
+            self._sim_qs, self._sim_phases, self._sim_intensities, exp_qs_list, self.max_distance,
+            truncated=self.config.match_config.truncated_matching,
+        )
 
-            matching_results[name] = dict(
-                path=str(path),
-                metric=np.array(matched_sf),
-                sim_idx=sim_idx,
-                exp_idx=exp_idx,
-            )
+        save_legacy = self.config.save_config.save_legacy_matching
 
-        data_dict['matching_results'] = matching_results
+        for i, data_dict in enumerate(data_list):
+            data_dict['matching_table'] = results.frame_table(i, self._phase_names, str(self.folder))
+            if save_legacy:
+                data_dict['matching_results'] = results.frame_phases(i, self._phases)
 
-        return data_dict
+        return results
+
+    def _concat_phases(self):
+        sim_results = self.sim_results or []
+        sizes = np.array([r[2].size for r in sim_results], dtype=np.int64)
+
+        self._phase_names = np.array([r[0] for r in sim_results], dtype=np.bytes_)
+        self._phases = [(r[0], str(r[1])) for r in sim_results]
+        self._sim_phases = np.repeat(np.arange(len(sim_results)), sizes)
+        self._sim_qs = np.concatenate([r[2] for r in sim_results]) if sim_results else np.zeros(0)
+        self._sim_intensities = np.concatenate([r[3] for r in sim_results]) if sim_results else np.zeros(0)
+
+    @property
+    def phase_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        The phases and their simulated peaks as arrays, which can be shared with other processes.
+        """
+        return dict(
+            names=np.array([name for name, _ in self._phases], dtype=np.str_),
+            paths=np.array([path for _, path in self._phases], dtype=np.str_),
+            phase_ids=self._sim_phases,
+            qs=self._sim_qs,
+            intensities=self._sim_intensities,
+        )
+
+    def _set_phase_arrays(self, phase_arrays: Dict[str, np.ndarray]):
+        names, paths = phase_arrays['names'].tolist(), phase_arrays['paths'].tolist()
+
+        self._phase_names = np.array(names, dtype=np.bytes_)
+        self._phases = list(zip(names, paths))
+        self._sim_phases = phase_arrays['phase_ids']
+        self._sim_qs = phase_arrays['qs']
+        self._sim_intensities = phase_arrays['intensities']
 
     def _simulate_peaks(self):
+        paths = sorted(self.folder.glob('*.cif'))
+        cached = self._load_cached(paths)
+        simulated = self._simulate_cifs([path for path in paths if path not in cached])
+
         sim_results = []
 
-        for path in self.folder.glob('*.cif'):
-            name = path.stem
-            q_pos, intensities, miller_indices = simulate_diffraction_peaks(
-                path,
-                q_max=self.q_max,
-                wavelength=self.config.q_space.wavelength,
-            )
+        for path in paths:
+            sim_result = cached.get(path, simulated.get(path))
+
+            if sim_result is None:
+                continue
+
+            q_pos, intensities, miller_indices = sim_result
 
             if intensities.sum() > 0:
-                sim_results.append((name, path, q_pos, intensities, miller_indices))
+                sim_results.append((path.stem, path, q_pos, intensities, miller_indices))
 
         return sim_results
 
+    def _load_cached(self, paths: List[Path]) -> Dict[Path, tuple]:
+        if not self.cache:
+            return {}
+
+        cached = {}
+
+        for path in paths:
+            sim_result = self.cache.load(self.cache.key(path, self.q_max, self.wavelength))
+            if sim_result is not None:
+                cached[path] = sim_result
+
+        return cached
+
+    def _simulate_cifs(self, paths: List[Path]) -> Dict[Path, tuple]:
+        """
+        Simulates peaks for the CIF files in a process pool. Files that fail are logged and skipped.
+        """
+        if not paths:
+            return {}
+
+        num_processes = _get_num_processes(self.config.match_config.sim_processes, len(paths))
+        args = [(path, self.q_max, self.wavelength) for path in paths]
+        log_every = max(1, len(paths) // 10)
+
+        self.log.info(f'Simulating peaks for {len(paths)} CIF files with {num_processes} processes ...')
+
+        if num_processes == 1:
+            results = map(_simulate_cif, args)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(num_processes)
+            results = (future.result() for future in as_completed([executor.submit(_simulate_cif, a) for a in args]))
+
+        simulated = {}
+
+        try:
+            for i, (path, sim_result, error) in enumerate(results, 1):
+                if error:
+                    self.log.warning(f'Could not simulate peaks for {path.name}: {error}')
+                else:
+                    simulated[path] = sim_result
+                    if self.cache:
+                        self.cache.save(self.cache.key(path, self.q_max, self.wavelength), *sim_result)
+
+                if i % log_every == 0 or i == len(paths):
+                    self.log.info(f'Simulated {i}/{len(paths)} CIF files.')
+        finally:
+            if executor:
+                executor.shutdown()
+
+        return simulated
+
+
+def _simulate_cif(args: Tuple[Path, float, float]):
+    path, q_max, wavelength = args
+    try:
+        return path, simulate_diffraction_peaks(path, q_max=q_max, wavelength=wavelength), None
+    except Exception as err:
+        return path, None, repr(err)
+
+
+def _get_num_processes(sim_processes: int, num_files: int) -> int:
+    if sim_processes <= 0:
+        try:
+            sim_processes = len(os.sched_getaffinity(0))
+        except AttributeError:
+            sim_processes = os.cpu_count() or 1
+    return max(1, min(sim_processes, num_files))
+
 
 def get_match_metrics(
         sim_qs: np.ndarray,
         exp_qs: np.ndarray,
         sim_intensities: np.ndarray,
         max_distance: float = 0.1,
+        truncated: bool = False,
 ):
-    distance_mtx = np.abs(exp_qs[None] - sim_qs[..., None])
-    sim_idx, exp_idx = linear_sum_assignment(distance_mtx)
-    distances = distance_mtx[sim_idx, exp_idx]
-    indices = distances < max_distance
-    sim_idx, exp_idx = sim_idx[indices], exp_idx[indices]
+    """
+    Matches simulated and experimental peak positions one-to-one with the minimal total distance
+    (as linear_sum_assignment of the distance matrix), keeps the pairs closer than max_distance and returns
+    the share of the simulated intensity that is matched together with the indices of the pairs.
+    With truncated=True the distances are truncated at max_distance instead (see match_1d_truncated).
+    """
+    sim_idx, exp_idx = (match_1d_truncated if truncated else match_1d)(sim_qs, exp_qs, max_distance)
     matched_sf = sim_intensities[sim_idx].sum() / sim_intensities.sum()
     return matched_sf, sim_idx, exp_idx
+
+
+class BatchMatchResults(NamedTuple):
+    """
+    Matching results of a batch of frames. Matched pairs are sorted by frame, phase and simulated peak,
+    pairs of frame i are pair_offsets[i]:pair_offsets[i + 1]. Simulated indices refer to the peaks
+    of the phase, experimental ones to the peaks of the frame.
+    """
+    metrics: np.ndarray  # (num_phases, num_frames) matched share of the simulated intensity
+    pair_offsets: np.ndarray  # (num_frames + 1,)
+    phase_ids: np.ndarray
+    sim_idx: np.ndarray
+    exp_idx: np.ndarray
+
+    def frame_table(self, frame: int, phase_names: np.ndarray, cif_folder: str = '') -> dict:
+        """
+        Table of the phases with matched peaks in the frame and the matched pairs
+        (columns: row in the phase table, simulated index, experimental index).
+        """
+        start, end = self.pair_offsets[frame], self.pair_offsets[frame + 1]
+        phase_ids, rows = np.unique(self.phase_ids[start:end], return_inverse=True)
+
+        return dict(
+            names=phase_names[phase_ids],
+            metric=self.metrics[phase_ids, frame],
+            pairs=np.stack([rows, self.sim_idx[start:end], self.exp_idx[start:end]], 1).astype(np.int32),
+            cif_folder=cif_folder,
+        )
+
+    def frame_phases(self, frame: int, phases: List[Tuple[str, str]]) -> Dict[str, dict]:
+        """
+        Results of the frame in the per-phase layout used before the tables: one group for each of the
+        (name, cif path) phases with the path, the metric and the simulated and experimental indices of the pairs.
+        """
+        start, end = self.pair_offsets[frame], self.pair_offsets[frame + 1]
+        phase_ids = self.phase_ids[start:end]
+        bounds = start + np.searchsorted(phase_ids, np.arange(len(phases) + 1))
+
+        return {
+            name: dict(
+                path=path,
+                metric=np.array(self.metrics[i, frame]),
+                sim_idx=self.sim_idx[bounds[i]:bounds[i + 1]],
+                exp_idx=self.exp_idx[bounds[i]:bounds[i + 1]],
+            )
+            for i, (name, path) in enumerate(phases)
+        }
+
+
+def match_batch(
+        sim_qs: np.ndarray,
+        sim_phases: np.ndarray,
+        sim_intensities: np.ndarray,
+        exp_qs_list: List[np.ndarray],
+        max_distance: float = 0.1,
+        truncated: bool = False,
+) -> BatchMatchResults:
+    """
+    Matches the experimental peaks of several frames against all the phases in one pass. Simulated peaks
+    of all phases are concatenated with their (sorted) phase ids. Every (frame, phase) block is matched
+    independently with the results of get_match_metrics. Only the phases with simulated peaks close
+    to the peaks of a frame enter the problem, the other ones have no pairs closer than max_distance.
+    With truncated=True only the close simulated peaks enter, and the blocks are shifted along q by a distance
+    exceeding the q range, so that they form independent clusters of a single match_1d_truncated problem.
+    """
+    num_phases, num_frames = int(sim_phases.max()) + 1 if sim_phases.size else 0, len(exp_qs_list)
+    totals = np.bincount(sim_phases, weights=sim_intensities, minlength=num_phases)
+    phase_starts = np.searchsorted(sim_phases, np.arange(num_phases))
+
+    all_qs = [qs for qs in exp_qs_list if qs.size]
+    empty = np.zeros(0, dtype=np.int64)
+
+    if not sim_qs.size or not all_qs:
+        return BatchMatchResults(np.zeros((num_phases, num_frames)), np.zeros(num_frames + 1, dtype=np.int64),
+                                 empty, empty, empty)
+
+    q_min = min(sim_qs.min(), min(qs.min() for qs in all_qs))
+    shift = max(sim_qs.max(), max(qs.max() for qs in all_qs)) - q_min + 2 * max_distance
+
+    sim_blocks, sim_ids, exp_blocks, exp_ids, exp_values = [], [], [], [], []
+    sim_order = np.lexsort((sim_qs, sim_phases))
+
+    for frame, exp_qs in enumerate(exp_qs_list):
+        if not exp_qs.size:
+            continue
+
+        exp_order = np.argsort(exp_qs, kind='stable')
+        exp_sorted = exp_qs[exp_order]
+        candidates = np.flatnonzero(_has_neighbour(sim_qs, exp_sorted, max_distance))
+        phases = np.unique(sim_phases[candidates])
+
+        if not truncated:
+            # all the peaks of the phases with candidates, sorted by phase and q
+            in_phases = np.zeros(num_phases, dtype=bool)
+            in_phases[phases] = True
+            candidates = sim_order[in_phases[sim_phases[sim_order]]]
+
+        sim_blocks.append(frame * num_phases + sim_phases[candidates])
+        sim_ids.append(candidates)
+        exp_blocks.append(np.repeat(frame * num_phases + phases, exp_qs.size))
+        exp_ids.append(np.tile(exp_order, phases.size))
+        exp_values.append(np.tile(exp_sorted, phases.size))
+
+    sim_blocks, sim_ids = np.concatenate(sim_blocks), np.concatenate(sim_ids)
+    exp_blocks, exp_ids = np.concatenate(exp_blocks), np.concatenate(exp_ids)
+
+    if truncated:
+        s_idx, e_idx = match_1d_truncated(
+            sim_qs[sim_ids] - q_min + sim_blocks * shift,
+            np.concatenate(exp_values) - q_min + exp_blocks * shift,
+            max_distance,
+        )
+    else:
+        s_idx, e_idx = match_blocks(sim_qs[sim_ids], sim_blocks, np.concatenate(exp_values), exp_blocks, max_distance)
+
+    blocks, sim_ids, exp_ids = sim_blocks[s_idx], sim_ids[s_idx], exp_ids[e_idx]
+    order = np.lexsort((sim_ids, blocks))
+    blocks, sim_ids, exp_ids = blocks[order], sim_ids[order], exp_ids[order]
+
+    frames, phase_ids = np.divmod(blocks, num_phases)
+    matched = np.bincount(blocks, weights=sim_intensities[sim_ids], minlength=num_frames * num_phases)
+    matched = matched.reshape(num_frames, num_phases).T
+    metrics = np.divide(matched, totals[:, None], out=np.zeros_like(matched), where=totals[:, None] > 0)
+
+    return BatchMatchResults(
+        metrics=metrics,
+        pair_offsets=np.searchsorted(frames, np.arange(num_frames + 1)),
+        phase_ids=phase_ids,
+        sim_idx=sim_ids - phase_starts[phase_ids],
+        exp_idx=exp_ids,
+    )
+
+
+def match_1d(sim_qs: np.ndarray, exp_qs: np.ndarray, max_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the indices of the matched simulated and experimental peaks closer than max_distance
+    of the one-to-one matching of min(n_sim, n_exp) pairs with the minimal total distance,
+    the same pairs as linear_sum_assignment of the distance matrix (up to ties).
+    If no peak has a partner closer than max_distance, no matching is needed.
+    """
+    empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    if not sim_qs.size or not exp_qs.size:
+        return empty
+
+    sim_order, exp_order = np.argsort(sim_qs, kind='stable'), np.argsort(exp_qs, kind='stable')
+
+    if not _has_neighbour(sim_qs[sim_order], exp_qs[exp_order], max_distance).any():
+        return empty
+
+    s_idx, e_idx = match_blocks(
+        sim_qs[sim_order], np.zeros(sim_qs.size, dtype=np.int64),
+        exp_qs[exp_order], np.zeros(exp_qs.size, dtype=np.int64), max_distance,
+    )
+    sim_idx, exp_idx = sim_order[s_idx], exp_order[e_idx]
+    order = np.argsort(sim_idx)
+
+    return sim_idx[order], exp_idx[order]
+
+
+def match_blocks(sim_qs: np.ndarray, sim_blocks: np.ndarray, exp_qs: np.ndarray, exp_blocks: np.ndarray,
+                 max_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Matches the simulated and experimental peaks of every block independently as match_1d does.
+    The peaks are sorted by block and q. Returns the indices of the pairs closer than max_distance.
+
+    In 1D a matching with the minimal total distance preserves the order, so the smaller set of a block
+    (n peaks) is matched to an ordered subset of the larger one (m peaks) by dynamic programming
+    in O(n * min(n, m - n)) time and memory, for all the blocks of similar size at once (see _match_ordered).
+    The total distance does not change if the partners of two pairs pointing in the same direction
+    with overlapping intervals are swapped, so there are often several optimal matchings
+    (linear_sum_assignment returns any of them). The one with most pairs closer than max_distance is chosen,
+    see _maximize_close_pairs.
+    """
+    num_blocks = int(max(sim_blocks.max(initial=-1), exp_blocks.max(initial=-1))) + 1
+    sim_counts = np.bincount(sim_blocks, minlength=num_blocks)
+    exp_counts = np.bincount(exp_blocks, minlength=num_blocks)
+    sim_starts = np.cumsum(sim_counts) - sim_counts
+    exp_starts = np.cumsum(exp_counts) - exp_counts
+    sim_pairs, exp_pairs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+
+    for sim_rows in (True, False):
+        blocks = np.flatnonzero((sim_counts > 0) & (exp_counts > 0) & ((sim_counts <= exp_counts) == sim_rows))
+
+        if sim_rows:
+            s_idx, e_idx = _match_ordered(
+                sim_qs, exp_qs, sim_starts[blocks], sim_counts[blocks], exp_starts[blocks], exp_counts[blocks],
+            )
+        else:
+            e_idx, s_idx = _match_ordered(
+                exp_qs, sim_qs, exp_starts[blocks], exp_counts[blocks], sim_starts[blocks], sim_counts[blocks],
+            )
+        sim_pairs.append(s_idx)
+        exp_pairs.append(e_idx)
+
+    sim_idx, exp_idx = np.concatenate(sim_pairs), np.concatenate(exp_pairs)
+    order = np.argsort(sim_idx, kind='stable')
+    sim_idx, exp_idx = sim_idx[order], exp_idx[order]
+    exp_idx = exp_idx[_maximize_close_pairs(sim_qs[sim_idx], exp_qs[exp_idx], sim_blocks[sim_idx], max_distance)]
+    close = np.abs(sim_qs[sim_idx] - exp_qs[exp_idx]) < max_distance
+
+    return sim_idx[close], exp_idx[close]
+
+
+def _maximize_close_pairs(row_qs: np.ndarray, col_qs: np.ndarray, blocks: np.ndarray,
+                          max_distance: float) -> np.ndarray:
+    """
+    Takes the pairs of an order preserving matching sorted by block and row position and returns
+    the permutation of their columns with the same total distance and the most pairs closer than max_distance.
+
+    Consecutive pairs pointing in the same direction with overlapping intervals form runs. Within a run
+    every assignment of the columns to the rows keeping the direction of all the pairs has the same
+    total distance. The run is swept in its direction, every column takes the earliest open row closer
+    than max_distance (or the earliest open row if there is none), which maximizes the number of close pairs.
+    """
+    num_pairs = row_qs.size
+    permutation = np.arange(num_pairs)
+
+    # without a far pair there is nothing to gain
+    if num_pairs < 2 or not np.isfinite(max_distance):
+        return permutation
+
+    forward = col_qs >= row_qs
+    row_end, col_end = row_qs[:-1], col_qs[:-1]
+    overlap = np.where(forward[1:], row_qs[1:] <= col_end, col_qs[1:] <= row_end)
+    same_run = (blocks[1:] == blocks[:-1]) & (forward[1:] == forward[:-1]) & overlap
+    starts = np.flatnonzero(np.concatenate([[True], ~same_run]))
+    ends = np.append(starts[1:], num_pairs)
+
+    # runs without a far pair keep their partners
+    gain = np.abs(col_qs - row_qs) >= max_distance
+    runs = np.flatnonzero((ends - starts > 1) & (np.add.reduceat(gain, starts) > 0))
+
+    # runs of two pairs only swap their columns if this gives more close pairs
+    pairs = starts[runs[ends[runs] - starts[runs] == 2]]
+    kept = np.add(np.abs(col_qs[pairs] - row_qs[pairs]) < max_distance,
+                  np.abs(col_qs[pairs + 1] - row_qs[pairs + 1]) < max_distance, dtype=int)
+    swapped = np.add(np.abs(col_qs[pairs + 1] - row_qs[pairs]) < max_distance,
+                     np.abs(col_qs[pairs] - row_qs[pairs + 1]) < max_distance, dtype=int)
+    pairs = pairs[swapped > kept]
+    permutation[pairs], permutation[pairs + 1] = pairs + 1, pairs
+    runs = runs[ends[runs] - starts[runs] > 2]
+
+    signs = np.where(forward, 1., -1.)
+    sources, sinks = (row_qs * signs).tolist(), (col_qs * signs).tolist()
+
+    for start, end in zip(starts[runs].tolist(), ends[runs].tolist()):
+        # the pairs of a backward run are swept from the end
+        pairs = range(start, end) if forward[start] else range(end - 1, start - 1, -1)
+        taken = _sweep_run([sources[j] for j in pairs], [sinks[j] for j in pairs], max_distance)
+        permutation[[pairs[j] for j in taken]] = pairs
+
+    return permutation
+
+
+def _sweep_run(sources: List[float], sinks: List[float], max_distance: float) -> List[int]:
+    """
+    Sorted sources[i] <= sinks[i]. Returns the index of the source taken by every sink.
+    """
+    taken, open_sources, open_idx = [], [], []
+    next_source = 0
+
+    for sink in sinks:
+        while next_source < len(sources) and sources[next_source] <= sink:
+            open_sources.append(sources[next_source])
+            open_idx.append(next_source)
+            next_source += 1
+
+        close = bisect_right(open_sources, sink - max_distance)
+        close = close if close < len(open_sources) else 0
+        del open_sources[close]
+        taken.append(open_idx.pop(close))
+
+    return taken
+
+
+def _match_ordered(
+        row_qs: np.ndarray,
+        col_qs: np.ndarray,
+        row_starts: np.ndarray,
+        row_counts: np.ndarray,
+        col_starts: np.ndarray,
+        col_counts: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Matches every sorted row point of a block to one of the sorted column points (row_counts <= col_counts)
+    preserving the order and minimizing the total distance.
+
+    In such a matching all the columns between a row and its partner are taken by the other rows
+    (otherwise the rows in between could move closer), so the partner of a row is at most n columns below
+    or above its position among the columns. Only a window of about n + 1 cells of the band is needed per row.
+    """
+    row_idx, col_idx = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+
+    if not row_counts.size:
+        return row_idx[0], col_idx[0]
+
+    # positions of the rows among the columns of their block
+    row_blocks = np.repeat(np.arange(row_counts.size), row_counts)
+    col_blocks = np.repeat(np.arange(col_counts.size), col_counts)
+    row_pos = np.arange(row_blocks.size) - np.repeat(np.cumsum(row_counts) - row_counts - row_starts, row_counts)
+    col_pos = np.arange(col_blocks.size) - np.repeat(np.cumsum(col_counts) - col_counts - col_starts, col_counts)
+    rows, cols = row_qs[row_pos], col_qs[col_pos]
+    span = max(rows.max(), cols.max()) - min(rows.min(), cols.min()) + 1
+    row_keys, col_keys = rows + row_blocks * span, cols + col_blocks * span
+    first_col = (np.cumsum(col_counts) - col_counts)[row_blocks]
+    below = np.searchsorted(col_keys, row_keys, 'left') - first_col
+    above = np.searchsorted(col_keys, row_keys, 'right') - first_col
+
+    # k = column - row index of the partner is within [below - n, above]
+    lows = below - row_counts[row_blocks]
+    widths = col_counts - row_counts + 1
+    windows = np.minimum(np.maximum.reduceat(above - lows, np.cumsum(row_counts) - row_counts) + 1, widths)
+    row_offsets = np.cumsum(row_counts) - row_counts
+
+    for chunk in _get_chunks(row_counts, windows):
+        window = windows[chunk].max()
+        r, c = _match_band(
+            _pad(row_qs, row_starts[chunk], row_counts[chunk]),
+            _pad(col_qs, col_starts[chunk], col_counts[chunk], col_counts[chunk].max() + window),
+            _pad(lows, row_offsets[chunk], row_counts[chunk]),
+            row_counts[chunk], widths[chunk], window,
+        )
+        row_idx.append(row_starts[chunk][r[0]] + r[1])
+        col_idx.append(col_starts[chunk][c[0]] + c[1])
+
+    return np.concatenate(row_idx), np.concatenate(col_idx)
+
+
+def _match_band(row_qs: np.ndarray, col_qs: np.ndarray, lows: np.ndarray, row_counts: np.ndarray,
+                widths: np.ndarray, window: int):
+    """
+    costs[i, w, b] is the minimal cost of matching the first i rows of block b to the first i + k columns
+    with k = bases[i - 1, b] + w, row i - 1 is matched to column i - 1 + k or an earlier one.
+    The window of row i covers k from bases[i] to bases[i] + window - 1, the cells beyond it keep the cost
+    of its last cell, the cells beyond the band width of a block are not used.
+    """
+    num_blocks, num_rows = row_qs.shape
+
+    # the blocks are the last axis, so that the running minimum is vectorized over them
+    bases = np.clip(np.nan_to_num(lows.T), 0, np.maximum(widths - window, 0)).astype(np.int64)
+    bases = np.maximum.accumulate(bases, axis=0)
+    row_qs, col_qs = row_qs.T, col_qs.T.ravel()
+    blocks, cells = np.arange(num_blocks), np.arange(window)[:, None] * num_blocks
+    costs = np.zeros((num_rows + 1, window, num_blocks))
+    last = (window - 1) * num_blocks
+
+    for i in range(num_rows):
+        # flat indices of the cells of the window of row i
+        cols = cells + (i + bases[i]) * num_blocks + blocks
+        distances = np.abs(np.take(col_qs, cols) - row_qs[i])
+        distances += costs[i] if i == 0 else np.take(
+            costs[i], np.minimum(cells + (bases[i] - bases[i - 1]) * num_blocks, last) + blocks,
+        )
+        np.minimum.accumulate(distances, axis=0, out=costs[i + 1])
+
+    # backtracking on the flattened tables of all the blocks
+    skip_stride = num_blocks
+    row_stride = window * skip_stride
+    costs, bases = costs.ravel(), bases.ravel()
+    i = row_counts.copy()
+    k = np.minimum(widths - 1, bases[(i - 1) * num_blocks + blocks] + window - 1)
+    matched = []
+
+    while True:
+        active = i > 0
+        if not active.all():
+            if not active.any():
+                break
+            i, k, blocks = i[active], k[active], blocks[active]
+        w = k - bases[(i - 1) * num_blocks + blocks]
+        pos = i * row_stride + w * skip_stride + blocks
+        skip = (w > 0) & (costs[pos] == costs[pos - skip_stride])
+        match = ~skip
+        matched.append((blocks[match], i[match] - 1, i[match] - 1 + k[match]))
+        i = i - match
+        k = k - skip
+        # the cells beyond the window of the next row have the cost of its last cell
+        k = np.where(match & (i > 0), np.minimum(k, bases[np.maximum(i - 1, 0) * num_blocks + blocks] + window - 1), k)
+
+    if not matched:
+        empty = np.zeros(0, dtype=np.int64)
+        return (empty, empty), (empty, empty)
+
+    a, i, j = map(np.concatenate, zip(*matched))
+    return (a, i), (a, j)
+
+
+def match_1d_truncated(sim_qs: np.ndarray, exp_qs: np.ndarray,
+                       max_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the indices of the matched simulated and experimental peaks.
+
+    The assignment maximizes the sum of max_distance - distance over the pairs closer than max_distance
+    (the distance sum truncated at max_distance), so the number of pairs closer than max_distance comes first.
+    This differs from match_1d, which minimizes the sum of all min(n_sim, n_exp) distances and can give up
+    a close pair to shorten a far one that is filtered out afterwards.
+
+    Sorting and the neighbour filter take O(n log n). The peaks are then split into clusters which cannot
+    share a pair. Clusters with a single peak of either set are matched to the nearest peak.
+    The other clusters are solved exactly by a dynamic programming in O(k * m) time and memory per cluster
+    of k and m peaks. This is fast for sparse peaks but not bounded by O(n log n)
+    if most peaks fall into a single cluster (max_distance comparable to the peak spacing).
+    """
+    empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    if not sim_qs.size or not exp_qs.size:
+        return empty
+
+    sim_order, exp_order = np.argsort(sim_qs, kind='stable'), np.argsort(exp_qs, kind='stable')
+    sim_sorted, exp_sorted = sim_qs[sim_order], exp_qs[exp_order]
+
+    sim_mask = _has_neighbour(sim_sorted, exp_sorted, max_distance)
+
+    if not sim_mask.any():
+        return empty
+
+    exp_mask = _has_neighbour(exp_sorted, sim_sorted, max_distance)
+    sim_order, sim_sorted = sim_order[sim_mask], sim_sorted[sim_mask]
+    exp_order, exp_sorted = exp_order[exp_mask], exp_sorted[exp_mask]
+
+    sim_clusters, exp_clusters = _get_clusters(sim_sorted, exp_sorted, max_distance)
+    num_clusters = max(sim_clusters[-1], exp_clusters[-1]) + 1
+    sim_counts = np.bincount(sim_clusters, minlength=num_clusters)
+    exp_counts = np.bincount(exp_clusters, minlength=num_clusters)
+
+    # a single peak of one set in a cluster is matched to its nearest peak of the other set
+    single_exp = np.flatnonzero((exp_counts == 1)[exp_clusters])
+    single_sim = np.flatnonzero(((sim_counts == 1) & (exp_counts > 1))[sim_clusters])
+
+    sim_pairs = [_nearest(exp_sorted[single_exp], sim_sorted), single_sim]
+    exp_pairs = [single_exp, _nearest(sim_sorted[single_sim], exp_sorted)]
+
+    sim_starts = np.cumsum(sim_counts) - sim_counts
+    exp_starts = np.cumsum(exp_counts) - exp_counts
+    multi = (sim_counts > 1) & (exp_counts > 1)
+
+    # the dynamic programming runs over the rows of the smaller set of every cluster
+    for sim_rows in (True, False):
+        clusters = np.flatnonzero(multi & ((sim_counts <= exp_counts) == sim_rows))
+
+        if sim_rows:
+            s_idx, e_idx = _match_clusters(
+                sim_sorted, exp_sorted, sim_starts[clusters], sim_counts[clusters],
+                exp_starts[clusters], exp_counts[clusters], max_distance,
+            )
+        else:
+            e_idx, s_idx = _match_clusters(
+                exp_sorted, sim_sorted, exp_starts[clusters], exp_counts[clusters],
+                sim_starts[clusters], sim_counts[clusters], max_distance,
+            )
+        sim_pairs.append(s_idx)
+        exp_pairs.append(e_idx)
+
+    sim_idx = sim_order[np.concatenate(sim_pairs)]
+    exp_idx = exp_order[np.concatenate(exp_pairs)]
+    order = np.argsort(sim_idx)
+
+    return sim_idx[order], exp_idx[order]
+
+
+def _has_neighbour(qs: np.ndarray, other_qs: np.ndarray, max_distance: float) -> np.ndarray:
+    """
+    Returns the mask of the sorted qs having a point of the sorted other_qs closer than max_distance.
+    """
+    idx = np.searchsorted(other_qs, qs)
+    right = other_qs[np.minimum(idx, other_qs.size - 1)] - qs
+    left = qs - other_qs[np.maximum(idx - 1, 0)]
+    return (np.abs(right) < max_distance) | (np.abs(left) < max_distance)
+
+
+def _nearest(qs: np.ndarray, other_qs: np.ndarray) -> np.ndarray:
+    """
+    Returns the indices of the nearest points of the sorted other_qs.
+    """
+    idx = np.minimum(np.searchsorted(other_qs, qs), other_qs.size - 1)
+    left = np.maximum(idx - 1, 0)
+    return np.where(np.abs(qs - other_qs[left]) <= np.abs(other_qs[idx] - qs), left, idx)
+
+
+def _get_clusters(sim_qs: np.ndarray, exp_qs: np.ndarray, max_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Splits the sorted positions of both sets into clusters separated by gaps >= max_distance,
+    no pair from different clusters can be matched. Returns the cluster ids of both arrays.
+    """
+    qs = np.sort(np.concatenate([sim_qs, exp_qs]))
+    edges = qs[1:][np.diff(qs) >= max_distance]
+    return np.searchsorted(edges, sim_qs, 'right'), np.searchsorted(edges, exp_qs, 'right')
+
+
+# max number of cells of the score tables processed at once
+_MAX_DP_CELLS: int = 2 ** 22
+
+
+def _match_clusters(
+        row_qs: np.ndarray,
+        col_qs: np.ndarray,
+        row_starts: np.ndarray,
+        row_counts: np.ndarray,
+        col_starts: np.ndarray,
+        col_counts: np.ndarray,
+        max_distance: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Non-crossing assignment of the sorted row and column points of every cluster maximizing the sum of
+    max_distance - distance over the pairs closer than max_distance. Clusters of similar size are padded
+    to score tables that are filled row by row (every row from the previous one with a running maximum)
+    and backtracked for all the clusters at once.
+    """
+    row_idx, col_idx = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+
+    for chunk in _get_chunks(row_counts, col_counts):
+        r, c = _match_padded(
+            _pad(row_qs, row_starts[chunk], row_counts[chunk]),
+            _pad(col_qs, col_starts[chunk], col_counts[chunk]),
+            row_counts[chunk], col_counts[chunk], max_distance,
+        )
+        row_idx.append(row_starts[chunk][r[0]] + r[1])
+        col_idx.append(col_starts[chunk][c[0]] + c[1])
+
+    return np.concatenate(row_idx), np.concatenate(col_idx)
+
+
+def _get_chunks(row_counts: np.ndarray, col_counts: np.ndarray) -> List[np.ndarray]:
+    """
+    Groups the clusters by the powers of two of their sizes to limit the padding.
+    """
+    buckets = np.ceil(np.log2(row_counts)).astype(np.int64) * 64 + np.ceil(np.log2(col_counts)).astype(np.int64)
+    order = np.argsort(buckets, kind='stable')
+    chunks = []
+
+    for group in np.split(order, np.flatnonzero(np.diff(buckets[order])) + 1) if order.size else []:
+        cells = (row_counts[group].max() + 1) * (col_counts[group].max() + 1)
+        chunks.extend(np.array_split(group, -(-group.size * cells // _MAX_DP_CELLS)))
+
+    return chunks
+
+
+def _pad(qs: np.ndarray, starts: np.ndarray, counts: np.ndarray, size: int = None) -> np.ndarray:
+    offsets = np.arange(counts.max() if size is None else size)
+    idx = np.minimum(starts[:, None] + offsets, qs.size - 1)
+    return np.where(offsets < counts[:, None], qs[idx], np.nan)
+
+
+def _match_padded(row_qs: np.ndarray, col_qs: np.ndarray, row_counts: np.ndarray, col_counts: np.ndarray,
+                  max_distance: float):
+    num_clusters, num_rows = row_qs.shape
+    weights = max_distance - np.abs(row_qs[:, :, None] - col_qs[:, None, :])
+    weights = np.where(weights > 0, weights, 0)  # nan for padding
+
+    scores = np.zeros((num_clusters, num_rows + 1, col_qs.shape[1] + 1))
+
+    for i in range(num_rows):
+        row = scores[:, i + 1]
+        row[:, 1:] = np.maximum(scores[:, i, 1:], scores[:, i, :-1] + weights[:, i])
+        np.maximum.accumulate(row, axis=1, out=row)
+
+    # backtracking on the flattened tables of all the clusters
+    row_stride, cluster_stride = scores.shape[2], scores.shape[1] * scores.shape[2]
+    scores = scores.ravel()
+    pos = np.arange(num_clusters) * cluster_stride + row_counts * row_stride + col_counts
+    i, j = row_counts.copy(), col_counts.copy()
+    matched = []
+
+    while True:
+        active = (i > 0) & (j > 0)
+        if not active.all():
+            if not active.any():
+                break
+            pos, i, j = pos[active], i[active], j[active]
+        current = scores[pos]
+        up = current == scores[pos - row_stride]
+        left = ~up & (current == scores[pos - 1])
+        match = ~up & ~left
+        matched.append((pos[match] // cluster_stride, i[match] - 1, j[match] - 1))
+        step_up, step_left = up | match, left | match
+        i = i - step_up
+        j = j - step_left
+        pos = pos - step_up * row_stride - step_left
+
+    if not matched:
+        empty = np.zeros(0, dtype=np.int64)
+        return (empty, empty), (empty, empty)
+
+    a, i, j = map(np.concatenate, zip(*matched))
+    return (a, i), (a, j)
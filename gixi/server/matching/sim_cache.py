@@ -0,0 +1,58 @@
+import os
+import logging
+import hashlib
+from typing import Tuple
+from pathlib import Path
+
+import numpy as np
+
+__all__ = [
+    'SimulationCache',
+]
+
+# increment to invalidate the cache when the simulation changes
+_CACHE_VERSION: int = 1
+
+SimResults = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class SimulationCache(object):
+    """
+    Persistent cache of simulated diffraction peaks keyed by the CIF file content, q_max and wavelength.
+    """
+
+    def __init__(self, folder: Path):
+        self.log = logging.getLogger(__name__)
+        self.folder = Path(folder)
+
+    def key(self, cif_path: Path, q_max: float, wavelength: float) -> str:
+        h = hashlib.sha1(Path(cif_path).read_bytes())
+        h.update(f'{_CACHE_VERSION}:{float(q_max)!r}:{float(wavelength)!r}'.encode())
+        return h.hexdigest()
+
+    def load(self, key: str) -> SimResults or None:
+        path = self._path(key)
+
+        if not path.is_file():
+            return
+
+        try:
+            with np.load(str(path), allow_pickle=True) as f:
+                return f['q_pos'], f['intensities'], f['miller_indices']
+        except Exception as err:
+            self.log.warning(f'Could not read simulation cache entry {path}: {err}')
+
+    def save(self, key: str, q_pos: np.ndarray, intensities: np.ndarray, miller_indices: np.ndarray):
+        path = self._path(key)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp_path), 'wb') as f:
+                np.savez(f, q_pos=q_pos, intensities=intensities, miller_indices=np.asarray(miller_indices))
+            os.replace(str(tmp_path), str(path))
+        except OSError as err:
+            self.log.warning(f'Could not write simulation cache entry {path}: {err}')
+
+    def _path(self, key: str) -> Path:
+        return self.folder / f'{key}.npz'
@@ -1,9 +1,6 @@
-from typing import Union
+from typing import Union, TYPE_CHECKING
 from pathlib import Path
 
-from xrayutilities.materials import Crystal
-from xrayutilities.utilities import lam2en
-
 import numpy as np
 
 import numpy
@@ -12,13 +9,20 @@ from numpy import abs as nabs
 from numpy import cos as ncos
 from numpy import sin as nsin
 
+if TYPE_CHECKING:
+    from xrayutilities.materials import Crystal
+
 
 def simulate_diffraction_peaks(
-        mat: Union[Crystal, str, Path],
+        mat: Union['Crystal', str, Path],
         q_max: float,
         wavelength: float,
         normalize: bool = True,
 ):
+    # xrayutilities is slow to import, only the processes simulating new structures need it
+    from xrayutilities.materials import Crystal
+    from xrayutilities.utilities import lam2en
+
     if not isinstance(mat, Crystal):
         mat = Crystal.fromCIF(mat)
 
@@ -42,7 +46,7 @@ def simulate_diffraction_peaks(
     return q_pos, intensities, miller_indices
 
 
-def _reflection_strength(mat: Crystal, qmax: float, energy: float):
+def _reflection_strength(mat: 'Crystal', qmax: float, energy: float):
     """
     determine structure factors/reflection strength of all Bragg peaks up
     to tt_cutoff. This function also implements the March-Dollase model for
@@ -68,6 +72,10 @@ def _reflection_strength(mat: Crystal, qmax: float, energy: float):
     return data
 
 
+# tolerance of numpy.isclose(q, 0) used to merge lines at the same q-position
+_Q_MERGE_TOL: float = 1e-8
+
+
 def _merge_lines(data):
     """
     if calculation is isotropic lines at the same q-position can be merged
@@ -87,37 +95,61 @@ def _merge_lines(data):
         reflection strength of the material
     """
     data.sort(order=['q', 'hkl'])
-    qpos = []
-    refstrength = []
-    hkl = []
-
-    def add_lines(q, ref, chkl):
-        for R, m in zip(ref, chkl):
-            qpos.append(q)
-            refstrength.append(R)
-            hkl.append(m)
-
-    currq = -1
-    curref = []
-    currhkl = []
-
-    for r in data:
-        if not numpy.isclose(r[0] - currq, 0):
-            add_lines(currq, curref, currhkl)
-            currq = r[0]
-            curref = [r[1], ]
-            currhkl = [r[2], ]
-        else:
-            curref[-1] += r[1]
-            currhkl[-1] = r[2]
-    # add remaining lines
-    add_lines(currq, curref, currhkl)
-
-    qpos = numpy.array(qpos, dtype=numpy.double)
-    refstrength = numpy.array(refstrength, dtype=numpy.double)
+
+    if not data.size:
+        return [], numpy.zeros(0, dtype=numpy.double), numpy.zeros(0, dtype=numpy.double)
+
+    q = data['q']
+    starts = numpy.flatnonzero(numpy.diff(q) > _Q_MERGE_TOL) + 1
+    starts = numpy.insert(starts, 0, 0)
+    ends = numpy.append(starts[1:], q.size) - 1
+
+    if numpy.any(q - numpy.repeat(q[starts], ends - starts + 1) > _Q_MERGE_TOL):
+        # a chain of close lines spans more than the tolerance, every line is compared to the first one of its group
+        starts = _get_group_starts(q)
+        ends = numpy.append(starts[1:], q.size) - 1
+
+    qpos = numpy.array(q[starts], dtype=numpy.double)
+    refstrength = _sum_groups(numpy.asarray(data['r'], dtype=numpy.double), starts, ends)
+    hkl = list(data['hkl'][ends])
+
     return hkl, qpos, refstrength
 
 
+def _get_group_starts(q: numpy.ndarray) -> numpy.ndarray:
+    """
+    Returns the first indices of the groups of sorted q-positions within the tolerance of the first q of the group.
+    """
+    starts = [0]
+
+    while True:
+        start = starts[-1]
+        end = int(numpy.searchsorted(q, q[start] + _Q_MERGE_TOL, side='right'))
+        # correct the rounding of q[start] + _Q_MERGE_TOL
+        while end < q.size and q[end] - q[start] <= _Q_MERGE_TOL:
+            end += 1
+        while end > start + 1 and q[end - 1] - q[start] > _Q_MERGE_TOL:
+            end -= 1
+        if end >= q.size:
+            return numpy.array(starts)
+        starts.append(end)
+
+
+def _sum_groups(values: numpy.ndarray, starts: numpy.ndarray, ends: numpy.ndarray) -> numpy.ndarray:
+    """
+    Sums the values of every group in their order. Unlike numpy.add.reduceat (pairwise summation),
+    the result is bitwise identical to adding the lines one by one.
+    """
+    sums = values[starts].copy()
+    lengths = ends - starts + 1
+
+    for offset in range(1, lengths.max()):
+        groups = lengths > offset
+        sums[groups] += values[starts[groups] + offset]
+
+    return sums
+
+
 def _get_correction_factor(ang):
     """
     calculate the correction factor for the diffracted intensities. This
@@ -1,8 +1,8 @@
+import sys
 from pathlib import Path
 
 import numpy as np
 from PIL import Image
-from torch import Tensor
 
 __all__ = [
     'to_np',
@@ -13,7 +13,10 @@ __all__ = [
 
 
 def to_np(arr):
-    if isinstance(arr, Tensor):
+    # an array cannot be a tensor if torch has not been imported
+    torch = sys.modules.get('torch')
+
+    if torch is not None and isinstance(arr, torch.Tensor):
         arr = arr.detach().cpu().numpy()
     return arr
 
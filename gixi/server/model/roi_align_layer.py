@@ -8,21 +8,28 @@ from torchvision.ops.roi_align import RoIAlign as BasicRoiAlign
 
 
 class ChooseFeatureMaps(nn.Module):
-    def forward(self, boxes: Tensor) -> List[Tensor]:
+    num_of_maps: int = 1
+
+    def level_ids(self, boxes: Tensor) -> Tensor:
+        """
+        Returns an int64 tensor of shape (num_boxes, ) with the index of the feature map assigned to each box.
+        """
         raise NotImplementedError
 
+    def forward(self, boxes: Tensor) -> List[Tensor]:
+        levels = self.level_ids(boxes)
+        return [levels == i for i in range(self.num_of_maps)]
+
 
 class ChooseByHeight(ChooseFeatureMaps):
     def __init__(self, height_thresh: float = 250):
         super().__init__()
         self.register_buffer('height_thresh', torch.tensor(height_thresh))
+        self.num_of_maps = 2
 
-    def forward(self, boxes: Tensor) -> List[Tensor]:
+    def level_ids(self, boxes: Tensor) -> Tensor:
         heights = boxes[:, 3] - boxes[:, 1]
-        first_map_indices: Tensor = heights < self.height_thresh
-        second_map_indices: Tensor = ~first_map_indices
-
-        return [first_map_indices, second_map_indices]
+        return (heights >= self.height_thresh).to(torch.int64)
 
 
 class ChooseOneMap(ChooseFeatureMaps):
@@ -31,20 +38,17 @@ class ChooseOneMap(ChooseFeatureMaps):
         self.idx = idx
         self.num_of_maps = num_of_maps
 
-    def forward(self, boxes: Tensor) -> List[Tensor]:
-        return [
-            torch.ones(*boxes.shape[:-1], dtype=torch.bool, device=boxes.device)
-            if i == self.idx else
-            torch.zeros(*boxes.shape[:-1], dtype=torch.bool, device=boxes.device)
-            for i in range(self.num_of_maps)
-        ]
+    @property
+    def single_level(self) -> int:
+        return self.idx
 
-
-class ChooseFirstMap(ChooseFeatureMaps):
-    def forward(self, boxes: Tensor) -> List[Tensor]:
-        return [torch.ones(*boxes.shape[:-1], dtype=torch.bool, device=boxes.device)]
+    def level_ids(self, boxes: Tensor) -> Tensor:
+        return torch.full(boxes.shape[:-1], self.idx, dtype=torch.int64, device=boxes.device)
 
 
+class ChooseFirstMap(ChooseOneMap):
+    def __init__(self):
+        super().__init__(0, 1)
 
 
 class RoiAlign(nn.Module):
@@ -59,31 +63,36 @@ class RoiAlign(nn.Module):
         self.choose_map = choose_map or ChooseByHeight()
         self.roi_align = BasicRoiAlign((height, width), 1., -1)
 
+        self.output_size = (height, width)
         self.size = height * width
 
     def forward(self, feature_maps: List[Tensor], boxes: List[Tensor]):
         boxes, img_indices = _cat_boxes(boxes)
 
-        feature_indices = self.choose_map(boxes)
+        assert self.choose_map.num_of_maps == len(feature_maps)
 
-        assert len(feature_indices) == len(feature_maps)
+        single_level = getattr(self.choose_map, 'single_level', None)
 
-        rescaled_boxes = []
+        if single_level is not None:
+            # all the boxes go to the same feature map, no need to gather & scatter the results
+            return self._roi_align(feature_maps[single_level], boxes, img_indices, self.scales[single_level])
 
-        for feature_map, indices, scales in zip(feature_maps, feature_indices, self.scales):
-            if torch.any(indices):
-                scaled_boxes = _rescale_boxes(boxes[indices], scales)
-                rois = torch.cat([img_indices[indices][:, None], scaled_boxes], dim=1)
-                rescaled_boxes.append(self.roi_align(feature_map, rois))
+        levels = self.choose_map.level_ids(boxes)
 
-        rescaled_boxes = torch.cat(rescaled_boxes)
+        rescaled_boxes = feature_maps[0].new_empty((boxes.shape[0], feature_maps[0].shape[1], *self.output_size))
 
-        if len(feature_maps) > 1:
-            indices_order = torch.argsort(torch.cat([torch.where(fi)[0] for fi in feature_indices]))
-            rescaled_boxes = rescaled_boxes[indices_order]
+        for level, (feature_map, scales) in enumerate(zip(feature_maps, self.scales)):
+            indices = torch.where(levels == level)[0]
+            if indices.numel():
+                rescaled_boxes[indices] = self._roi_align(feature_map, boxes[indices], img_indices[indices], scales)
 
         return rescaled_boxes
 
+    def _roi_align(self, feature_map: Tensor, boxes: Tensor, img_indices: Tensor, scales: Tensor) -> Tensor:
+        scaled_boxes = _rescale_boxes(boxes, scales)
+        rois = torch.cat([img_indices[:, None].to(scaled_boxes.dtype), scaled_boxes], dim=1)
+        return self.roi_align(feature_map, rois)
+
 
 def _init_scales(feature_map_sizes: Tuple[Tuple[int, int], ...], img_size: Tuple[int, int]):
     return [(f[0] / img_size[0], f[1] / img_size[1]) for f in feature_map_sizes]
@@ -12,8 +12,8 @@ from .model import (
 from gixi.server.app_config import AppConfig
 
 
-def get_basic_model(config: AppConfig):
-    device = config.device
+def get_basic_model(config: AppConfig, device: str = None, load_weights: bool = True):
+    device = device or config.device
     model_name = config.model_config.name
 
     backbone = BackboneWithFPN(
@@ -49,5 +49,6 @@ def get_basic_model(config: AppConfig):
         score_thresh=config.postprocessing_config.score_level,
     ).to(device).eval()
 
-    model.load_model(model_name, device=device)
+    if load_weights:
+        model.load_model(model_name, device=device)
     return model
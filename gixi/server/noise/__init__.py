@@ -1 +1 @@
-from .perlin import perlin
+from .perlin import perlin, perlin_batch
@@ -1,6 +1,6 @@
 import torch
 
-__all__ = ['perlin', 'perlin_octave']
+__all__ = ['perlin', 'perlin_octave', 'perlin_batch', 'perlin_octave_batch']
 
 
 def perlin(octave_rates: tuple = (1, 2, 3, 4),
@@ -33,5 +33,41 @@ def perlin_octave(width, height, scale, device='cuda'):
     return dots.permute(0, 2, 1, 3).contiguous().view(width * scale, height * scale)
 
 
+def perlin_batch(batch_size: int,
+                 octave_rates: tuple = (1, 2, 3, 4),
+                 weights: torch.Tensor = None,
+                 amp: float = 1., size: int = 512, device='cuda', generator: torch.Generator = None):
+    """
+    A batch of independent perlin noise images of shape (batch_size, size, size),
+    weights of the octaves are given per image (batch_size, len(octave_rates)).
+    """
+    p = 0
+
+    for i, rate in enumerate(octave_rates):
+        octave = 2 ** rate
+        octave_noise = perlin_octave_batch(batch_size, octave, octave, size // octave, device, generator)
+        p = p + (octave_noise * weights[:, i, None, None] if weights is not None else octave_noise)
+
+    p_min, p_max = p.amin((1, 2), keepdim=True), p.amax((1, 2), keepdim=True)
+    return ((p - p_min) / (p_max - p_min) - 0.5) * amp + 1
+
+
+def perlin_octave_batch(batch_size: int, width, height, scale, device='cuda', generator: torch.Generator = None):
+    gx, gy = torch.randn(2, batch_size, width + 1, height + 1, 1, 1, device=device, generator=generator)
+    xs = torch.linspace(0, 1, scale + 1, device=device)[:-1, None]
+    ys = torch.linspace(0, 1, scale + 1, device=device)[None, :-1]
+
+    wx = 1 - interp(xs)
+    wy = 1 - interp(ys)
+
+    dots = 0
+    dots += wx * wy * (gx[:, :-1, :-1] * xs + gy[:, :-1, :-1] * ys)
+    dots += (1 - wx) * wy * (-gx[:, 1:, :-1] * (1 - xs) + gy[:, 1:, :-1] * ys)
+    dots += wx * (1 - wy) * (gx[:, :-1, 1:] * xs - gy[:, :-1, 1:] * (1 - ys))
+    dots += (1 - wx) * (1 - wy) * (-gx[:, 1:, 1:] * (1 - xs) - gy[:, 1:, 1:] * (1 - ys))
+
+    return dots.permute(0, 1, 3, 2, 4).reshape(batch_size, width * scale, height * scale)
+
+
 def interp(t):
     return 6 * t ** 5 - 15 * t ** 4 + 10 * t ** 3
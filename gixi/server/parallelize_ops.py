@@ -1,5 +1,5 @@
 import sys
-from typing import List, Type
+from typing import List, Type, Tuple, Union, Sequence
 import logging
 from logging.handlers import QueueHandler
 import threading
@@ -7,7 +7,7 @@ from contextlib import contextmanager
 from queue import Empty
 
 import multiprocessing
-from multiprocessing import Queue, Process
+from multiprocessing import Queue
 
 
 class SharedResources(object):
@@ -65,11 +65,14 @@ class Workers(object):
     def __call__(self, worker: int, logger_queue: Queue, resources: SharedResources, kwargs: dict, log_level: int):
         self.init(worker, logger_queue, resources, log_level)
         try:
-            self.method_name = resources.message_queue.get_nowait()
+            message = resources.message_queue.get_nowait()
         except Empty:
             self.log.warning(f'No methods left for the process.')
             return
 
+        self.method_name, method_kwargs = _parse_message(message)
+        kwargs = dict(kwargs, **method_kwargs)
+
         method = getattr(self, self.method_name, self.unknown_method)
 
         process_id = multiprocessing.current_process()
@@ -89,17 +92,36 @@ class Workers(object):
         self.log.error('Unknown method called!')
 
 
+def _parse_message(message: Union[str, Tuple[str, dict]]) -> Tuple[str, dict]:
+    if isinstance(message, str):
+        return message, {}
+    method_name, method_kwargs = message
+    return method_name, dict(method_kwargs)
+
+
 @contextmanager
 def run_pool(workers: Type[Workers],
              resources: SharedResources,
-             worker_methods: List[str],
+             worker_methods: List[Union[str, Tuple[str, dict]]],
              log_level: int = logging.INFO,
+             start_method: str = None,
+             preload: Sequence[str] = (),
              **kwargs):
-    with _set_logger_queue() as logger_queue:
+    """
+    Starts a process per worker method. start_method is 'fork', 'spawn' or 'forkserver'
+    (the default of the platform if None), the forkserver imports the preload modules once
+    and forks the workers from them.
+    """
+    context = multiprocessing.get_context(start_method)
+
+    if context.get_start_method() == 'forkserver' and preload:
+        context.set_forkserver_preload(list(preload))
+
+    with _set_logger_queue(context) as logger_queue:
         for method in worker_methods:
             resources.message_queue.put_nowait(method)
         processes = [
-            Process(target=workers(),
+            context.Process(target=workers(),
                     args=(worker, logger_queue, resources, kwargs, log_level))
             for worker in range(len(worker_methods))
         ]
@@ -123,8 +145,8 @@ def run_pool(workers: Type[Workers],
 
 
 @contextmanager
-def _set_logger_queue():
-    logger_queue = Queue()
+def _set_logger_queue(context=multiprocessing):
+    logger_queue = context.Queue()
     listener = threading.Thread(target=_logger_thread, args=(logger_queue,))
     listener.start()
     yield logger_queue
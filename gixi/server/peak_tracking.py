@@ -0,0 +1,178 @@
+import heapq
+import logging
+from typing import NamedTuple, List
+from pathlib import Path
+
+import numpy as np
+import h5py
+
+from gixi.server.app_config import AppConfig
+from gixi.server.connect_peaks import give_matching_indices
+
+__all__ = [
+    'PeakTracker',
+    'TRACKS_FILENAME',
+]
+
+TRACKS_FILENAME: str = 'tracks.h5'
+
+_TRACK_COLUMNS = (
+    ('track_id', np.int64),
+    ('frame_idx', np.int64),
+    ('q', np.float32),
+    ('angle', np.float32),
+    ('q_width', np.float32),
+    ('angle_width', np.float32),
+    ('intensity', np.float32),
+    ('score', np.float32),
+)
+
+_CHUNK_SIZE: int = 4096
+
+
+class _Frame(NamedTuple):
+    frame_idx: int
+    prev_frame_idx: int
+    name: str
+    boxes: np.ndarray
+    intensities: np.ndarray
+    scores: np.ndarray
+
+
+class PeakTracker(object):
+    """
+    Links the detected boxes of consecutive frames into peak tracks and appends the tracks to an h5 table.
+
+    Frames may arrive out of order, they are buffered until the previous frame (prev_frame_idx)
+    is tracked, until more than max_pending frames are waiting or until the newest frame is more than
+    max_frame_lag frames ahead (frames that fail processing never arrive).
+    Every row of the 'tracks' group is a peak of a frame: track id, frame index, q (1/Ang),
+    angle (deg), widths, intensity and score.
+    If the job is resumed, the rows are appended to the existing file and the new tracks get new ids.
+    """
+
+    def __init__(self, config: AppConfig, path: Path):
+        self.log = logging.getLogger(__name__)
+        self.iou_thresh = config.tracking_config.iou_thresh
+        self.max_pending = config.tracking_config.max_pending
+        self.max_frame_lag = config.tracking_config.max_frame_lag
+        self.path = Path(path)
+
+        polar_config = config.polar_config
+        self._pixel_scale = np.array([polar_config.q_size, polar_config.angular_size] * 2)[None]
+        self._units_scale = np.array([config.q_space.q_max, 90] * 2)[None]
+
+        self._pending: List[tuple] = []
+        self._last_frame_idx: int = -1
+        self._newest_frame_idx: int = -1
+        self._prev_boxes: np.ndarray = np.zeros((0, 4))
+        self._prev_track_ids: np.ndarray = np.zeros(0, dtype=np.int64)
+        self._next_track_id: int = 0
+        self._num_rows: int = 0
+
+        if config.job_config.resume and self.path.is_file():
+            self._open_previous()
+        else:
+            self._create()
+
+    def _create(self):
+        self._file = h5py.File(str(self.path), 'w')
+        self._tracks = self._file.create_group('tracks')
+        self._frames = self._file.create_group('frames')
+
+        for name, dtype in _TRACK_COLUMNS:
+            self._tracks.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(_CHUNK_SIZE,))
+
+        self._frames.create_dataset('frame_idx', shape=(0,), maxshape=(None,), dtype=np.int64, chunks=True)
+        self._frames.create_dataset('name', shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(), chunks=True)
+
+    def _open_previous(self):
+        self._file = h5py.File(str(self.path), 'a')
+        self._tracks = self._file['tracks']
+        self._frames = self._file['frames']
+
+        track_ids = self._tracks['track_id'][()]
+        self._num_rows = track_ids.size
+        self._next_track_id = int(track_ids.max()) + 1 if track_ids.size else 0
+
+        # the frames tracked by the previous run are not sent again, the tracks are not continued
+        frame_ids = self._frames['frame_idx'][()]
+        self._last_frame_idx = self._newest_frame_idx = int(frame_ids.max()) if frame_ids.size else -1
+        self.log.info(f'Resume peak tracking: {self._next_track_id} tracks ({self._num_rows} peaks) in {self.path}')
+
+    def add(self, data_dict: dict, name: str):
+        if 'frame_idx' not in data_dict:
+            return
+
+        boxes = data_dict['boxes']
+
+        frame = _Frame(
+            data_dict['frame_idx'],
+            data_dict.get('prev_frame_idx', -1),
+            name,
+            boxes,
+            data_dict.get('intensities', np.full(len(boxes), np.nan)),
+            data_dict.get('scores', np.full(len(boxes), np.nan)),
+        )
+        heapq.heappush(self._pending, (frame.frame_idx, frame))
+        self._newest_frame_idx = max(self._newest_frame_idx, frame.frame_idx)
+
+        while self._pending and (
+                self._pending[0][1].prev_frame_idx <= self._last_frame_idx or
+                len(self._pending) > self.max_pending or
+                self._newest_frame_idx - self._pending[0][0] > self.max_frame_lag
+        ):
+            self._track(heapq.heappop(self._pending)[1])
+
+    def close(self):
+        while self._pending:
+            self._track(heapq.heappop(self._pending)[1])
+
+        self._file.close()
+        self.log.info(f'Saved {self._next_track_id} peak tracks ({self._num_rows} peaks) to {self.path}')
+
+    def _track(self, frame: _Frame):
+        boxes = frame.boxes * self._pixel_scale
+        track_ids = np.full(len(boxes), -1, dtype=np.int64)
+
+        current_ind, prev_ind, _ = give_matching_indices(boxes, self._prev_boxes, self.iou_thresh)
+        track_ids[current_ind] = self._prev_track_ids[prev_ind]
+
+        new_tracks = track_ids == -1
+        track_ids[new_tracks] = np.arange(self._next_track_id, self._next_track_id + new_tracks.sum())
+        self._next_track_id += int(new_tracks.sum())
+
+        self._prev_boxes, self._prev_track_ids = boxes, track_ids
+        self._last_frame_idx = max(self._last_frame_idx, frame.frame_idx)
+
+        self._write(frame, track_ids)
+
+    def _write(self, frame: _Frame, track_ids: np.ndarray):
+        boxes = frame.boxes * self._units_scale
+        columns = dict(
+            track_id=track_ids,
+            frame_idx=np.full(len(track_ids), frame.frame_idx),
+            q=(boxes[:, 0] + boxes[:, 2]) / 2,
+            angle=(boxes[:, 1] + boxes[:, 3]) / 2,
+            q_width=boxes[:, 2] - boxes[:, 0],
+            angle_width=boxes[:, 3] - boxes[:, 1],
+            intensity=frame.intensities,
+            score=frame.scores,
+        )
+
+        num_rows = self._num_rows + len(track_ids)
+
+        for name, _ in _TRACK_COLUMNS:
+            dset = self._tracks[name]
+            dset.resize((num_rows,))
+            dset[self._num_rows:] = columns[name]
+
+        self._num_rows = num_rows
+
+        num_frames = self._frames['frame_idx'].shape[0] + 1
+
+        for name, value in (('frame_idx', frame.frame_idx), ('name', frame.name)):
+            self._frames[name].resize((num_frames,))
+            self._frames[name][-1] = value
+
+        self._file.flush()
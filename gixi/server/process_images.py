@@ -0,0 +1,92 @@
+import logging
+from typing import Tuple, Dict, Any
+from pathlib import Path
+import warnings
+
+import numpy as np
+
+from gixi.server.img_processing.conversions import PolarInterpolation, QInterpolation
+from gixi.server.img_processing.contrast_correction import ContrastCorrection
+from gixi.server.app_config import AppConfig
+from gixi.server.misc import read_image
+from gixi.server.time_record import TimeRecorder
+from gixi.server.result_cache import ResultCache, FRAME_KEY
+
+__all__ = [
+    'ProcessImages',
+]
+
+
+class ProcessImages(object):
+    def __init__(self,
+                 config: AppConfig,
+                 time_recorder: TimeRecorder = None,
+                 grids: Dict[str, Tuple[np.ndarray, np.ndarray]] = None,
+                 ):
+        self.time_recorder = time_recorder or TimeRecorder('process_images', no_record=config.log_config.no_time_record)
+
+        self.log = logging.getLogger(__name__)
+        self.device: str = config.device
+        self.config = config
+
+        self.contrast = ContrastCorrection(config.contrast)
+        grids = grids or {}
+        self.q_interp = QInterpolation(config, grids.get('q'))
+        self.p_interp = PolarInterpolation(config, grids.get('polar'))
+        self.cache = ResultCache(config)
+
+        self._save_img = config.save_config.save_img
+        self._save_q_img = config.save_config.save_q_img
+        self._save_polar_img = config.save_config.save_polar_img
+
+    def polar_interpolation(self, img: np.ndarray):
+        with self.time_recorder('polar'):
+            return self.p_interp(img)
+
+    def q_interpolation(self, img: np.ndarray):
+        with self.time_recorder('q_space'):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                return self.q_interp(img)
+
+    def __call__(self, img_paths: Tuple[Path, ...], frame: Tuple[int, int] = None) -> Dict[str, Any] or None:
+        try:
+            frame_key = self.cache.frame_key(img_paths)
+            cached = self.cache.load('process', frame_key)
+
+            res_dict = {'paths': img_paths}
+
+            if frame:
+                res_dict['frame_idx'], res_dict['prev_frame_idx'] = frame
+
+            if frame_key:
+                res_dict[FRAME_KEY] = frame_key
+
+            if cached is None or self._save_img or self._save_q_img:
+                with self.time_recorder('read'):
+                    img = np.sum([read_image(path) for path in img_paths], 0)
+
+                if img.shape != self.q_interp.expected_shape:
+                    return
+
+                if self._save_img:
+                    res_dict['img'] = img
+                if self._save_q_img:
+                    res_dict['q_img'] = self.q_interpolation(img)
+
+            if cached is None:
+                polar_img = self.polar_interpolation(img)
+                processed_img = self.contrast(polar_img)
+                self.cache.save('process', frame_key, dict(polar_img=polar_img, processed_img=processed_img))
+            else:
+                polar_img, processed_img = cached['polar_img'], cached['processed_img']
+
+            if self._save_polar_img:
+                res_dict['polar_img'] = polar_img
+
+            res_dict['processed_img'] = processed_img
+
+            return res_dict
+        except Exception as err:
+            self.log.exception(err)
+            return
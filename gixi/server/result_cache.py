@@ -0,0 +1,111 @@
+import os
+import json
+import logging
+import hashlib
+from typing import Tuple, Dict
+from pathlib import Path
+
+import numpy as np
+
+from gixi.server.app_config import AppConfig
+
+__all__ = [
+    'ResultCache',
+    'FRAME_KEY',
+]
+
+FRAME_KEY: str = 'frame_key'
+
+# config sections the results of every stage depend on
+_STAGE_CONFIGS: Dict[str, Tuple[str, ...]] = {
+    'process': ('q_space', 'polar_config', 'contrast'),
+    'detect': ('q_space', 'polar_config', 'contrast', 'model_config', 'postprocessing_config'),
+}
+
+
+class ResultCache(object):
+    """
+    On-disk cache of per-batch intermediate results. Entries are keyed by the identity of the input
+    files (path, size, mtime) and by the config sections the stage depends on, so a rerun with other
+    save or matching parameters skips interpolation and detection for unchanged images.
+    """
+
+    def __init__(self, config: AppConfig):
+        self.log = logging.getLogger(__name__)
+        self.enabled = config.cache_config.use_cache
+
+        if config.cache_config.cache_dir:
+            self.folder = Path(config.cache_config.cache_dir).expanduser()
+        else:
+            self.folder = config.dest_path / '.gixi_cache'
+
+        self._stage_hashes = {stage: _get_stage_hash(config, stage) for stage in _STAGE_CONFIGS.keys()}
+
+    def frame_key(self, paths: Tuple[Path, ...]) -> str or None:
+        if not self.enabled:
+            return
+
+        h = hashlib.sha1()
+
+        for path in paths:
+            stat = os.stat(str(path))
+            h.update(f'{str(path)}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+
+        return h.hexdigest()
+
+    def load(self, stage: str, frame_key: str or None) -> Dict[str, np.ndarray] or None:
+        if not frame_key:
+            return
+
+        path = self._path(stage, frame_key)
+
+        if not path.is_file():
+            return
+
+        try:
+            with np.load(str(path)) as f:
+                return {k: f[k] for k in f.files}
+        except Exception as err:
+            self.log.warning(f'Could not read cache entry {path}: {err}')
+
+    def save(self, stage: str, frame_key: str or None, data: Dict[str, np.ndarray]):
+        if not frame_key:
+            return
+
+        path = self._path(stage, frame_key)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp_path), 'wb') as f:
+                np.savez(f, **data)
+            os.replace(str(tmp_path), str(path))
+        except OSError as err:
+            self.log.warning(f'Could not write cache entry {path}: {err}')
+
+    def _path(self, stage: str, frame_key: str) -> Path:
+        key = hashlib.sha1(f'{frame_key}:{self._stage_hashes[stage]}'.encode()).hexdigest()
+        return self.folder / stage / key[:2] / f'{key}.npz'
+
+
+def _get_stage_hash(config: AppConfig, stage: str) -> str:
+    conf_dict = {name: getattr(config, name).asdict() for name in _STAGE_CONFIGS[stage]}
+
+    if stage == 'detect':
+        conf_dict['model_file'] = _get_model_file_id(config.model_config.name)
+
+    return hashlib.sha1(json.dumps(conf_dict, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _get_model_file_id(name: str) -> str:
+    from gixi.server.ml import ModelMixin
+
+    if '.h5' not in name:
+        name = f'{name}.h5'
+    path = ModelMixin.MODEL_DIR / name
+
+    try:
+        stat = path.stat()
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+    except OSError:
+        return ''
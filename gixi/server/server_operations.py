@@ -1,36 +1,37 @@
 import logging
-from typing import Tuple, List, Dict, Any
-from pathlib import Path
+from typing import Tuple, List
 import sys
-import warnings
 
 import numpy as np
 import torch
 
 from gixi.server.models_collection import get_basic_model
-from gixi.server.img_processing import (
-    PolarInterpolation,
-    QInterpolation,
-    ContrastCorrection,
-)
 from gixi.server.app_config import AppConfig
-from gixi.server.misc import to_np, read_image
+from gixi.server.misc import to_np
 from gixi.server.time_record import TimeRecorder
 from gixi.server.matching import MatchDiffractionPatterns
+from gixi.server.result_cache import ResultCache, FRAME_KEY
+from gixi.server.process_images import ProcessImages  # noqa: F401
 
 
 class FeatureDetector(object):
-    def __init__(self, config: AppConfig, time_recorder: TimeRecorder = None):
+    def __init__(self,
+                 config: AppConfig,
+                 time_recorder: TimeRecorder = None,
+                 device: str = None,
+                 match_peaks: bool = True,
+                 ):
         self.log = logging.getLogger(__name__)
         self.time_recorder = time_recorder or TimeRecorder('detector', no_record=config.log_config.no_time_record)
-        self.device: torch.device = config.device
+        self.device: torch.device = device or config.device
         self.config = config
         self._scale = _init_scale(config)
-        self.matching = MatchDiffractionPatterns(config)
+        self.matching = MatchDiffractionPatterns(config) if match_peaks else None
+        self.cache = ResultCache(config)
 
         try:
             with self.time_recorder('load_model'):
-                self.model = get_basic_model(config)
+                self.model = get_basic_model(config, self.device)
             self.log.debug('Model loaded successfully!')
         except Exception as err:
             self.model = None
@@ -42,83 +43,48 @@ class FeatureDetector(object):
 
     @torch.no_grad()
     def __call__(self, data_list: List[dict]) -> List[dict]:
-        polar_images = torch.tensor(
-            [data['processed_img'] for data in data_list],
-            dtype=torch.float32,
-            device=self.device
-        )[:, None]
-
-        with self.time_recorder('model'):
-            boxes_list, scores_list = self.model(polar_images)
-
         save_intensities = _get_save_intensities_func(self.config, self.time_recorder)
 
-        for data_dict, boxes, scores in zip(data_list, boxes_list, scores_list):
-            boxes = to_np(boxes)
+        for data_dict, (boxes, scores) in zip(data_list, self.detect(data_list)):
             data_dict['boxes'] = boxes * self._scale
-            data_dict['scores'] = to_np(scores)
+            data_dict['scores'] = scores
             save_intensities(data_dict, boxes)
 
+        if self.matching:
             with self.time_recorder('matching'):
-                self.matching(data_dict)
+                self.matching.match_batch(data_list)
 
         self.log.debug(f'data_dict keys: {data_list[0].keys()}')
 
         return data_list
 
+    @torch.no_grad()
+    def detect(self, data_list: List[dict]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns boxes (in polar image pixels) and scores for each image, runs the model only for
+        the images without cached results.
+        """
+        results = [self.cache.load('detect', data.get(FRAME_KEY)) for data in data_list]
+        results = [(res['boxes'], res['scores']) if res else None for res in results]
+        missing = [i for i, res in enumerate(results) if res is None]
+
+        if not missing:
+            return results
 
-class ProcessImages(object):
-    def __init__(self, config: AppConfig, time_recorder: TimeRecorder = None):
-        self.time_recorder = time_recorder or TimeRecorder('process_images', no_record=config.log_config.no_time_record)
-
-        self.log = logging.getLogger(__name__)
-        self.device: torch.device = config.device
-        self.config = config
-
-        self.contrast = ContrastCorrection(config.contrast)
-        self.q_interp = QInterpolation(config)
-        self.p_interp = PolarInterpolation(config)
-
-        self._save_img = config.save_config.save_img
-        self._save_q_img = config.save_config.save_q_img
-        self._save_polar_img = config.save_config.save_polar_img
-
-    def polar_interpolation(self, img: np.ndarray):
-        with self.time_recorder('polar'):
-            return self.p_interp(img)
-
-    def q_interpolation(self, img: np.ndarray):
-        with self.time_recorder('q_space'):
-            with warnings.catch_warnings():
-                warnings.simplefilter('ignore', category=RuntimeWarning)
-                return self.q_interp(img)
-
-    def __call__(self, img_paths: Tuple[Path, ...]) -> Dict[str, Any] or None:
-        try:
-            with self.time_recorder('read'):
-                img = np.sum([read_image(path) for path in img_paths], 0)
-
-            if img.shape != self.q_interp.expected_shape:
-                return
-
-            res_dict = {'paths': img_paths}
-
-            if self._save_img:
-                res_dict['img'] = img
-            if self._save_q_img:
-                res_dict['q_img'] = self.q_interpolation(img)
-
-            polar_img = self.polar_interpolation(img)
+        polar_images = torch.tensor(
+            [data_list[i]['processed_img'] for i in missing],
+            dtype=torch.float32,
+            device=self.device
+        )[:, None]
 
-            if self._save_polar_img:
-                res_dict['polar_img'] = polar_img
+        with self.time_recorder('model'):
+            boxes_list, scores_list = self.model(polar_images)
 
-            res_dict['processed_img'] = self.contrast(polar_img)
+        for i, boxes, scores in zip(missing, boxes_list, scores_list):
+            results[i] = to_np(boxes), to_np(scores)
+            self.cache.save('detect', data_list[i].get(FRAME_KEY), dict(boxes=results[i][0], scores=results[i][1]))
 
-            return res_dict
-        except Exception as err:
-            self.log.exception(err)
-            return
+        return results
 
 
 def extract_peak_intensities(polar_img: np.ndarray, boxes: np.ndarray) -> np.ndarray:
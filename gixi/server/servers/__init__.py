@@ -2,19 +2,34 @@ import logging
 
 from gixi.server.log_config import set_log_config
 from gixi.server.app_config import AppConfig
+from gixi.server.lazy_imports import lazy_exports
 
-from .single_process_server import SingleProcessServer
-from .multi_process_server import MultiProcessServer
 from .basicserver import BasicServer
+from .distributed import get_node_info, Coordinator
+
+__getattr__, __dir__ = lazy_exports(__name__, {
+    'SingleProcessServer': 'gixi.server.servers.single_process_server',
+    'MultiProcessServer': 'gixi.server.servers.multi_process_server',
+})
 
 
 def run_server(app_config: AppConfig):
-    set_log_config(app_config.log_config.logging_level, app_config.log_filename)
+    node = get_node_info(app_config)
+    set_log_config(app_config.log_config.logging_level, node.node_filename(app_config.log_filename))
     logging.getLogger(__name__).info(f'Starting server from config: {app_config.job_config.config_path}.')
 
+    if node.is_distributed:
+        logging.getLogger(__name__).info(f'Distributed mode: node {node.rank} of {node.num_nodes}, '
+                                         f'split images by {node.split_frames}.')
+
     if app_config.parallel.parallel_computation:
+        from .multi_process_server import MultiProcessServer
         server = MultiProcessServer(app_config)
     else:
+        from .single_process_server import SingleProcessServer
         server = SingleProcessServer(app_config)
 
     server.run()
+
+    if node.is_distributed:
+        Coordinator(app_config, node).mark_done()
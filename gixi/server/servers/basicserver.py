@@ -2,7 +2,8 @@ import os
 from pathlib import Path
 
 from gixi.server.app_config import AppConfig
-from gixi.server.time_record import TimeRecorder
+from gixi.server.time_record import TimeRecorder, export_spans, flush_spans
+from .distributed import get_node_info
 
 
 class BasicServer(object):
@@ -23,11 +24,22 @@ class BasicServer(object):
         raise NotImplementedError()
 
     def save_time_records(self) -> TimeRecorder:
-        path = self.config.record_filename
+        path = get_node_info(self.config).node_filename(self.config.record_filename)
 
         if not path:
             return TimeRecorder('')
 
         time_records = self.get_time_recorder()
         time_records.save(path)
+        flush_spans()
         return time_records
+
+
+def init_span_export(config: AppConfig, process_name: str):
+    """
+    Streams the time records of the current process to {spans_folder}/{process_name}_{pid}.h5.
+    """
+    folder = get_node_info(config).node_filename(config.spans_folder)
+
+    if folder:
+        export_spans(Path(folder) / f'{process_name}_{os.getpid()}.h5', process_name)
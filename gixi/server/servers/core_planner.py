@@ -0,0 +1,225 @@
+import os
+import sys
+from typing import List, Tuple, NamedTuple, Dict
+from collections import Counter
+from pathlib import Path
+
+from ..app_config import AppConfig
+
+__all__ = [
+    'WorkerPlan',
+    'CorePlan',
+    'plan_cores',
+    'get_available_cores',
+    'apply_worker_plan',
+]
+
+_THREAD_ENV_VARIABLES: Tuple[str, ...] = (
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'OPENCV_FOR_THREADS_NUM',
+)
+
+_NUMA_NODES_PATH: Path = Path('/sys/devices/system/node')
+
+
+class WorkerPlan(NamedTuple):
+    method: str
+    num_threads: int = 1
+    cores: Tuple[int, ...] = ()
+    device: str = None
+
+    def kwargs(self) -> dict:
+        kwargs = dict(num_threads=self.num_threads, cores=self.cores)
+        if self.device:
+            kwargs['device'] = self.device
+        return kwargs
+
+    def __str__(self):
+        cores = _cores_str(self.cores) if self.cores else 'not pinned'
+        threads = self.num_threads if self.num_threads > 0 else 'default'
+        device = f', device={self.device}' if self.device else ''
+        return f'{self.method}: threads={threads}, cores={cores}{device}'
+
+
+class CorePlan(object):
+    def __init__(self, main: WorkerPlan, workers: List[WorkerPlan]):
+        self.main = main
+        self.workers = workers
+
+    def method_list(self) -> List[Tuple[str, dict]]:
+        return [(plan.method, plan.kwargs()) for plan in self.workers]
+
+    @property
+    def num_processes(self) -> Dict[str, int]:
+        return dict(Counter(plan.method for plan in [self.main] + self.workers))
+
+    def __str__(self):
+        lines = [f'Core plan ({len(self.workers) + 1} processes):', f'  main process - {self.main}']
+        lines += [f'  worker {i} - {plan}' for i, plan in enumerate(self.workers)]
+        return '\n'.join(lines)
+
+
+def get_available_cores(max_cores: int = -1) -> List[int]:
+    """
+    Returns the cores the current process is allowed to run on (respects SLURM / cgroup affinity).
+    """
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:  # not available on some platforms
+        cores = list(range(os.cpu_count()))
+
+    if max_cores > 0:
+        cores = cores[:max_cores]
+    return cores
+
+
+def plan_cores(config: AppConfig,
+               cores: List[int],
+               num_inference_workers: int = 1,
+               num_inference_threads: int = 0,
+               devices: List[str] = None,
+               ) -> CorePlan:
+    """
+    Distributes the cores between the server processes. Paths collection, saving and every matching
+    worker get one core each, every image processing worker gets a single core and every detection
+    process gets num_inference_threads cores. The main process is the first detection process.
+
+    If num_inference_threads is zero, the detection in the main process keeps the default number
+    of torch threads and is not pinned, sharing the cores with image processing as before.
+    """
+    parallel_config = config.parallel
+    devices = devices or [None] * num_inference_workers
+    allocator = _CoreAllocator(cores, parallel_config.numa_aware)
+
+    num_matching_workers = max(0, parallel_config.matching_workers)
+    num_processing_workers = len(cores) - 2 - num_matching_workers - num_inference_workers * num_inference_threads
+    num_processing_workers = max(1, num_processing_workers)
+
+    if num_inference_threads > 0:
+        detection_cores = [allocator.allocate(num_inference_threads) for _ in range(num_inference_workers)]
+    else:
+        detection_cores = [()] * num_inference_workers
+
+    matching_cores = [allocator.allocate(1) for _ in range(num_matching_workers)]
+    processing_cores = [allocator.allocate(1) for _ in range(num_processing_workers)]
+    io_cores = [allocator.allocate(1) for _ in range(2)]
+
+    if not parallel_config.pin_cores:
+        detection_cores = [()] * num_inference_workers
+        matching_cores = [()] * num_matching_workers
+        processing_cores = [()] * num_processing_workers
+        io_cores = [(), ()]
+
+    detection_plans = [
+        WorkerPlan('detect', num_inference_threads, c, d) for c, d in zip(detection_cores, devices)
+    ]
+
+    workers = [
+        WorkerPlan('collect_paths', 1, io_cores[0]),
+        WorkerPlan('save_data', 1, io_cores[1]),
+    ]
+    workers += [WorkerPlan('process_images', 1, c) for c in processing_cores]
+    workers += [WorkerPlan('match_peaks', 1, c) for c in matching_cores]
+    workers += detection_plans[1:]
+
+    return CorePlan(detection_plans[0], workers)
+
+
+def apply_worker_plan(num_threads: int = 0, cores: Tuple[int, ...] = (), **kwargs) -> None:
+    """
+    Pins the current process to the cores and limits the thread pools of torch, OpenCV and BLAS.
+    Environment variables only affect the libraries that create their thread pools afterwards.
+    """
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+    if num_threads <= 0:
+        return
+
+    for name in _THREAD_ENV_VARIABLES:
+        os.environ[name] = str(num_threads)
+
+    # torch and OpenCV read the environment variables when they are imported later,
+    # only the already imported ones are limited here (importing them would slow down every worker)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(num_threads)
+
+    if 'cv2' in sys.modules:
+        sys.modules['cv2'].setNumThreads(num_threads)
+
+
+class _CoreAllocator(object):
+    def __init__(self, cores: List[int], numa_aware: bool = False):
+        if numa_aware:
+            self.nodes = [node for node in _get_numa_nodes(cores) if node]
+        else:
+            self.nodes = [list(cores)]
+        self._all_cores = list(cores)
+        self._idx = 0
+
+    def allocate(self, num: int) -> Tuple[int, ...]:
+        for node in self.nodes:
+            if len(node) >= num:
+                allocated, node[:] = node[:num], node[num:]
+                return tuple(allocated)
+
+        free = [core for node in self.nodes for core in node]
+
+        if len(free) >= num:
+            allocated = set(free[:num])
+            for node in self.nodes:
+                node[:] = [core for core in node if core not in allocated]
+            return tuple(sorted(allocated))
+
+        # not enough free cores, oversubscribe
+        allocated = []
+        for _ in range(num):
+            allocated.append(self._all_cores[self._idx % len(self._all_cores)])
+            self._idx += 1
+        return tuple(sorted(set(allocated)))
+
+
+def _get_numa_nodes(cores: List[int]) -> List[List[int]]:
+    cores_set = set(cores)
+    nodes = []
+
+    for path in sorted(_NUMA_NODES_PATH.glob('node[0-9]*')):
+        try:
+            node_cores = _parse_cpulist((path / 'cpulist').read_text())
+        except OSError:
+            continue
+        nodes.append([core for core in node_cores if core in cores_set])
+
+    assigned = set(core for node in nodes for core in node)
+    unassigned = [core for core in cores if core not in assigned]
+
+    if unassigned:
+        nodes.append(unassigned)
+
+    return nodes
+
+
+def _parse_cpulist(cpulist: str) -> List[int]:
+    cores = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            cores.extend(range(start, end + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+
+def _cores_str(cores: Tuple[int, ...]) -> str:
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ','.join(f'{start}-{end}' if start != end else f'{start}' for start, end in ranges)
@@ -0,0 +1,136 @@
+import os
+import json
+import logging
+from typing import NamedTuple, Tuple
+from pathlib import Path
+from time import perf_counter, sleep
+from zlib import crc32
+
+from ..app_config import AppConfig
+
+__all__ = [
+    'NodeInfo',
+    'get_node_info',
+    'Coordinator',
+    'SPLIT_MODES',
+]
+
+SPLIT_MODES: Tuple[str, ...] = ('index', 'hash')
+
+
+class NodeInfo(NamedTuple):
+    rank: int = 0
+    num_nodes: int = 1
+    job_id: str = 'local'
+    split_frames: str = 'index'
+
+    @property
+    def is_distributed(self) -> bool:
+        return self.num_nodes > 1
+
+    def owns_batch(self, batch_idx: int, batch_name: str) -> bool:
+        """
+        Deterministically assigns a batch of images to a node, either by the batch index (round robin)
+        or by the hash of the name of its first image.
+        """
+        if not self.is_distributed:
+            return True
+        if self.split_frames == 'hash':
+            return crc32(batch_name.encode()) % self.num_nodes == self.rank
+        return batch_idx % self.num_nodes == self.rank
+
+    def node_filename(self, filename: str or None) -> str or None:
+        if not filename or not self.is_distributed:
+            return filename
+        path = Path(filename)
+        return str(path.with_name(f'{path.stem}_node{self.rank}{path.suffix}'))
+
+
+def get_node_info(config: AppConfig) -> NodeInfo:
+    """
+    Reads the rank of the current server instance from the SLURM environment.
+    Single node mode is used if the job is not launched via srun or if ClusterConfig.nodes == 1.
+    Raises ValueError for the tasks beyond ClusterConfig.nodes, they would process the images of another node.
+    """
+    split_frames = config.cluster_config.split_frames
+
+    if split_frames not in SPLIT_MODES:
+        raise ValueError(f'Unknown split_frames mode {split_frames}, expected one of {SPLIT_MODES}.')
+
+    num_nodes = min(int(os.environ.get('SLURM_NTASKS', 1)), max(1, config.cluster_config.nodes))
+    rank = int(os.environ.get('SLURM_PROCID', 0))
+
+    if rank >= num_nodes:
+        message = (f'Task {rank} has no images to process, they are split between {num_nodes} nodes '
+                   f'(SLURM_NTASKS = {os.environ.get("SLURM_NTASKS")}, nodes = {config.cluster_config.nodes}).')
+        logging.getLogger(__name__).error(message)
+        raise ValueError(message)
+
+    return NodeInfo(rank, num_nodes, os.environ.get('SLURM_JOB_ID', 'local'), split_frames)
+
+
+class Coordinator(object):
+    """
+    Synchronizes server instances of the same job via files on the shared filesystem.
+    """
+
+    def __init__(self, config: AppConfig, node: NodeInfo, timeout: float = None):
+        self.log = logging.getLogger(__name__)
+        self.node = node
+        self.timeout = timeout or config.general.timeout
+        self.folder: Path = config.dest_path
+        self.prefix = f'.{config.job_config.id_name}_{node.job_id}'
+
+    @property
+    def coordinator_path(self) -> Path:
+        return self.folder / f'{self.prefix}.coordinator.json'
+
+    @property
+    def lock_path(self) -> Path:
+        return self.folder / f'{self.prefix}.lock'
+
+    def done_path(self, rank: int) -> Path:
+        return self.folder / f'{self.prefix}.node{rank}.done'
+
+    def agree_on_folder_name(self, folder_name: str) -> str:
+        """
+        The first node to take the lock publishes its output folder name, other nodes use it.
+        """
+        try:
+            os.close(os.open(str(self.lock_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            folder_name = self._read()['folder_name']
+            self.log.info(f'Node {self.node.rank}: use output folder {folder_name}.')
+            return folder_name
+
+        self._write(dict(folder_name=folder_name, num_nodes=self.node.num_nodes))
+        self.log.info(f'Node {self.node.rank}: output folder {folder_name} is published.')
+        return folder_name
+
+    def mark_done(self, **info) -> int:
+        """
+        Marks the current node as finished and returns the number of finished nodes.
+        """
+        with open(str(self.done_path(self.node.rank)), 'w') as f:
+            json.dump(info, f)
+
+        num_finished = sum(self.done_path(rank).is_file() for rank in range(self.node.num_nodes))
+        self.log.info(f'Node {self.node.rank} is finished ({num_finished}/{self.node.num_nodes} nodes done).')
+        return num_finished
+
+    def _write(self, data: dict):
+        tmp_path = self.coordinator_path.with_suffix(f'.tmp{self.node.rank}')
+        with open(str(tmp_path), 'w') as f:
+            json.dump(data, f)
+        os.replace(str(tmp_path), str(self.coordinator_path))
+
+    def _read(self) -> dict:
+        start = perf_counter()
+
+        while not self.coordinator_path.is_file():
+            if perf_counter() - start > self.timeout:
+                raise TimeoutError(f'Coordinator file {self.coordinator_path} did not appear.')
+            sleep(0.1)
+
+        with open(str(self.coordinator_path), 'r') as f:
+            return json.load(f)
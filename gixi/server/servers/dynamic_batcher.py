@@ -0,0 +1,148 @@
+import logging
+from typing import List, Callable, Any
+from collections import deque
+from queue import Empty
+from time import perf_counter, time
+
+import numpy as np
+
+from gixi.server.time_record import TimeRecorder
+
+__all__ = [
+    'DynamicBatcher',
+    'QUEUED_AT_KEY',
+    'mark_queued',
+    'processed_img_shape',
+]
+
+QUEUED_AT_KEY: str = 'queued_at'
+
+
+def mark_queued(data: dict) -> dict:
+    data[QUEUED_AT_KEY] = time()
+    return data
+
+
+def processed_img_shape(data: dict) -> tuple:
+    return np.shape(data['processed_img'])
+
+
+class DynamicBatcher(object):
+    """
+    Collects batches from a queue with bounded latency: a batch is dispatched as soon as it is full
+    or once max_wait seconds passed since its first item arrived, whichever comes first.
+
+    If bucket_key is provided, only items with the same key are batched together; the others are kept
+    for the next batches in the order they arrived.
+    """
+
+    def __init__(self,
+                 queue,
+                 max_batch: int,
+                 max_wait: float = 0.02,
+                 bucket_key: Callable[[Any], Any] = None,
+                 time_recorder: TimeRecorder = None,
+                 ):
+        self.log = logging.getLogger(__name__)
+        self.queue = queue
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0., max_wait)
+        self.bucket_key = bucket_key
+        self.time_recorder = time_recorder or TimeRecorder('batcher')
+        self.batch_sizes: List[int] = []
+        self._pending = deque()
+
+    def get_batch(self, timeout: float = 0.5) -> list:
+        """
+        Waits up to timeout seconds for the first item, then fills the batch until it is full or
+        max_wait seconds passed. Returns an empty list if no data arrived.
+        """
+        batch = []
+        key = None
+
+        if self._pending:
+            first = self._pending.popleft()
+        else:
+            first = self._get(timeout)
+
+        if first is None:
+            return batch
+
+        batch.append(first)
+
+        if self.bucket_key is not None:
+            key = self.bucket_key(first)
+            batch.extend(self._pop_pending(key))
+
+        deadline = perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            item = self._get(max(0., deadline - perf_counter()))
+
+            if item is None:
+                break
+
+            if self.bucket_key is not None and self.bucket_key(item) != key:
+                self._pending.append(item)
+            else:
+                batch.append(item)
+
+        self._record_batch(batch)
+
+        return batch
+
+    def _get(self, timeout: float):
+        self.time_recorder.start_record('get_image')
+        try:
+            if timeout > 0:
+                item = self.queue.get(timeout=timeout)
+            else:
+                item = self.queue.get_nowait()
+            self.time_recorder.end_record()
+            return item
+        except (OSError, ValueError, Empty):
+            self.time_recorder.end_record('timeout')
+
+    def _pop_pending(self, key) -> list:
+        items, pending = [], deque()
+
+        while self._pending:
+            item = self._pending.popleft()
+            if len(items) + 1 < self.max_batch and self.bucket_key(item) == key:
+                items.append(item)
+            else:
+                pending.append(item)
+
+        self._pending = pending
+        return items
+
+    def _record_batch(self, batch: list):
+        self.batch_sizes.append(len(batch))
+
+        now = time()
+
+        for item in batch:
+            try:
+                queued_at = item.pop(QUEUED_AT_KEY)
+            except (AttributeError, KeyError, TypeError):
+                continue
+            self.time_recorder.add_record('queue_delay', now - queued_at)
+
+        self.log.debug(f'Dispatch batch with {len(batch)} images.')
+
+    @property
+    def mean_batch_size(self) -> float:
+        if not self.batch_sizes:
+            return 0.
+        return float(np.mean(self.batch_sizes))
+
+    def summary(self) -> str:
+        if not self.batch_sizes:
+            return 'No batches dispatched.'
+
+        sizes = np.array(self.batch_sizes)
+        return (
+            f'Dispatched {sizes.size} batches (max_batch={self.max_batch}, max_wait={self.max_wait} s): '
+            f'mean size {sizes.mean():.2f}, min {sizes.min()}, max {sizes.max()}, '
+            f'full batches {(sizes == self.max_batch).mean() * 100:.1f}%.'
+        )
@@ -1,10 +1,17 @@
-from typing import Tuple
+from typing import Tuple, NamedTuple, Iterator
 from time import perf_counter, sleep
 from pathlib import Path
 
 from gixi.server.time_record import TimeRecorder
 
 from ..app_config import AppConfig
+from .distributed import get_node_info
+from .journal import load_completed_batches, batch_key
+
+
+class FrameIndex(NamedTuple):
+    idx: int
+    prev_idx: int = -1
 
 
 class ImagePathGen(object):
@@ -18,9 +25,13 @@ class ImagePathGen(object):
         self.is_real_time = config.general.real_time
         self.timeout = config.general.timeout
         self.sleep_time = config.general.sleep_time if not config.parallel.parallel_computation else 0
+        self.node = get_node_info(config)
+        self._completed_batches = load_completed_batches(config)
         self._processed_set = set()
         self._num_processed_imgs = 0
         self._num_image_batches = 0
+        self._num_found_batches = 0
+        self.frame = FrameIndex(-1)
 
     @property
     def num_processed_imgs(self) -> int:
@@ -30,6 +41,10 @@ class ImagePathGen(object):
     def num_image_batches(self) -> int:
         return self._num_image_batches
 
+    @property
+    def num_found_batches(self) -> int:
+        return self._num_found_batches
+
     def fetch_paths(self):
         # TODO: extend: add more options / file formats / sorted keys / etc.
         return sorted(list(filter(lambda p: 'dark' not in p.name, self.src_folder.rglob('*.tif'))))
@@ -43,9 +58,28 @@ class ImagePathGen(object):
             return ()
         else:
             self._num_processed_imgs += len(path_batch)
-            self._num_image_batches += 1
+            self._num_found_batches += 1
             return tuple(path_batch)
 
+    def should_process(self, batch_idx: int, paths: Tuple[Path, ...]) -> bool:
+        if self._completed_batches and batch_key(paths, self.src_folder) in self._completed_batches:
+            return False
+        return self.node.owns_batch(batch_idx, str(paths[0].relative_to(self.src_folder)))
+
+    def _own_batch(self, paths: Tuple[Path, ...]) -> bool:
+        if self.should_process(self._num_found_batches - 1, paths):
+            self._num_image_batches += 1
+            self.frame = FrameIndex(self._num_found_batches - 1, self.frame.idx)
+            return True
+        return False
+
+    def iter_frames(self) -> Iterator[Tuple[Tuple[Path, ...], FrameIndex]]:
+        """
+        Yields image batches with their frame index and the index of the previous frame of this node.
+        """
+        for paths in self:
+            yield paths, self.frame
+
     def __iter__(self):
         last_update = perf_counter()
 
@@ -54,7 +88,8 @@ class ImagePathGen(object):
                 paths = self.get_batch()
 
             if len(paths) == self.sum_images:
-                yield paths
+                if self._own_batch(paths):
+                    yield paths
                 last_update = perf_counter()
                 continue
             elif not self.is_real_time or perf_counter() - last_update > self.timeout:
@@ -64,5 +99,5 @@ class ImagePathGen(object):
 
         paths = self.get_batch(wait_for_full_batch=False)
 
-        if paths:
+        if paths and self._own_batch(paths):
             yield paths
@@ -0,0 +1,85 @@
+import logging
+from typing import Set, Tuple
+from pathlib import Path
+
+from ..app_config import AppConfig
+from ..h5utils import get_folder_name
+
+__all__ = [
+    'ProgressJournal',
+    'batch_key',
+    'load_completed_batches',
+]
+
+JOURNAL_PREFIX: str = '.gixi_journal'
+
+
+class ProgressJournal(object):
+    """
+    Append-only record of the image batches saved to the output folder. Every node writes its own file,
+    so the journal is safe to use on a shared filesystem.
+    """
+
+    def __init__(self, folder: Path, rank: int = 0):
+        self.log = logging.getLogger(__name__)
+        self.folder = Path(folder)
+        self.rank = rank
+        self.path = self.node_path(rank)
+
+    def node_path(self, rank: int) -> Path:
+        return self.folder / f'{JOURNAL_PREFIX}_node{rank}'
+
+    def record(self, key: str):
+        with open(str(self.path), 'a') as f:
+            f.write(key + '\n')
+
+    def completed(self) -> Set[str]:
+        completed = set()
+
+        for path in self.folder.glob(f'{JOURNAL_PREFIX}_*'):
+            with open(str(path), 'r') as f:
+                completed.update(line.strip() for line in f if line.strip())
+
+        return completed
+
+    def clear(self, num_nodes: int = 1):
+        """
+        Removes the journal of this node. The first node also removes the journals of the ranks
+        which do not exist in the current job (left by a previous job with more nodes),
+        the other nodes may already record their batches, so their journals are not touched.
+        """
+        paths = [self.path]
+
+        if self.rank == 0:
+            existing = {self.node_path(rank) for rank in range(num_nodes)}
+            paths += [path for path in self.folder.glob(f'{JOURNAL_PREFIX}_node*') if path not in existing]
+
+        for path in paths:
+            if path.is_file():
+                self.log.debug(f'Remove journal {path.name}.')
+                path.unlink()
+
+
+def batch_key(paths: Tuple[Path, ...], src_folder: Path) -> str:
+    return ','.join(str(p.relative_to(src_folder)) for p in paths)
+
+
+def load_completed_batches(config: AppConfig) -> Set[str]:
+    """
+    Returns the keys of the batches saved by previous runs if the job is resumed.
+    """
+    if not config.job_config.resume:
+        return set()
+
+    if not config.job_config.rewrite_previous:
+        logging.getLogger(__name__).warning(
+            'Cannot resume processing if previous results are not rewritten, process all the images.'
+        )
+        return set()
+
+    folder = config.dest_path / get_folder_name(config.src_path.name, add_time=False)
+    completed = ProgressJournal(folder).completed() if folder.is_dir() else set()
+
+    logging.getLogger(__name__).info(f'Resume processing: skip {len(completed)} saved image batches.')
+
+    return completed
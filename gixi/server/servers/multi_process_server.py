@@ -1,20 +1,41 @@
+import os
 import logging
-from time import perf_counter
+from typing import Tuple, List, TYPE_CHECKING
+from time import perf_counter, time
 from functools import lru_cache
 
 from queue import Empty
-import multiprocessing
 from multiprocessing import Manager
 
-import torch
-
-from .basicserver import BasicServer, AppConfig
+from .basicserver import BasicServer, AppConfig, init_span_export
 
 from .image_path_gen import ImagePathGen
 from .save_data import SaveData
-from ..server_operations import ProcessImages, FeatureDetector
+from .dynamic_batcher import DynamicBatcher, mark_queued, processed_img_shape
+from .core_planner import plan_cores, get_available_cores, apply_worker_plan
+from .telemetry import StageReporter, StatusWriter, get_status_path
+from .shared_state import get_shared_grids, get_shared_phases, attach_shared_arrays, grids_from_arrays
 from ..parallelize_ops import Workers, SharedResources, run_pool
-from gixi.server.time_record import TimeRecorder
+from gixi.server.time_record import TimeRecorder, stop_span_export
+
+# Every worker process imports this module, so torch, the model and the matching
+# are imported only in the methods which need them.
+if TYPE_CHECKING:
+    from ..server_operations import FeatureDetector
+
+# Number of cpu cores a single detection process still uses efficiently.
+_CORES_PER_INFERENCE_WORKER: int = 4
+
+START_METHODS: Tuple[str, ...] = ('fork', 'forkserver', 'spawn')
+
+# Modules the forkserver imports once for the workers of every method.
+_METHOD_MODULES: dict = dict(
+    collect_paths='gixi.server.servers.image_path_gen',
+    process_images='gixi.server.process_images',
+    detect='gixi.server.server_operations',
+    match_peaks='gixi.server.matching',
+    save_data='gixi.server.servers.save_data',
+)
 
 
 class MultiProcessServer(BasicServer):
@@ -22,33 +43,145 @@ class MultiProcessServer(BasicServer):
         super().__init__(config)
 
         self.log = logging.getLogger(__name__)
+        self.start_method = get_start_method(config)
         self.resources = FastServerResources(config)
+        # the detection model of the main process is loaded while the workers start
+        self.model = None
+        self.plan = None
         self.methods = self.get_method_list()
-        self.model = FastModelPrediction(self.resources, config)
         self.log.info('Started multiprocessing server')
 
     def get_method_list(self):
-        available = multiprocessing.cpu_count()
-        if self.config.cluster_config.max_cores > 0:
-            available = min(available, self.config.cluster_config.max_cores)
-        assert available > 2, f'Not enough available cpu cores!'
-        methods = ['collect_paths'] + ['save_data'] + (available - 2) * ['process_images']
-
-        return methods
+        cores = get_available_cores(self.config.cluster_config.max_cores)
+        assert len(cores) > 2, f'Not enough available cpu cores!'
+
+        num_workers, num_threads = self.get_inference_split(len(cores) - 2)
+        devices = get_inference_devices(self.config, num_workers)
+
+        if self.config.cluster_config.use_cuda and num_workers > 1 and self.start_method == 'fork':
+            # forked processes cannot re-initialize CUDA used by the main process
+            self.start_method = get_cuda_start_method()
+            self.log.warning(f'CUDA detection workers cannot be forked, start the workers with '
+                             f'{self.start_method} instead.')
+
+        self.plan = plan_cores(self.config, cores, num_workers, num_threads, devices)
+        self.log.info(str(self.plan))
+
+        return self.plan.method_list()
+
+    def get_inference_split(self, num_cores: int) -> Tuple[int, int]:
+        """
+        Returns the number of detection processes and the number of torch threads per process.
+        Zero threads means the legacy mode: a single detection process in the main process
+        without a dedicated share of cores.
+        """
+        parallel_config = self.config.parallel
+
+        if parallel_config.inference_workers == 1 and parallel_config.inference_threads <= 0:
+            return 1, 0
+
+        if parallel_config.inference_workers > 0 and parallel_config.inference_threads > 0:
+            return parallel_config.inference_workers, parallel_config.inference_threads
+
+        inference_cores = self.get_inference_cores(num_cores)
+
+        if parallel_config.inference_workers > 0:
+            num_workers = parallel_config.inference_workers
+        else:
+            num_workers = get_auto_num_inference_workers(self.config, inference_cores)
+
+        if parallel_config.inference_threads > 0:
+            num_threads = parallel_config.inference_threads
+        else:
+            num_threads = max(1, inference_cores // num_workers)
+
+        return num_workers, num_threads
+
+    def get_inference_cores(self, num_cores: int) -> int:
+        """
+        Splits the cores between image processing and detection proportionally to the measured
+        single-core time per frame of both stages.
+        """
+        if self.config.cluster_config.use_cuda:
+            # the main process should not initialize CUDA before the workers are started
+            process_time, detection_time = measure_stage_times_in_child(self.config)
+        else:
+            process_time, detection_time = measure_stage_times(self.config, self.get_model().detector)
+
+        if process_time > 0 and detection_time > 0:
+            share = detection_time / (process_time + detection_time)
+            self.log.info(f'Measured time per frame: processing {process_time:.2e} s, '
+                          f'detection {detection_time:.2e} s.')
+        else:
+            share = 0.5
+            self.log.warning('Could not measure stage times, split the cores equally.')
+
+        return max(1, min(int(round(num_cores * share)), num_cores - 1))
+
+    def get_model(self) -> 'FastModelPrediction':
+        if self.model is None:
+            self.model = FastModelPrediction(self.resources, self.config)
+        return self.model
+
+    def get_preload_modules(self) -> List[str]:
+        methods = {method for method, _ in self.methods}
+        return [__name__] + [module for method, module in _METHOD_MODULES.items() if method in methods]
 
     def run(self):
-        with run_pool(
-                FastServer,
-                self.resources,
-                self.methods,
-                log_level=self.config.log_config.logging_level,
-                config=self.config.asdict(),
-        ):
-            self.model.run()
-            self.log.info(str(self.save_time_records()))
+        apply_worker_plan(**self.plan.main.kwargs())
+
+        status = StatusWriter(self.resources, get_status_path(self.config), self.config.log_config.status_interval)
+        grids = get_shared_grids(self.config) if self.config.parallel.share_grids else None
+
+        if grids:
+            self.log.info(f'Shared interpolation grids: {grids.nbytes / 1024 ** 2:.1f} MiB.')
+
+        if self.config.parallel.matching_workers > 0 and self.config.match_config.perform_matching:
+            # the crystal structures are simulated once, not by every matching worker
+            phases = get_shared_phases(self.config)
+        else:
+            phases = None
+
+        self.resources.created = time()  # worker startup and time to first frame are measured from here
+
+        try:
+            with run_pool(
+                    FastServer,
+                    self.resources,
+                    self.methods,
+                    log_level=self.config.log_config.logging_level,
+                    start_method=self.start_method,
+                    preload=self.get_preload_modules(),
+                    config=self.config.asdict(),
+                    grids=grids.spec if grids else None,
+                    phases=phases.spec if phases else None,
+            ):
+                status.start()
+                init_span_export(self.config, 'detection')
+                self.get_model().run()
+                status.stop()
+                self.log_startup()
+                self.log.info(str(self.save_time_records()))
+        finally:
+            if grids:
+                grids.close()
+            if phases:
+                phases.close()
+
+    def log_startup(self):
+        startup_times = [
+            stats['startup'] for stats in dict(self.resources.live_stats).values() if 'startup' in stats
+        ]
+
+        if startup_times:
+            self.log.info(f'Worker startup ({self.start_method}): max {max(startup_times):.2f} s, '
+                          f'mean {sum(startup_times) / len(startup_times):.2f} s.')
+
+        if self.resources.time_to_first_frame is not None:
+            self.log.info(f'Time to first frame: {self.resources.time_to_first_frame:.2f} s.')
 
     def get_time_recorder(self) -> TimeRecorder:
-        return self.model.time_recorder + self.resources.get_time_recorder()
+        return self.get_model().time_recorder + self.resources.get_time_recorder()
 
 
 class FastServerResources(SharedResources):
@@ -58,8 +191,10 @@ class FastServerResources(SharedResources):
 
         self.timeout = config.cluster_config.timeout * 0.9  # finish the job nicely before the job is terminated
         self.start_time = perf_counter()
+        self.created = time()  # wall clock, comparable between processes
         self._num_found_images = manager.Value('i', 0)
         self._num_saved_images = manager.Value('i', 0)
+        self._first_frame_time = manager.Value('d', -1.)
         self._lock_num_found_images = manager.Lock()
         self._lock_num_predicted_images = manager.Lock()
 
@@ -70,6 +205,12 @@ class FastServerResources(SharedResources):
         self.images_queue = manager.Queue(self.max_batch)
         self.results_queue = manager.Queue(self.max_batch)
         self.time_records = manager.Queue()
+        self.live_stats = manager.dict()
+
+        if config.parallel.matching_workers > 0:
+            self.detected_queue = manager.Queue(self.max_batch)
+        else:
+            self.detected_queue = self.results_queue
 
     @property
     def num_found_images(self):
@@ -85,8 +226,15 @@ class FastServerResources(SharedResources):
 
     def add_num_saved_images(self, num):
         with self._lock_num_predicted_images:
+            if num > 0 and self._first_frame_time.value < 0:
+                self._first_frame_time.value = time() - self.created
             self._num_saved_images.value += num
 
+    @property
+    def time_to_first_frame(self) -> float or None:
+        value = self._first_frame_time.value
+        return value if value >= 0 else None
+
     @property
     def is_timeout(self):
         return perf_counter() - self.start_time > self.timeout
@@ -109,23 +257,38 @@ class FastServerResources(SharedResources):
 
 class FastServer(Workers):
     resources: FastServerResources
+    config: AppConfig
     time_recorder: TimeRecorder
+    reporter: StageReporter
+    startup: float
 
     def on_start(self, **kwargs):
-        config = AppConfig.from_dict(kwargs['config'])
+        # the config is parsed once per worker, the methods use self.config
+        self.config = config = AppConfig.from_dict(kwargs['config'])
+
+        apply_worker_plan(**kwargs)
 
         self.time_recorder = TimeRecorder(self.method_name, no_record=not config.log_config.record_time)
+        init_span_export(config, self.method_name)
+        self.startup = time() - self.resources.created
+        self.reporter = StageReporter(
+            self.resources.live_stats, f'{self.method_name}_{os.getpid()}', config.log_config.status_interval,
+            startup=self.startup,
+        )
+        self.reporter.report(force=True)
+        self.log.debug(f'{self.method_name} worker started in {self.startup:.2f} s.')
 
     def on_stop(self, **kwargs):
+        self.reporter.report(self.time_recorder, force=True)
         self.resources.time_records.put(self.time_recorder.asdict())
+        stop_span_export()
 
     def collect_paths(self, **kwargs):
-        config = AppConfig.from_dict(kwargs['config'])
-
-        image_path_gen = ImagePathGen(config)
+        image_path_gen = ImagePathGen(self.config)
 
-        for paths in image_path_gen:
-            self.resources.paths_queue.put(paths)
+        for paths, frame in image_path_gen.iter_frames():
+            self.resources.paths_queue.put((paths, frame))
+            self.reporter.report(image_path_gen.time_recorder, found_images=image_path_gen.num_processed_imgs)
 
         self.resources.add_num_found_images(image_path_gen.num_image_batches)
         self.time_recorder += image_path_gen.time_recorder
@@ -135,35 +298,67 @@ class FastServer(Workers):
 
         self.resources.stop()
 
-    def process_images(self, timeout=0.01, **kwargs):
-        config = AppConfig.from_dict(kwargs['config'])
-        process = ProcessImages(config)
+    def process_images(self, timeout=0.01, grids: dict = None, **kwargs):
+        from ..process_images import ProcessImages
+
+        process = ProcessImages(self.config, grids=grids_from_arrays(attach_shared_arrays(grids)))
 
         while not self.resources.finished:
             self.time_recorder.start_record('get_img_paths')
             try:
-                img_paths = self.resources.paths_queue.get(timeout=timeout)
+                img_paths, frame = self.resources.paths_queue.get(timeout=timeout)
                 self.time_recorder.end_record()
             except (OSError, ValueError, Empty):
                 self.time_recorder.end_record('timeout')
                 continue
 
             self.time_recorder.start_record('process_imgs')
-            data = process(img_paths)
+            data = process(img_paths, frame)
             if data:
                 self.time_recorder.end_record()
                 self.log.debug(f'Put result to images_queue.')
-                self.resources.images_queue.put(data)
+                self.resources.images_queue.put(mark_queued(data))
             else:
                 self.time_recorder.end_record('empty_data')
                 self.log.debug(f'num_found_images = {self.resources.num_found_images}')
                 self.resources.add_num_found_images(-1)
 
+            self.reporter.report(self.time_recorder, process.time_recorder)
+
         self.time_recorder += process.time_recorder
 
+    def detect(self, device: str = None, **kwargs):
+        model = FastModelPrediction(self.resources, self.config, device=device)
+        model.run()
+
+        self.time_recorder += model.time_recorder
+
+    def match_peaks(self, timeout=0.1, phases: dict = None, **kwargs):
+        from ..matching import MatchDiffractionPatterns
+
+        matching = MatchDiffractionPatterns(self.config, phase_arrays=attach_shared_arrays(phases))
+
+        while not self.resources.finished:
+            self.time_recorder.start_record('wait_data_list')
+
+            try:
+                data_list = self.resources.detected_queue.get(timeout=timeout)
+                self.time_recorder.end_record()
+            except (OSError, ValueError, Empty):
+                self.time_recorder.end_record('timeout')
+                continue
+
+            try:
+                with self.time_recorder('matching'):
+                    matching.match_batch(data_list)
+            except Exception as err:
+                self.log.exception(err)
+
+            self.resources.results_queue.put(data_list)
+            self.reporter.report(self.time_recorder)
+
     def save_data(self, timeout=0.1, **kwargs):
-        config = AppConfig.from_dict(kwargs['config'])
-        save_data = SaveData(config)
+        save_data = SaveData(self.config)
 
         while not self.resources.finished:
             self.time_recorder.start_record('wait_data_list')
@@ -180,43 +375,156 @@ class FastServer(Workers):
             except Exception as err:
                 self.log.exception(err)
 
+            self.reporter.report(self.time_recorder, save_data.time_recorder)
+
+        save_data.close()
         self.time_recorder += save_data.time_recorder
 
 
 class FastModelPrediction(object):
-    def __init__(self, resources: FastServerResources, config: AppConfig):
+    def __init__(self, resources: FastServerResources, config: AppConfig, device: str = None):
+        from ..server_operations import FeatureDetector
+
         self.log = logging.getLogger(__name__)
         self.resources = resources
-        self.detector = FeatureDetector(config)
+        self.detector = FeatureDetector(config, device=device, match_peaks=config.parallel.matching_workers <= 0)
         self.time_recorder = TimeRecorder('detection', no_record=not config.log_config.record_time)
+        self.batcher = DynamicBatcher(
+            resources.images_queue,
+            max_batch=resources.max_batch,
+            max_wait=config.parallel.max_batch_wait,
+            bucket_key=processed_img_shape if config.parallel.bucket_by_size else None,
+            time_recorder=self.time_recorder,
+        )
+        self.status_interval = config.log_config.status_interval
 
-    @torch.no_grad()
     def run(self, timeout=0.5):
+        import torch
+
+        with torch.no_grad():
+            self._run(timeout)
+
+    def _run(self, timeout: float):
+        reporter = StageReporter(self.resources.live_stats, f'detect_{os.getpid()}', self.status_interval)
+
         while not self.resources.finished:
-            data_list = []
-
-            for i in range(self.resources.max_batch):
-                self.time_recorder.start_record('get_image')
-                try:
-                    data = self.resources.images_queue.get(timeout=timeout)
-                    self.time_recorder.end_record()
-                    data_list.append(data)
-                except (OSError, ValueError, Empty):
-                    self.log.debug(f'Timeout waiting for data, run batch with {len(data_list)} images.')
-                    self.time_recorder.end_record('timeout')
-                    break
+            data_list = self.batcher.get_batch(timeout=timeout)
+
             if not data_list:
                 self.log.debug(f'Data list is empty, continue waiting for new data.')
                 continue
             try:
                 with self.time_recorder('detect_total'):
                     data_list = self.detector(data_list)
-                self.resources.results_queue.put(data_list)
+                self.resources.detected_queue.put(data_list)
             except Exception as err:
                 self.log.exception(err)
                 return
 
             self.log.debug(f'Added num_predicted_images: {len(data_list)}')
 
+            reporter.report(
+                self.time_recorder, self.detector.time_recorder,
+                mean_batch_size=self.batcher.mean_batch_size, last_batch_size=len(data_list),
+            )
+
         self.time_recorder += self.detector.time_recorder
+        reporter.report(self.time_recorder, force=True, mean_batch_size=self.batcher.mean_batch_size)
+        self.log.info(self.batcher.summary())
         self.log.info('Detection process is finished.')
+
+
+def get_start_method(config: AppConfig) -> str:
+    start_method = config.parallel.start_method
+
+    if start_method not in START_METHODS:
+        raise ValueError(f'Unknown start_method {start_method}, expected one of {START_METHODS}.')
+
+    return start_method
+
+
+def get_cuda_start_method() -> str:
+    import multiprocessing
+
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def get_auto_num_inference_workers(config: AppConfig, inference_cores: int) -> int:
+    import torch
+
+    if config.cluster_config.use_cuda:
+        return max(1, torch.cuda.device_count())
+    return max(1, inference_cores // _CORES_PER_INFERENCE_WORKER)
+
+
+def get_inference_devices(config: AppConfig, num_workers: int) -> List[str]:
+    import torch
+
+    if config.cluster_config.use_cuda and torch.cuda.device_count() > 1:
+        num_devices = torch.cuda.device_count()
+        return [f'cuda:{i % num_devices}' for i in range(num_workers)]
+    return [config.device] * num_workers
+
+
+def measure_stage_times(config: AppConfig, detector: 'FeatureDetector', batch_size: int = 4) -> Tuple[float, float]:
+    """
+    Measures single-core time per frame of image processing and detection on the first frame found.
+    Returns zeros if there is no data yet.
+    """
+    import torch
+    from ..process_images import ProcessImages
+
+    paths = ImagePathGen(config).get_batch(wait_for_full_batch=False)
+
+    if not paths:
+        return 0., 0.
+
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+
+    try:
+        process = ProcessImages(config)
+
+        start = perf_counter()
+        data = process(paths)
+        process_time = perf_counter() - start
+
+        if not data:
+            return 0., 0.
+
+        batch_size = max(1, min(batch_size, config.parallel.max_batch))
+
+        with torch.no_grad():
+            detector([dict(data)])  # warm-up
+
+            start = perf_counter()
+            detector([dict(data) for _ in range(batch_size)])
+            detection_time = (perf_counter() - start) / batch_size
+    finally:
+        torch.set_num_threads(num_threads)
+
+    return process_time, detection_time
+
+
+def measure_stage_times_in_child(config: AppConfig) -> Tuple[float, float]:
+    """
+    Runs measure_stage_times in a spawned process with its own detection model,
+    so that CUDA is initialized only in the child. Returns zeros if the measurement fails.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    try:
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            return executor.submit(_measure_stage_times, config.asdict()).result()
+    except (Exception, SystemExit) as err:  # the detector exits if the model does not load
+        logging.getLogger(__name__).error(f'Could not measure stage times: {err!r}')
+        return 0., 0.
+
+
+def _measure_stage_times(config_dict: dict) -> Tuple[float, float]:
+    from ..server_operations import FeatureDetector
+
+    config = AppConfig.from_dict(config_dict)
+    detector = FeatureDetector(config, match_peaks=config.parallel.matching_workers <= 0)
+    return measure_stage_times(config, detector)
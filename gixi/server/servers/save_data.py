@@ -3,8 +3,10 @@ from pathlib import Path
 
 from gixi.server.time_record import TimeRecorder
 
-from ..h5utils import GixiFileManager
+from ..h5utils import GixiFileManager, get_folder_name
 from ..app_config import AppConfig
+from .distributed import get_node_info, Coordinator
+from .journal import ProgressJournal, batch_key
 
 
 class SaveData(object):
@@ -15,7 +17,19 @@ class SaveData(object):
         self._keys = _init_save_keys(config)
         self.src_path = config.src_path
         self.h5file = GixiFileManager(config.dest_path)
-        self.h5file.init_folder(self.src_path.name, add_time=not config.job_config.rewrite_previous)
+        self.h5file.init_folder(_init_folder_name(config), add_time=False)
+        node = get_node_info(config)
+        self.journal = ProgressJournal(self.h5file.folder_path, node.rank)
+
+        if not config.job_config.resume:
+            self.journal.clear(node.num_nodes)
+
+        if config.tracking_config.track_peaks:
+            # imports scipy, the save workers do not need it otherwise
+            from gixi.server.peak_tracking import PeakTracker, TRACKS_FILENAME
+            self.tracker = PeakTracker(config, self.h5file.folder_path / node.node_filename(TRACKS_FILENAME))
+        else:
+            self.tracker = None
 
     def __call__(self, data_dicts: List[dict]):
         for data_dict in data_dicts:
@@ -29,10 +43,20 @@ class SaveData(object):
         path_names = ','.join(_get_path_name(p, self.src_path) for p in paths)
 
         if data_dict:
+            file_name = _get_path_name(paths[0], self.src_path)
+
+            if self.tracker:
+                with self.time_recorder('tracking'):
+                    self.tracker.add(data_dict, file_name)
+
             with self.time_recorder():
-                file_name = _get_path_name(paths[0], self.src_path)
                 data_dict = {k: data_dict[k] for k in self._keys if k in data_dict}
                 self.h5file.save(file_name, data_dict, attrs=dict(paths=path_names))
+                self.journal.record(batch_key(paths, self.src_path))
+
+    def close(self):
+        if self.tracker:
+            self.tracker.close()
 
 
 def _get_path_name(path: Path, rel_folder: Path) -> str:
@@ -40,6 +64,17 @@ def _get_path_name(path: Path, rel_folder: Path) -> str:
     return str(path.relative_to(rel_folder)).split('.tif')[0]
 
 
+def _init_folder_name(config: AppConfig) -> str:
+    folder_name = get_folder_name(config.src_path.name, add_time=not config.job_config.rewrite_previous)
+    node = get_node_info(config)
+
+    if node.is_distributed:
+        # all the nodes write to the same folder, the file names do not overlap
+        folder_name = Coordinator(config, node).agree_on_folder_name(folder_name)
+
+    return folder_name
+
+
 def _init_save_keys(config: AppConfig):
     save_config = config.save_config
     keys = ['boxes']
@@ -54,5 +89,7 @@ def _init_save_keys(config: AppConfig):
     if save_config.save_intensities:
         keys.append('intensities')
     if config.match_config.perform_matching:
-        keys.append('matching_results')
+        keys.append('matching_table')
+        if save_config.save_legacy_matching:
+            keys.append('matching_results')
     return keys
@@ -0,0 +1,128 @@
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+
+from ..app_config import AppConfig
+
+__all__ = [
+    'SharedArrays',
+    'attach_shared_arrays',
+    'get_shared_grids',
+    'get_shared_phases',
+    'grids_from_arrays',
+]
+
+# name -> (shared memory block name, shape, dtype)
+ArraysSpec = Dict[str, Tuple[str, Tuple[int, ...], str]]
+
+
+class SharedArrays(object):
+    """
+    Copies read-only arrays to shared memory blocks once in the main process,
+    worker processes attach to them by the picklable spec instead of computing their own copies.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        from multiprocessing.shared_memory import SharedMemory
+
+        self.blocks = {}
+        self.spec: ArraysSpec = {}
+
+        try:
+            for key, arr in arrays.items():
+                arr = np.ascontiguousarray(arr)
+                block = SharedMemory(create=True, size=max(arr.nbytes, 1))
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+                self.blocks[key] = block
+                self.spec[key] = (block.name, arr.shape, arr.dtype.str)
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.size for block in self.blocks.values())
+
+    def close(self):
+        while self.blocks:
+            block = self.blocks.popitem()[1]
+            block.close()
+            block.unlink()
+
+
+def attach_shared_arrays(spec: ArraysSpec or None) -> Dict[str, np.ndarray] or None:
+    """
+    Returns read-only views of the shared arrays. The arrays keep their memory blocks open.
+    """
+    if not spec:
+        return
+
+    from multiprocessing.shared_memory import SharedMemory
+
+    arrays = {}
+
+    for key, (name, shape, dtype) in spec.items():
+        # workers share the resource tracker of the main process, which unlinks the blocks
+        block = SharedMemory(name=name)
+        arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        arr.flags.writeable = False
+        arrays[key] = _SharedArray(arr, block)
+
+    return arrays
+
+
+def get_shared_grids(config: AppConfig) -> SharedArrays or None:
+    """
+    Computes the q-space and polar remap grids of the detector once and puts them to shared memory.
+    Returns None if shared memory is not available (python < 3.8).
+    """
+    from gixi.server.img_processing.conversions import get_detector_q_grid, get_detector_polar_grid
+
+    grids = dict(
+        q=get_detector_q_grid(config.q_space),
+        polar=get_detector_polar_grid(config.q_space, config.polar_config),
+    )
+    arrays = {f'{key}_{i}': grid[i].astype(np.float32) for key, grid in grids.items() for i in range(2)}
+
+    try:
+        return SharedArrays(arrays)
+    except (ImportError, OSError) as err:
+        logging.getLogger(__name__).warning(f'Could not share the remap grids: {err}')
+
+
+def get_shared_phases(config: AppConfig) -> SharedArrays or None:
+    """
+    Simulates the peaks of the crystal structures once (or loads them from the cache) and puts them
+    to shared memory for the matching workers, see MatchDiffractionPatterns.phase_arrays.
+    Returns None if shared memory is not available.
+    """
+    from gixi.server.matching import MatchDiffractionPatterns
+
+    arrays = MatchDiffractionPatterns(config).phase_arrays
+
+    try:
+        return SharedArrays(arrays)
+    except (ImportError, OSError) as err:
+        logging.getLogger(__name__).warning(f'Could not share the simulated peaks: {err}')
+
+
+def grids_from_arrays(arrays: Dict[str, np.ndarray] or None) -> Dict[str, Tuple[np.ndarray, np.ndarray]] or None:
+    if not arrays:
+        return
+    return {key: (arrays[f'{key}_0'], arrays[f'{key}_1']) for key in ('q', 'polar')}
+
+
+class _SharedArray(np.ndarray):
+    """
+    An ndarray view which holds a reference to its shared memory block.
+    """
+
+    def __new__(cls, arr: np.ndarray, block):
+        obj = arr.view(cls)
+        obj._block = block
+        return obj
+
+    def __array_finalize__(self, obj):
+        self._block = getattr(obj, '_block', None)
+
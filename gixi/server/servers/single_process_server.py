@@ -7,8 +7,8 @@ from gixi.server.app_config import AppConfig
 from gixi.server.server_operations import FeatureDetector, ProcessImages
 from gixi.server.time_record import TimeRecorder
 
-from .basicserver import BasicServer
-from .image_path_gen import ImagePathGen
+from .basicserver import BasicServer, init_span_export
+from .image_path_gen import ImagePathGen, FrameIndex
 
 from .save_data import SaveData
 
@@ -32,10 +32,12 @@ class SingleProcessServer(BasicServer):
     def run(self):
         self.log.debug(f'Run single-process server.')
 
+        init_span_export(self.config, 'main')
+
         batch = []
 
-        for paths in self.image_path_gen:
-            batch.append(paths)
+        for paths, frame in self.image_path_gen.iter_frames():
+            batch.append((paths, frame))
 
             if len(batch) == self.max_batch:
                 self.process_file(batch)
@@ -44,6 +46,8 @@ class SingleProcessServer(BasicServer):
         if batch:
             self.process_file(batch)
 
+        self.save_data.close()
+
         if self.config.log_config.record_time:
             self.log.info(str(self.save_time_records()))
 
@@ -56,11 +60,11 @@ class SingleProcessServer(BasicServer):
         )
         return time_recorder
 
-    def process_file(self, batch: List[Tuple[Path, ...]]):
+    def process_file(self, batch: List[Tuple[Tuple[Path, ...], FrameIndex]]):
         if not batch:
             return
 
-        data_list = [self.process_images(paths) for paths in batch]
+        data_list = [self.process_images(paths, frame) for paths, frame in batch]
         data_list = list(filter(lambda x: x is not None, data_list))
 
         if not len(data_list):
@@ -0,0 +1,165 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict
+from pathlib import Path
+from time import perf_counter, time, strftime, localtime
+
+from gixi.server.app_config import AppConfig
+from gixi.server.time_record import TimeRecorder
+from .distributed import get_node_info
+
+__all__ = [
+    'StageReporter',
+    'StatusWriter',
+    'get_status_path',
+    'summarize_records',
+]
+
+STATUS_PREFIX: str = '.gixi_status'
+
+
+class StageReporter(object):
+    """
+    Publishes a summary of the time records of a worker process (and the constant values)
+    to a shared dict at most every interval seconds.
+    """
+
+    def __init__(self, stats: dict, key: str, interval: float, **values):
+        self.stats = stats
+        self.key = key
+        self.interval = interval
+        self.values = values
+        self._start = perf_counter()
+        self._last_report = self._start
+
+    def report(self, *time_recorders: TimeRecorder, force: bool = False, **values):
+        now = perf_counter()
+
+        if not force and (self.interval <= 0 or now - self._last_report < self.interval):
+            return
+
+        self._last_report = now
+        elapsed = now - self._start
+        records = {}
+
+        for time_recorder in time_recorders:
+            records.update(summarize_records(time_recorder, elapsed))
+
+        try:
+            self.stats[self.key] = dict(pid=os.getpid(), elapsed=elapsed, records=records, **dict(self.values, **values))
+        except (OSError, EOFError):
+            pass
+
+
+class StatusWriter(threading.Thread):
+    """
+    Periodically rewrites a json file with the state of a running MultiProcessServer:
+    image counts, throughput, queue depths and the stage summaries published by the workers.
+    """
+
+    def __init__(self, resources, path: str or Path, interval: float):
+        super().__init__(daemon=True)
+        self.log = logging.getLogger(__name__)
+        self.resources = resources
+        self.path = Path(path)
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._start = perf_counter()
+        self._last_saved = (self._start, 0)
+
+    def run(self):
+        if self.interval <= 0:
+            return
+
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self._stop_event.set()
+
+        if self.is_alive():
+            self.join()
+
+        if self.interval > 0:
+            self.write(state='finished')
+
+    def write(self, state: str = 'running'):
+        try:
+            status = self.get_status(state)
+        except (OSError, EOFError) as err:
+            self.log.debug(f'Could not collect the server status: {err}')
+            return
+
+        tmp_path = self.path.with_name(f'{self.path.name}.tmp')
+
+        try:
+            with open(str(tmp_path), 'w') as f:
+                json.dump(status, f, indent=2, default=float)
+            os.replace(str(tmp_path), str(self.path))
+        except OSError as err:
+            self.log.warning(f'Could not write the status file {self.path}: {err}')
+
+    def get_status(self, state: str = 'running') -> dict:
+        resources = self.resources
+        now = perf_counter()
+        elapsed = now - self._start
+        num_saved = resources.num_saved_images
+
+        last_time, last_saved = self._last_saved
+        self._last_saved = (now, num_saved)
+
+        queues = dict(
+            paths=resources.paths_queue.qsize(),
+            images=resources.images_queue.qsize(),
+            results=resources.results_queue.qsize(),
+        )
+
+        if resources.detected_queue is not resources.results_queue:
+            queues['detected'] = resources.detected_queue.qsize()
+
+        return dict(
+            state=state,
+            updated=strftime('%Y-%m-%d %H:%M:%S', localtime()),
+            elapsed=elapsed,
+            time_to_first_frame=resources.time_to_first_frame,
+            images=dict(
+                found=resources.num_found_images,
+                saved=num_saved,
+                saved_per_s=num_saved / elapsed if elapsed else 0.,
+                recent_saved_per_s=(num_saved - last_saved) / (now - last_time) if now > last_time else 0.,
+            ),
+            queues=queues,
+            max_queue_size=resources.max_batch,
+            stages=dict(resources.live_stats),
+        )
+
+
+def summarize_records(time_recorder: TimeRecorder, elapsed: float) -> Dict[str, dict]:
+    """
+    Returns count, rate (records per second of elapsed time), mean, median, P99 and total time
+    of every record name.
+    """
+    num_records = time_recorder.num_records()
+    mean_records = time_recorder.mean_records()
+    total_records = time_recorder.total_records()
+    median_records = time_recorder.percentile_records(50)
+    p99_records = time_recorder.percentile_records(99)
+
+    return {
+        k: dict(
+            count=num_records[k],
+            rate=num_records[k] / elapsed if elapsed else 0.,
+            mean=mean_records[k],
+            median=median_records[k],
+            p99=p99_records[k],
+            total=total_records[k],
+        )
+        for k in num_records.keys()
+    }
+
+
+def get_status_path(config: AppConfig) -> Path:
+    filename = get_node_info(config).node_filename(f'{STATUS_PREFIX}_{config.job_config.id_name}.json')
+    return config.dest_path / filename
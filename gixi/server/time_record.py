@@ -1,14 +1,40 @@
-from collections import defaultdict
-from typing import Callable
-from time import perf_counter
+import os
+import math
+import atexit
+from typing import Callable, Dict
+from time import perf_counter, time
 from functools import wraps
 from contextlib import contextmanager
 from pathlib import Path
 
-from torch import save, load
-
+import numpy as np
 from numpy import mean
 
+__all__ = [
+    'TimeRecorder',
+    'RecordSeries',
+    'SpanWriter',
+    'export_spans',
+    'flush_spans',
+    'stop_span_export',
+]
+
+# log-spaced histogram bins: 16 bins per octave between 100 ns and ~1 day (~2% relative error of percentiles)
+_MIN_TIME: float = 1e-7
+_BINS_PER_OCTAVE: int = 16
+_NUM_BINS: int = 2 + _BINS_PER_OCTAVE * 40
+
+# number of the latest records kept as raw values for every record name
+_RECENT_SIZE: int = 1024
+_FOLD_SIZE: int = 256
+
+_SPAN_BUFFER_SIZE: int = 8192
+_SPAN_FLUSH_INTERVAL: float = 30.
+
+_span_writer: 'SpanWriter' or None = None
+# series with records not passed to the span writer yet, folded before the spans are flushed
+_unfolded_series: set = set()
+
 
 def _ignore_if_no_record(func):
     @wraps(func)
@@ -20,20 +46,315 @@ def _ignore_if_no_record(func):
     return wrapper
 
 
+class RecordSeries(object):
+    """
+    Bounded statistics of a single record name: count, total, min, max, a log-spaced histogram
+    for percentiles and a ring buffer with the latest records and their start times.
+    New records are collected in a short list and folded into the arrays in batches.
+    """
+
+    __slots__ = ('name', 'count', 'total', 'min', 'max', 'hist', 'recent', 'recent_starts', '_pending')
+
+    def __init__(self, name: str = ''):
+        self.name = name
+        self.count: int = 0
+        self.total: float = 0.
+        self.min: float = math.inf
+        self.max: float = -math.inf
+        self.hist: np.ndarray = np.zeros(_NUM_BINS, dtype=np.int64)
+        self.recent: np.ndarray = np.empty(_RECENT_SIZE)
+        self.recent_starts: np.ndarray = np.empty(_RECENT_SIZE)
+        self._pending: list = []
+
+    def add(self, record: float, start_time: float):
+        if not self._pending and _span_writer is not None:
+            _unfolded_series.add(self)
+
+        self._pending.append((record, start_time))
+
+        if len(self._pending) == _FOLD_SIZE:
+            self.fold()
+
+    def fold(self):
+        if not self._pending:
+            return
+
+        pending = np.array(self._pending, dtype=np.float64)
+        self._pending = []
+        _unfolded_series.discard(self)
+        records, start_times = pending[:, 0], pending[:, 1]
+
+        if _span_writer is not None:
+            _span_writer.add_batch(self.name, start_times, records)
+
+        indices = (self.count + np.arange(records.size)) % _RECENT_SIZE
+        self.recent[indices] = records
+        self.recent_starts[indices] = start_times
+        np.add.at(self.hist, _get_bins(records), 1)
+        self.count += records.size
+        self.total += float(records.sum())
+        self.min = min(self.min, float(records.min()))
+        self.max = max(self.max, float(records.max()))
+
+    def merge(self, other: 'RecordSeries') -> 'RecordSeries':
+        self.fold()
+        other.fold()
+
+        records = np.concatenate([self.values, other.values])
+        start_times = np.concatenate([self.start_times, other.start_times])
+        indices = np.argsort(start_times, kind='stable')[-_RECENT_SIZE:]
+        num_recent = indices.size
+
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.hist += other.hist
+
+        # the merged ring buffer is stored in order, the next write position is count % _RECENT_SIZE
+        shift = (self.count - num_recent) % _RECENT_SIZE
+        self.recent[:num_recent] = records[indices]
+        self.recent_starts[:num_recent] = start_times[indices]
+        self.recent = np.roll(self.recent, shift)
+        self.recent_starts = np.roll(self.recent_starts, shift)
+
+        return self
+
+    def copy(self) -> 'RecordSeries':
+        return RecordSeries.from_state(self.state(), self.name)
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._ordered(self.recent)
+
+    @property
+    def start_times(self) -> np.ndarray:
+        return self._ordered(self.recent_starts)
+
+    def _ordered(self, arr: np.ndarray) -> np.ndarray:
+        self.fold()
+
+        if self.count <= _RECENT_SIZE:
+            return arr[:self.count].copy()
+        idx = self.count % _RECENT_SIZE
+        return np.concatenate([arr[idx:], arr[:idx]])
+
+    @property
+    def mean(self) -> float:
+        self.fold()
+        return self.total / self.count if self.count else math.nan
+
+    def percentile(self, q: float) -> float:
+        """
+        Approximate percentile (0 <= q <= 100) from the histogram, exact for the min and max records.
+        """
+        self.fold()
+
+        if not self.count:
+            return math.nan
+
+        rank = max(1, math.ceil(q / 100 * self.count))
+        bin_idx = int(np.searchsorted(np.cumsum(self.hist), rank))
+        value = _MIN_TIME * 2 ** ((bin_idx - 0.5) / _BINS_PER_OCTAVE)
+
+        return min(max(value, self.min), self.max)
+
+    def state(self) -> dict:
+        self.fold()
+
+        return dict(
+            count=self.count,
+            total=self.total,
+            min=self.min,
+            max=self.max,
+            hist=self.hist.copy(),
+            recent=self.values,
+            recent_starts=self.start_times,
+        )
+
+    @classmethod
+    def from_state(cls, state: dict, name: str = '') -> 'RecordSeries':
+        series = cls(name)
+        series.count = int(state['count'])
+        series.total = float(state['total'])
+        series.min = float(state['min'])
+        series.max = float(state['max'])
+        series.hist[:] = state['hist']
+
+        recent, recent_starts = state['recent'], state['recent_starts']
+        shift = (series.count - len(recent)) % _RECENT_SIZE
+        series.recent[:len(recent)] = recent
+        series.recent_starts[:len(recent)] = recent_starts
+        series.recent = np.roll(series.recent, shift)
+        series.recent_starts = np.roll(series.recent_starts, shift)
+
+        return series
+
+    @classmethod
+    def from_records(cls, records, start_times=None, name: str = '') -> 'RecordSeries':
+        series = cls(name)
+
+        if start_times is None:
+            start_times = [math.nan] * len(records)
+
+        series._pending = list(zip(records, start_times))
+        series.fold()
+
+        return series
+
+
+class SpanWriter(object):
+    """
+    Buffers the (record name, start time, duration) spans of a process in preallocated arrays
+    and appends them to a columnar h5 file when the buffer is full or every flush_interval seconds.
+    Start times are perf_counter values, the 'time_offset' attribute converts them to unix time.
+    """
+
+    def __init__(self,
+                 path: str or Path,
+                 process_name: str = '',
+                 buffer_size: int = _SPAN_BUFFER_SIZE,
+                 flush_interval: float = _SPAN_FLUSH_INTERVAL,
+                 ):
+        self.path = Path(path)
+        self.process_name = process_name
+        self.flush_interval = flush_interval
+        self.num_rows: int = 0
+
+        self._names: Dict[str, int] = {}
+        self._name_ids = np.empty(buffer_size, dtype=np.int32)
+        self._start_times = np.empty(buffer_size, dtype=np.float64)
+        self._durations = np.empty(buffer_size, dtype=np.float64)
+        self._size: int = 0
+        self._last_flush: float = perf_counter()
+
+    def add_batch(self, name: str, start_times: np.ndarray, durations: np.ndarray):
+        name_id = self._names.get(name)
+
+        if name_id is None:
+            name_id = self._names[name] = len(self._names)
+
+        while len(durations):
+            num = min(len(durations), self._durations.size - self._size)
+            self._name_ids[self._size:self._size + num] = name_id
+            self._start_times[self._size:self._size + num] = start_times[:num]
+            self._durations[self._size:self._size + num] = durations[:num]
+            self._size += num
+            start_times, durations = start_times[num:], durations[num:]
+
+            if self._size == self._durations.size or perf_counter() - self._last_flush > self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        import h5py
+
+        self._last_flush = perf_counter()
+        size, self._size = self._size, 0
+
+        if not size and self.path.is_file():
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with h5py.File(str(self.path), 'a') as f:
+            f.attrs['pid'] = os.getpid()
+            f.attrs['process_name'] = self.process_name
+            f.attrs['time_offset'] = time() - perf_counter()
+
+            for key, arr in (
+                    ('name_id', self._name_ids),
+                    ('start_time', self._start_times),
+                    ('duration', self._durations),
+            ):
+                if key not in f:
+                    f.create_dataset(key, shape=(0,), maxshape=(None,), dtype=arr.dtype, chunks=(_SPAN_BUFFER_SIZE,))
+                dset = f[key]
+                dset.resize((self.num_rows + size,))
+                dset[self.num_rows:] = arr[:size]
+
+            if 'names' in f:
+                del f['names']
+            f.create_dataset('names', data=list(self._names.keys()), dtype=h5py.string_dtype())
+
+        self.num_rows += size
+
+
+def export_spans(path: str or Path, process_name: str = '') -> SpanWriter:
+    """
+    Streams all the records of the current process to a columnar h5 file.
+    """
+    global _span_writer
+
+    if _span_writer is None:
+        atexit.register(stop_span_export)
+
+    _span_writer = SpanWriter(path, process_name)
+    return _span_writer
+
+
+def flush_spans():
+    """
+    Passes the pending records of all the series to the span writer and writes its buffer.
+    """
+    while _unfolded_series:
+        _unfolded_series.pop().fold()
+
+    if _span_writer is not None:
+        _span_writer.flush()
+
+
+def stop_span_export():
+    global _span_writer
+    flush_spans()
+
+    if _span_writer is not None:
+        atexit.unregister(stop_span_export)
+
+    _span_writer = None
+
+
+def _reset_span_writer():
+    # a forked process does not write the spans buffered by its parent
+    global _span_writer
+    _span_writer = None
+    _unfolded_series.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_span_writer)
+
+
 class TimeRecorder(object):
-    def __init__(self, name: str, no_record: bool = False, records: dict = None, start_times: dict = None):
+    def __init__(self,
+                 name: str,
+                 no_record: bool = False,
+                 records: dict = None,
+                 start_times: dict = None,
+                 series: dict = None,
+                 ):
         self.name = name
         self.no_record = no_record
-        self.records = defaultdict(list)
-        self.start_times = defaultdict(list)
+        self.series: Dict[str, RecordSeries] = {}
         self._start_time = None
         self._record_name = ''
 
+        if series:
+            self.series.update({k: RecordSeries.from_state(v, k) for k, v in series.items()})
+
         if records:
-            self.records.update(records)
+            # records saved by the previous list-based version
+            start_times = start_times or {}
+            self.series.update({
+                k: RecordSeries.from_records(v, start_times.get(k), k) for k, v in records.items()
+            })
 
-        if start_times:
-            self.start_times.update(start_times)
+    @property
+    def records(self) -> Dict[str, np.ndarray]:
+        return {k: s.values for k, s in self.series.items()}
+
+    @property
+    def start_times(self) -> Dict[str, np.ndarray]:
+        return {k: s.start_times for k, s in self.series.items()}
 
     def iterate(self, iterator, name: str = ''):
         if self.no_record:
@@ -66,12 +387,27 @@ class TimeRecorder(object):
         except TypeError:
             raise TypeError(f'Have to call start_record before calling end_record.')
 
-        name = self._get_record_name(name)
-
-        self.records[name].append(record)
-        self.start_times[name].append(self._start_time)
+        self._add(self._get_record_name(name), record, self._start_time)
         self.clear_record()
 
+    @_ignore_if_no_record
+    def add_record(self, name: str, record: float, start_time: float = None):
+        """
+        Adds an externally measured duration (e.g. a queueing delay measured across processes).
+        """
+        if start_time is None:
+            start_time = perf_counter() - record
+
+        self._add(_join_names(self.name, name), record, start_time)
+
+    def _add(self, name: str, record: float, start_time: float):
+        series = self.series.get(name)
+
+        if series is None:
+            series = self.series[name] = RecordSeries(name)
+
+        series.add(record, start_time)
+
     def _get_record_name(self, end_name: str = ''):
         names = [self.name]
         if self._record_name:
@@ -87,55 +423,106 @@ class TimeRecorder(object):
         self._record_name = ''
 
     def clear(self):
-        self.records.clear()
+        self.series.clear()
         self.clear_record()
 
     def __iadd__(self, other: 'TimeRecorder'):
         if not isinstance(other, TimeRecorder):
             return NotImplemented
 
-        _add_records(self.records, other.records)
-        _add_records(self.start_times, other.start_times)
+        _merge_series(self.series, other.series)
 
         return self
 
     def __add__(self, other: 'TimeRecorder'):
         if not isinstance(other, TimeRecorder):
             return NotImplemented
-        records = _add_records(self.records.copy(), other.records)
-        start_times = _add_records(self.start_times.copy(), other.start_times)
 
-        return TimeRecorder(self.name, self.no_record, records=dict(records), start_times=dict(start_times))
+        time_recorder = TimeRecorder(self.name, self.no_record)
+        _merge_series(time_recorder.series, self.series)
+        _merge_series(time_recorder.series, other.series)
+
+        return time_recorder
 
     def asdict(self):
         return dict(
             name=self.name,
             no_record=self.no_record,
-            records=dict(self.records),
-            start_times=dict(self.start_times)
+            series={k: s.state() for k, s in self.series.items()},
         )
 
     def save(self, path: str or Path):
-        save(self.asdict(), path)
+        """
+        Saves the statistics of all record names as columns of an npz file.
+        """
+        names = sorted(self.series.keys())
+        states = [self.series[k].state() for k in names]
+        recent = np.full((len(names), _RECENT_SIZE), np.nan)
+        recent_starts = np.full((len(names), _RECENT_SIZE), np.nan)
+
+        for i, state in enumerate(states):
+            recent[i, :len(state['recent'])] = state['recent']
+            recent_starts[i, :len(state['recent_starts'])] = state['recent_starts']
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        with open(str(path), 'wb') as f:
+            np.savez(
+                f,
+                name=np.array(self.name),
+                record_names=np.array(names, dtype=str),
+                count=np.array([s['count'] for s in states], dtype=np.int64),
+                total=np.array([s['total'] for s in states]),
+                min=np.array([s['min'] for s in states]),
+                max=np.array([s['max'] for s in states]),
+                hist=np.array([s['hist'] for s in states], dtype=np.int64).reshape(-1, _NUM_BINS),
+                recent=recent,
+                recent_starts=recent_starts,
+            )
 
     @classmethod
     def load(cls, path: str or Path):
-        return cls(**load(path))
+        if Path(path).suffix == '.pt':
+            # files saved by the previous list-based version
+            from torch import load
+            return cls(**load(path))
+
+        with np.load(str(path)) as f:
+            series = {}
+
+            for i, k in enumerate(f['record_names']):
+                num_recent = min(int(f['count'][i]), _RECENT_SIZE)
+                series[str(k)] = dict(
+                    count=f['count'][i],
+                    total=f['total'][i],
+                    min=f['min'][i],
+                    max=f['max'][i],
+                    hist=f['hist'][i],
+                    recent=f['recent'][i, :num_recent],
+                    recent_starts=f['recent_starts'][i, :num_recent],
+                )
+
+            return cls(str(f['name']), series=series)
 
     def mean_records(self, reduce: bool = False, reduce_func: Callable = None):
-        return self._apply(mean, reduce, reduce_func)
+        return self._apply(lambda s: s.mean, reduce, reduce_func or mean)
 
     def total_records(self, reduce: bool = False, reduce_func: Callable = None):
-        return self._apply(sum, reduce, reduce_func)
+        return self._apply(lambda s: s.total, reduce, reduce_func or sum)
 
     def num_records(self, reduce: bool = False, reduce_func: Callable = None):
-        return self._apply(len, reduce, reduce_func)
+        return self._apply(lambda s: s.count, reduce, reduce_func or len)
+
+    def percentile_records(self, q: float, reduce: bool = False, reduce_func: Callable = None):
+        return self._apply(lambda s: s.percentile(q), reduce, reduce_func or max)
 
     def _apply(self, func: Callable, reduce: bool = False, reduce_func: Callable = None):
-        res = {keys: func(records) for keys, records in self.records.items()}
+        for series in self.series.values():
+            series.fold()
+
+        res = {keys: func(series) for keys, series in self.series.items()}
 
         if reduce:
-            reduce_func = reduce_func or func
             res = reduce_func(list(res.values()))
         return res
 
@@ -154,12 +541,20 @@ class TimeRecorder(object):
         total_records = self.total_records()
         mean_records = self.mean_records()
         num_records = self.num_records()
+        median_records = self.percentile_records(50)
+        p99_records = self.percentile_records(99)
 
-        heads = ['', 'Num records', 'Mean (s)', 'Total (s)']
-        keys = sorted(self.records.keys())
+        heads = ['', 'Num records', 'Mean (s)', 'Median (s)', 'P99 (s)', 'Total (s)']
+        keys = sorted(self.series.keys())
 
         table = [heads] + [
-            [k, str(num_records[k]), '{:.2e}'.format(mean_records[k]), '{:.2e}'.format(total_records[k])]
+            [
+                k, str(num_records[k]),
+                '{:.2e}'.format(mean_records[k]),
+                '{:.2e}'.format(median_records[k]),
+                '{:.2e}'.format(p99_records[k]),
+                '{:.2e}'.format(total_records[k]),
+            ]
             for k in keys
         ]
 
@@ -174,10 +569,19 @@ def _join_names(*names):
     return '/'.join(names)
 
 
-def _add_records(records, other_records):
-    for k, v in other_records.items():
-        records[k].extend(v)
-    return records
+def _get_bins(records: np.ndarray) -> np.ndarray:
+    bins = np.log2(np.maximum(records, _MIN_TIME) / _MIN_TIME) * _BINS_PER_OCTAVE + 1
+    bins[records < _MIN_TIME] = 0
+    return np.minimum(bins.astype(np.int64), _NUM_BINS - 1)
+
+
+def _merge_series(series: Dict[str, RecordSeries], other_series: Dict[str, RecordSeries]):
+    for k, v in other_series.items():
+        if k in series:
+            series[k].merge(v)
+        else:
+            series[k] = v.copy()
+    return series
 
 
 def _get_table_str(table):
@@ -0,0 +1,112 @@
+import json
+import logging
+from argparse import ArgumentParser
+from typing import List, Iterable
+from pathlib import Path
+
+import numpy as np
+import h5py
+
+__all__ = [
+    'export_chrome_trace',
+    'get_trace_events',
+    'load_spans',
+]
+
+
+def load_spans(path: str or Path) -> dict:
+    """
+    Reads a span file written by time_record.SpanWriter.
+    Returns pid, process_name, record names and start times (unix time, s) and durations (s) of the spans.
+    """
+    with h5py.File(str(path), 'r') as f:
+        names = [n.decode() if isinstance(n, bytes) else str(n) for n in f['names'][()]]
+
+        return dict(
+            pid=int(f.attrs['pid']),
+            process_name=str(f.attrs['process_name']),
+            names=np.array(names, dtype=object)[f['name_id'][()]],
+            start_times=f['start_time'][()] + float(f.attrs['time_offset']),
+            durations=f['duration'][()],
+        )
+
+
+def get_trace_events(paths: Iterable[str or Path], min_duration: float = 0.) -> List[dict]:
+    """
+    Converts span files to Chrome trace events: a process per worker (labelled by method name and pid)
+    and a thread per time recorder, so nested records of different recorders do not overlap on a track.
+    """
+    spans = [load_spans(path) for path in paths]
+    spans = [s for s in spans if s['durations'].size]
+
+    if not spans:
+        return []
+
+    t0 = min(s['start_times'].min() for s in spans)
+    events = []
+
+    for s in spans:
+        pid = s['pid']
+        events.append(dict(ph='M', name='process_name', pid=pid, tid=0, args=dict(name=f'{s["process_name"]} ({pid})')))
+
+        recorders = {}
+
+        for name, start, duration in zip(s['names'], s['start_times'], s['durations']):
+            if duration < min_duration:
+                continue
+
+            recorder = name.split('/')[0]
+
+            if recorder not in recorders:
+                recorders[recorder] = len(recorders)
+                events.append(dict(ph='M', name='thread_name', pid=pid, tid=recorders[recorder],
+                                   args=dict(name=recorder)))
+
+            events.append(dict(
+                ph='X',
+                name=name,
+                cat=recorder,
+                pid=pid,
+                tid=recorders[recorder],
+                ts=(start - t0) * 1e6,
+                dur=duration * 1e6,
+            ))
+
+    return events
+
+
+def export_chrome_trace(paths: Iterable[str or Path], output: str or Path, min_duration: float = 0.) -> Path:
+    """
+    Writes the spans of all the span files (or folders with span files) to a Chrome trace json file,
+    which can be opened with chrome://tracing or https://ui.perfetto.dev.
+    """
+    files = []
+
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob('*.h5')) if path.is_dir() else [path])
+
+    events = get_trace_events(files, min_duration)
+    output = Path(output)
+
+    with open(str(output), 'w') as f:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+    logging.getLogger(__name__).info(f'Saved {len(events)} trace events from {len(files)} files to {output}')
+
+    return output
+
+
+def main():
+    parser = ArgumentParser(description='Convert gixi time record spans to a Chrome trace json file')
+    parser.add_argument('paths', type=str, nargs='+', help='Span folders (time_records/spans_<job id>) or files')
+    parser.add_argument('-o', '--output', type=str, default='trace.json', help='Output json file')
+    parser.add_argument('--min-duration', type=float, default=0., help='Skip spans shorter than this (s)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    export_chrome_trace(args.paths, args.output, args.min_duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import pytest
+
+from gixi.server.app_config import AppConfig, ClusterConfig
+from gixi.server.servers.distributed import get_node_info
+
+
+def test_node_info_from_slurm(monkeypatch):
+    monkeypatch.setenv('SLURM_NTASKS', '4')
+    monkeypatch.setenv('SLURM_PROCID', '2')
+    monkeypatch.setenv('SLURM_JOB_ID', '17')
+
+    node = get_node_info(AppConfig(cluster_config=ClusterConfig(nodes=4)))
+
+    assert (node.rank, node.num_nodes, node.job_id) == (2, 4, '17')
+    assert [node.owns_batch(i, '') for i in range(4)] == [False, False, True, False]
+
+
+@pytest.mark.parametrize('nodes', [1, 2])
+def test_surplus_task_raises(monkeypatch, nodes):
+    monkeypatch.setenv('SLURM_NTASKS', '4')
+    monkeypatch.setenv('SLURM_PROCID', '2')
+
+    with pytest.raises(ValueError):
+        get_node_info(AppConfig(cluster_config=ClusterConfig(nodes=nodes)))
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+
+from gixi.server.matching.match_patterns import get_match_metrics, match_1d, match_1d_truncated, match_batch
+
+
+def random_peaks(rng, max_peaks: int = 40, decimals: int = None):
+    num_sim, num_exp = rng.integers(1, max_peaks, 2)
+    sim_qs, exp_qs = rng.uniform(0, 3, num_sim), rng.uniform(0, 3, num_exp)
+
+    if decimals is not None:
+        # equal positions
+        sim_qs, exp_qs = sim_qs.round(decimals), exp_qs.round(decimals)
+
+    return sim_qs, exp_qs, rng.uniform(0.1, 1, num_sim)
+
+
+@pytest.mark.parametrize('max_distance', [0.01, 0.1, 0.5])
+def test_match_1d_as_linear_sum_assignment(max_distance):
+    rng = np.random.default_rng(0)
+
+    for _ in range(500):
+        sim_qs, exp_qs, _ = random_peaks(rng)
+        distances = np.abs(sim_qs[:, None] - exp_qs[None])
+        rows, cols = linear_sum_assignment(distances)
+
+        # the full matching has the minimal total distance
+        sim_idx, exp_idx = match_1d(sim_qs, exp_qs, np.inf)
+        assert sim_idx.size == min(sim_qs.size, exp_qs.size)
+        assert np.unique(sim_idx).size == sim_idx.size and np.unique(exp_idx).size == exp_idx.size
+        assert distances[sim_idx, exp_idx].sum() == pytest.approx(distances[rows, cols].sum())
+
+        # of the equally short matchings, the one with most close pairs is kept
+        sim_idx, exp_idx = match_1d(sim_qs, exp_qs, max_distance)
+        assert np.all(distances[sim_idx, exp_idx] < max_distance)
+        assert sim_idx.size >= np.count_nonzero(distances[rows, cols] < max_distance)
+
+
+def test_match_1d_with_equal_positions():
+    rng = np.random.default_rng(2)
+
+    for _ in range(500):
+        sim_qs, exp_qs, _ = random_peaks(rng, decimals=1)
+        distances = np.abs(sim_qs[:, None] - exp_qs[None])
+        rows, cols = linear_sum_assignment(distances)
+        sim_idx, exp_idx = match_1d(sim_qs, exp_qs, np.inf)
+        assert sim_idx.size == min(sim_qs.size, exp_qs.size)
+        assert np.unique(sim_idx).size == sim_idx.size and np.unique(exp_idx).size == exp_idx.size
+        assert distances[sim_idx, exp_idx].sum() == pytest.approx(distances[rows, cols].sum())
+
+
+def test_match_batch_as_match_metrics():
+    rng = np.random.default_rng(1)
+    max_distance = 0.1
+    sizes = rng.integers(1, 60, 30)
+    sim_phases = np.repeat(np.arange(sizes.size), sizes)
+    sim_qs = rng.uniform(0, 3, sim_phases.size)
+    intensities = rng.uniform(0.1, 1, sim_phases.size)
+    exp_qs_list = [rng.uniform(0, 3, n) for n in (0, 1, 5, 20, 50)]
+
+    results = match_batch(sim_qs, sim_phases, intensities, exp_qs_list, max_distance)
+
+    for frame, exp_qs in enumerate(exp_qs_list):
+        start, end = results.pair_offsets[frame], results.pair_offsets[frame + 1]
+
+        for phase in range(sizes.size):
+            in_phase = sim_phases == phase
+            pairs = results.phase_ids[start:end] == phase
+
+            if not exp_qs.size:
+                assert results.metrics[phase, frame] == 0 and not pairs.any()
+                continue
+
+            metric, sim_idx, exp_idx = get_match_metrics(
+                sim_qs[in_phase], exp_qs, intensities[in_phase], max_distance
+            )
+
+            assert results.metrics[phase, frame] == pytest.approx(metric)
+            np.testing.assert_array_equal(results.sim_idx[start:end][pairs], sim_idx)
+            np.testing.assert_array_equal(results.exp_idx[start:end][pairs], exp_idx)
+
+
+def test_truncated_matching_maximizes_truncated_score():
+    rng = np.random.default_rng(2)
+
+    for _ in range(500):
+        sim_qs, exp_qs, _ = random_peaks(rng)
+        max_distance = rng.uniform(0.01, 0.3)
+        sim_idx, exp_idx = match_1d_truncated(sim_qs, exp_qs, max_distance)
+
+        scores = np.maximum(max_distance - np.abs(sim_qs[:, None] - exp_qs[None]), 0)
+        rows, cols = linear_sum_assignment(-scores)
+
+        assert scores[sim_idx, exp_idx].sum() == pytest.approx(scores[rows, cols].sum())
+        assert np.unique(sim_idx).size == sim_idx.size and np.unique(exp_idx).size == exp_idx.size
+        assert np.all(np.abs(sim_qs[sim_idx] - exp_qs[exp_idx]) < max_distance)
@@ -0,0 +1,78 @@
+import numpy
+import pytest
+
+from gixi.server.matching.simulate_diffraction_peaks import _merge_lines
+
+
+def _merge_lines_loop(data):
+    """
+    Reference implementation of _merge_lines, merges the lines of the sorted array one by one.
+    """
+    data.sort(order=['q', 'hkl'])
+    qpos = []
+    refstrength = []
+    hkl = []
+
+    def add_lines(q, ref, chkl):
+        for R, m in zip(ref, chkl):
+            qpos.append(q)
+            refstrength.append(R)
+            hkl.append(m)
+
+    currq = -1
+    curref = []
+    currhkl = []
+
+    for r in data:
+        if not numpy.isclose(r[0] - currq, 0):
+            add_lines(currq, curref, currhkl)
+            currq = r[0]
+            curref = [r[1], ]
+            currhkl = [r[2], ]
+        else:
+            curref[-1] += r[1]
+            currhkl[-1] = r[2]
+    # add remaining lines
+    add_lines(currq, curref, currhkl)
+
+    qpos = numpy.array(qpos, dtype=numpy.double)
+    refstrength = numpy.array(refstrength, dtype=numpy.double)
+    return hkl, qpos, refstrength
+
+
+def random_lines(rng, num_lines: int, chain_step: float = None):
+    """
+    Random lines with repeated q-positions. With chain_step, some lines are followed by chains of lines
+    chain_step apart, which span more than the merge tolerance.
+    """
+    q = rng.choice(rng.uniform(0.5, 4, max(1, num_lines // 3)), num_lines)
+
+    if chain_step is not None:
+        chains = rng.random(num_lines) < 0.3
+        q[chains] += rng.integers(1, 5, chains.sum()) * chain_step
+
+    data = numpy.zeros(num_lines, dtype=[('q', numpy.double), ('r', numpy.double), ('hkl', numpy.ndarray)])
+    data['q'] = q
+    data['r'] = rng.uniform(0, 100, num_lines)
+    data['hkl'] = [tuple(hkl) for hkl in rng.integers(-5, 6, (num_lines, 3))]
+    return data
+
+
+@pytest.mark.parametrize('chain_step', [None, 0.4e-8, 0.7e-8, 2e-8])
+def test_merge_lines_as_loop(chain_step):
+    rng = numpy.random.default_rng(0)
+
+    for num_lines in list(range(1, 30)) * 10 + [500, 2000]:
+        data = random_lines(rng, num_lines, chain_step)
+        hkl, qpos, refstrength = _merge_lines(data.copy())
+        ref_hkl, ref_qpos, ref_refstrength = _merge_lines_loop(data.copy())
+
+        assert hkl == ref_hkl
+        numpy.testing.assert_array_equal(qpos, ref_qpos)
+        numpy.testing.assert_array_equal(refstrength, ref_refstrength)
+
+
+def test_merge_lines_empty():
+    data = numpy.zeros(0, dtype=[('q', numpy.double), ('r', numpy.double), ('hkl', numpy.ndarray)])
+    hkl, qpos, refstrength = _merge_lines(data)
+    assert hkl == [] and qpos.size == 0 and refstrength.size == 0
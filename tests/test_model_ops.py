@@ -0,0 +1,26 @@
+import torch
+
+from gixi.server.bench.model_ops import get_environment_info, get_op_cases, is_same_environment
+
+
+@torch.no_grad()
+def test_op_cases_run():
+    cases = get_op_cases(batch_sizes=(2,), box_counts=(10,))
+
+    assert {case.name for case in cases} == {
+        'FixedAnchorsGenerator', 'get_top_n_idx', 'decode_boxes', 'FilterProposals', 'batched_nms', 'FilterRois',
+        'RoiAlign',
+    }
+
+    for case in cases:
+        case.func(**case.inputs())
+
+
+def test_regressions_only_fail_in_the_same_environment():
+    environment = get_environment_info(1)
+
+    assert is_same_environment(dict(environment), environment)
+    assert is_same_environment(dict(environment, python='2.7'), environment)
+    assert not is_same_environment(dict(environment, threads=4), environment)
+    assert not is_same_environment(dict(environment, processor='other'), environment)
+    assert not is_same_environment(None, environment)
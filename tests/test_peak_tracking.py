@@ -0,0 +1,42 @@
+import h5py
+import numpy as np
+
+from gixi.server.app_config import AppConfig, JobConfig, TrackingConfig
+from gixi.server.peak_tracking import PeakTracker
+
+
+def add_frames(tracker: PeakTracker, frame_ids):
+    for frame_idx in frame_ids:
+        boxes = np.array([[0.1, 0.1, 0.2, 0.2], [0.5, 0.5, 0.6, 0.6]])
+        tracker.add(dict(boxes=boxes, frame_idx=frame_idx, prev_frame_idx=frame_idx - 1), f'img_{frame_idx}')
+
+
+def test_resumed_tracking_appends_tracks(tmp_path):
+    config = AppConfig()
+    path = tmp_path / 'tracks.h5'
+
+    tracker = PeakTracker(config, path)
+    add_frames(tracker, range(3))
+    tracker.close()
+
+    tracker = PeakTracker(AppConfig(job_config=JobConfig(resume=True, rewrite_previous=True)), path)
+    add_frames(tracker, range(5, 7))
+    tracker.close()
+
+    with h5py.File(path, 'r') as f:
+        np.testing.assert_array_equal(f['frames/frame_idx'][()], [0, 1, 2, 5, 6])
+        np.testing.assert_array_equal(f['tracks/frame_idx'][()], np.repeat([0, 1, 2, 5, 6], 2))
+        np.testing.assert_array_equal(f['tracks/track_id'][()], [0, 1] * 3 + [2, 3] * 2)
+
+
+def test_lost_frame_does_not_hold_back_tracking(tmp_path):
+    config = AppConfig(tracking_config=TrackingConfig(max_frame_lag=4))
+    tracker = PeakTracker(config, tmp_path / 'tracks.h5')
+
+    # frame 2 fails processing and never arrives
+    add_frames(tracker, [0, 1, 3, 4, 5, 6])
+    assert tracker._last_frame_idx == 1
+
+    add_frames(tracker, [7, 8])
+    assert tracker._last_frame_idx == 8
+    tracker.close()
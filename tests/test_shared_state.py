@@ -0,0 +1,33 @@
+from pathlib import Path
+
+import numpy as np
+
+from gixi.server.app_config import AppConfig, MatchingConfig
+from gixi.server.matching import MatchDiffractionPatterns
+from gixi.server.servers.shared_state import SharedArrays, attach_shared_arrays
+
+
+def test_matching_with_shared_phases(monkeypatch):
+    rng = np.random.default_rng(0)
+    sim_results = [
+        (f'phase_{i}', Path(f'/cif/phase_{i}.cif'), np.sort(rng.uniform(0, 3, n)), rng.uniform(0.1, 1, n), None)
+        for i, n in enumerate([5, 20, 1, 40])
+    ]
+    monkeypatch.setattr(MatchDiffractionPatterns, '_simulate_peaks', lambda self: sim_results)
+
+    config = AppConfig(match_config=MatchingConfig(use_sim_cache=False))
+    matching = MatchDiffractionPatterns(config)
+    shared = SharedArrays(matching.phase_arrays)
+
+    try:
+        shared_matching = MatchDiffractionPatterns(config, phase_arrays=attach_shared_arrays(shared.spec))
+        boxes = rng.uniform(0, 1, (30, 4))
+        expected, data_dict = matching(dict(boxes=boxes)), shared_matching(dict(boxes=boxes))
+
+        for key in ('names', 'metric', 'pairs'):
+            np.testing.assert_array_equal(data_dict['matching_table'][key], expected['matching_table'][key])
+
+        assert data_dict['matching_results'].keys() == expected['matching_results'].keys()
+        assert data_dict['matching_results']['phase_1']['path'] == '/cif/phase_1.cif'
+    finally:
+        shared.close()